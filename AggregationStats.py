@@ -0,0 +1,135 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: AggregationStats.py
+@time: 10/18/26 11:23
+"""
+import warnings
+
+import numpy as np
+
+ARCSINH_COFACTOR = 5  # the usual cofactor of CyTOF intensities
+TRIM_PROPORTION = 0.1  # the share of subjects cut from each end by trimmed_mean
+STATISTICS = {}  # name: aggregation function, see register_statistic
+
+
+def register_statistic(name, function=None):
+    """
+    add an aggregation statistic, can be used as a decorator
+    the function reduces the last (subject) axis of a whole (data tag 1, ..., data tag n, subject) block in one call,
+    function(values, has_nan) -> numpy array of shape (data tag 1, ..., data tag n), has_nan is True when some subjects
+    miss some points (merged or appended files), those nan values are left out
+    e.g. register_statistic('trimmed_mean_20', functools.partial(trimmed_mean, proportion=0.2))
+    :param name: the name the statistic is selected by, e.g. DataAnalysis(statistic='median')
+    :param function: the aggregation function
+    """
+    if function is None:
+        return lambda decorated: register_statistic(name, decorated)
+    STATISTICS[name] = function
+    return function
+
+
+def get_statistic(name, streaming=False):
+    """
+    :param name: a registered statistic
+    :param streaming: the statistic is needed from the running aggregates of a streaming reader, only the mean can be
+    :return: the aggregation function
+    """
+    if name not in STATISTICS:
+        raise ValueError(f'unknown statistic {name}, use one of {list(STATISTICS)}')
+    if streaming and name != 'mean':
+        raise ValueError(f'the {name} statistic needs the raw data, only the mean is available in streaming mode')
+    return STATISTICS[name]
+
+
+@register_statistic('mean')
+def mean(values, has_nan=False):
+    if not has_nan:
+        return np.mean(values, axis=-1)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        return np.nanmean(values, axis=-1)
+
+
+def nan_quantiles(values, quantiles):
+    """
+    quantiles along the last axis ignoring nan, linear interpolation like np.quantile, without the python loop of
+    np.nanquantile
+    :param values: numpy array of shape (point, subject or resample)
+    :param quantiles: a list of quantiles in [0, 1]
+    :return: numpy array of shape (quantile, point), nan where a point has no value
+    """
+    values = np.sort(values, axis=-1)  # nan is sorted to the end
+    valid_num = np.count_nonzero(~np.isnan(values), axis=-1)
+    result = []
+    for quantile in quantiles:
+        position = quantile * np.maximum(valid_num - 1, 0)
+        low = np.floor(position).astype(np.int64)
+        high = np.minimum(low + 1, np.maximum(valid_num - 1, 0))
+        low_value = np.take_along_axis(values, low[:, None], axis=-1)[:, 0]
+        high_value = np.take_along_axis(values, high[:, None], axis=-1)[:, 0]
+        result.append(np.where(valid_num > 0, low_value + (position - low) * (high_value - low_value), np.nan))
+    return np.stack(result)
+
+
+def quantile(values, q, has_nan=False):
+    """
+    quantile along the last axis with linear interpolation like np.quantile
+    the values are only partitioned around the two positions that are needed, not sorted, the positions differ per
+    point when subjects miss values, so then the subject axis is sorted
+    :param values: numpy array of shape (..., subject)
+    :param q: the quantile in [0, 1]
+    :param has_nan: some values are nan, they are left out
+    :return: numpy array of shape (...)
+    """
+    subject_num = values.shape[-1]
+    if has_nan:
+        return nan_quantiles(values.reshape(-1, subject_num), [q])[0].reshape(values.shape[:-1])
+    if subject_num == 0:
+        return np.full(values.shape[:-1], np.nan)
+    position = q * (subject_num - 1)
+    low = int(np.floor(position))
+    high = min(low + 1, subject_num - 1)
+    partitioned = np.partition(values, sorted({low, high}), axis=-1)
+    return partitioned[..., low] + (position - low) * (partitioned[..., high] - partitioned[..., low])
+
+
+@register_statistic('median')
+def median(values, has_nan=False):
+    return quantile(values, 0.5, has_nan)
+
+
+@register_statistic('trimmed_mean')
+def trimmed_mean(values, has_nan=False, proportion=TRIM_PROPORTION):
+    """
+    mean without the int(proportion * subjects) smallest and largest values of every point, like
+    scipy.stats.trim_mean
+    """
+    if not 0 <= proportion < 0.5:
+        raise ValueError(f'proportion has to be in [0, 0.5), got {proportion}')
+    subject_num = values.shape[-1]
+    if not has_nan:
+        cut = int(proportion * subject_num)
+        if cut == 0:
+            return mean(values)
+        #  everything between the two partition points is the middle of the values
+        partitioned = np.partition(values, (cut, subject_num - cut - 1), axis=-1)
+        return np.mean(partitioned[..., cut:subject_num - cut], axis=-1)
+    #  the cut differs per point, the trimmed sums are differences of the cumulative sums of the sorted values
+    values = np.sort(values, axis=-1)  # nan is sorted to the end
+    valid_num = np.count_nonzero(~np.isnan(values), axis=-1)
+    cut = (proportion * valid_num).astype(np.int64)
+    cumulative = np.concatenate([np.zeros(values.shape[:-1] + (1,)), np.cumsum(np.nan_to_num(values), axis=-1)],
+                                axis=-1)
+    trimmed_sum = (np.take_along_axis(cumulative, (valid_num - cut)[..., None], axis=-1)[..., 0] -
+                   np.take_along_axis(cumulative, cut[..., None], axis=-1)[..., 0])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(valid_num > 0, trimmed_sum / (valid_num - 2 * cut), np.nan)
+
+
+@register_statistic('arcsinh_mean')
+def arcsinh_mean(values, has_nan=False, cofactor=ARCSINH_COFACTOR):
+    """
+    mean of the arcsinh(value / cofactor) transformed intensities
+    """
+    return mean(np.arcsinh(values / cofactor), has_nan)
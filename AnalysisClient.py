@@ -0,0 +1,87 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: AnalysisClient.py
+@time: 10/18/26 11:20
+"""
+import builtins
+import socket
+
+from AnalysisProtocol import DEFAULT_SOCKET, from_wire, pack_message, read_message
+from DataReaderCsv import DataReaderCsv
+
+
+class AnalysisClient:
+    """
+    thin client of AnalysisServer with the signatures of DataAnalysis, the dataset is loaded by the server once and
+    shared by every client, e.g.
+    client = AnalysisClient(file_path='MiceCYTOF.csv')
+    surface_data, x, y = client.get_surface_data(0, 'Naïve', 'percent_from_control')
+    """
+
+    def __init__(self, control_group='Naïve', streaming=False, file_path=None, row_tag_num=DataReaderCsv.ROW_TAG_NUM,
+                 data_tag_names=None, socket_path=DEFAULT_SOCKET, host=None, port=None, binary=True, timeout=None):
+        """
+        :param control_group, streaming, file_path, row_tag_num, data_tag_names: the dataset, see DataAnalysis
+        :param socket_path: the unix socket of the server, used when port is None
+        :param host: the host of the tcp server, 127.0.0.1 by default, only used with port
+        :param port: the tcp port of the server
+        :param binary: send arrays as raw bytes, False to get them as json lists (nan is null, ±inf is
+        {'__float__': 'inf'})
+        :param timeout: seconds to wait for an answer, None to wait as long as it takes
+        """
+        self.dataset = {'file_path': file_path, 'control_group': control_group, 'streaming': streaming,
+                        'row_tag_num': row_tag_num, 'data_tag_names': data_tag_names}
+        self.binary = binary
+        if port is None:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(timeout)
+            self.sock.connect(socket_path)
+        else:
+            self.sock = socket.create_connection((host or '127.0.0.1', port), timeout=timeout)
+
+    def request(self, method, *args, **kwargs):
+        """
+        send one request and wait for the result
+        :return: the result of the method on the server
+        """
+        self.sock.sendall(pack_message({'dataset': self.dataset, 'method': method, 'args': list(args),
+                                        'kwargs': kwargs, 'binary': self.binary}))
+        response, buffers = read_message(self.sock)
+        if 'error' in response:
+            #  builtin errors such as ValueError and KeyError are raised as themselves
+            error_type = getattr(builtins, response['error'], None)
+            if not (isinstance(error_type, type) and issubclass(error_type, Exception)):
+                error_type = RuntimeError
+            raise error_type(response['message'])
+        return from_wire(response['result'], buffers)
+
+    def get_data(self, data_tag_list, as_array=False):
+        """
+        see DataReaderCsv.get_data, the tags are names, lists of names or 'all', a TagFilter can not be sent
+        """
+        return self.request('get_data', data_tag_list, as_array=as_array)
+
+    def one_column_analysis(self, data_tags, statistic=None):
+        """
+        see DataAnalysis.one_column_analysis
+        """
+        return self.request('one_column_analysis', data_tags, statistic=statistic)
+
+    def get_surface_data(self, all_data_tag_index, surface_name, plot_type, control_group=None, fixed_tags=None,
+                         statistic=None):
+        """
+        see DataAnalysis.get_surface_data
+        :return: surfaced data, x label, y label
+        """
+        return tuple(self.request('get_surface_data', all_data_tag_index, surface_name, plot_type,
+                                  control_group=control_group, fixed_tags=fixed_tags, statistic=statistic))
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
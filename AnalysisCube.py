@@ -0,0 +1,380 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: AnalysisCube.py
+@time: 10/18/26 10:53
+"""
+from collections import OrderedDict
+from itertools import combinations
+
+import numpy as np
+
+
+class AnalysisCube:
+    """
+    array native result of the column analysis, every point of the (group, cell type, marker) cube at once
+    the cube can have more axes, one per extra data tag level, every reduction runs along one axis of the whole array
+    seq is the rank of a point inside its column (the axis that is 'all' in the column tag), 0 is the largest mean,
+    ties are broken the same way as sorting the 'group|cell|marker' keys in reverse
+    """
+
+    CONTROL_CACHE_SIZE = 8  # the number of percent_from_control arrays kept for control groups other than control_group
+
+    def __init__(self, mean, data_mask, all_data_tags, control_group):
+        """
+        :param mean: numpy array of shape (group, cell type, marker, ...), the mean of every point
+        :param data_mask: bool array of shape (cell type, marker, ...), True if the data tags exist in the data
+        :param all_data_tags: [group list, cell type list, marker list, ...]
+        :param control_group: the name of the control group
+        """
+        self.mean = mean
+        self.valid = np.broadcast_to(data_mask, mean.shape)
+        self.all_data_tags = all_data_tags
+        self.control_group = control_group
+        self.tag_index = [{tag: i for i, tag in enumerate(axis)} for axis in all_data_tags]
+        self.control_point = self.get_control_point(control_group)
+        self._seq = {}  # focused axis: rank along that axis
+        #  lru cache of control group: percent_from_control against that group, control_group is never evicted
+        self._percent_from_control = OrderedDict()
+        self.used_control_groups = set()  # every control group percent_from_control was asked against
+        self.point_stats = {}  # name: array of the same shape as mean, added to every point of the columns
+
+    @classmethod
+    def from_reader(cls, data_reader, all_data_tags, control_group, statistic='mean'):
+        """
+        :param statistic: how the subjects of a group are aggregated, see AggregationStats, the cube calls the
+        result mean whatever the statistic is
+        """
+        return cls(data_reader.group_means(statistic), data_reader.data_mask, all_data_tags, control_group)
+
+    def seq(self, axis):
+        """
+        rank of every point along the focused axis
+        :param axis: the index of the focused axis
+        :return: int array of the same shape as mean, -1 where the point does not exist
+        """
+        if axis not in self._seq:
+            self._seq[axis] = self.rank(axis)
+        return self._seq[axis]
+
+    def rank(self, axis, index=None, sub_axis=None):
+        """
+        rank along the focused axis of a part of the cube
+        :param axis: the index of the focused axis
+        :param index: the part of the cube, it has to keep the whole focused axis, the whole cube by default
+        :param sub_axis: the position of the focused axis in mean[index], axis by default
+        :return: int array of the shape of mean[index], -1 where the point does not exist
+        """
+        mean = self.mean if index is None else self.mean[index]
+        valid = self.valid if index is None else self.valid[index]
+        sub_axis = axis if sub_axis is None else sub_axis
+        # tie breaker: rank of the key strings, a tag that is followed by another tag is compared with its '|'
+        suffix = '|' if axis < self.mean.ndim - 1 else ''
+        tags = self.all_data_tags[axis]
+        tag_rank = np.empty(len(tags), dtype=np.int64)
+        tag_rank[sorted(range(len(tags)), key=lambda i: tags[i] + suffix)] = np.arange(len(tags))
+        shape = [1] * mean.ndim
+        shape[sub_axis] = len(tags)
+        tie_key = np.broadcast_to(-tag_rank.reshape(shape), mean.shape)
+        value_key = np.where(valid, -mean, 0)
+        order = np.lexsort((tie_key, value_key, ~valid), axis=sub_axis)
+        seq = np.empty(mean.shape, dtype=np.int64)
+        np.put_along_axis(seq, order, np.arange(len(tags)).reshape(shape), axis=sub_axis)
+        seq[~valid] = -1
+        return seq
+
+    def get_control_point(self, control_group):
+        """
+        :param control_group: the name of the control group
+        :return: bool array, True where the point key contains the control group name, those points get 0
+        percent_from_control
+        """
+        control_point = np.zeros(self.mean.shape, dtype=bool)
+        for axis, tags in enumerate(self.all_data_tags):
+            shape = [1] * self.mean.ndim
+            shape[axis] = len(tags)
+            control_point |= np.array([control_group in tag for tag in tags]).reshape(shape)
+        return control_point
+
+    @property
+    def percent_from_control(self):
+        return self.get_percent_from_control(self.control_group)
+
+    def get_control_mean(self, control_group):
+        """
+        :param control_group: the name of the control group
+        :return: the mean slice of the control group
+        """
+        if control_group not in self.tag_index[0]:
+            raise ValueError(f'control group {control_group} is not in the data')
+        return self.mean[self.tag_index[0][control_group]]
+
+    def get_percent_from_control(self, control_group):
+        """
+        (mean - control mean) / control mean, one broadcasted division against the control group slice
+        :param control_group: the name of the control group
+        :return: numpy array of the same shape as mean
+        """
+        return self.get_percent_from_controls([control_group])[0]
+
+    def get_percent_from_controls(self, control_groups):
+        """
+        percent_from_control against several control groups in one broadcasted division, only the last
+        CONTROL_CACHE_SIZE control groups besides control_group are kept
+        :param control_groups: a list of control group names
+        :return: numpy array of shape (control group, group, cell type, marker)
+        """
+        new_control_groups = [control_group for control_group in dict.fromkeys(control_groups)
+                              if control_group not in self._percent_from_control]
+        if new_control_groups:
+            control_mean = np.stack([self.get_control_mean(control_group) for control_group in new_control_groups])
+            control_mean = np.expand_dims(control_mean, 1)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                percent_from_controls = (self.mean - control_mean) / control_mean
+            for control_group, percent_from_control in zip(new_control_groups, percent_from_controls):
+                percent_from_control[self.get_control_point(control_group)] = 0
+                self._percent_from_control[control_group] = percent_from_control
+        self.used_control_groups.update(control_groups)
+        percent_from_controls = np.stack([self._percent_from_control[control_group]
+                                          for control_group in control_groups])
+        for control_group in control_groups:
+            self._percent_from_control.move_to_end(control_group)
+        evictable = [control_group for control_group in self._percent_from_control
+                     if control_group != self.control_group]
+        for control_group in evictable[:max(0, len(evictable) - self.CONTROL_CACHE_SIZE)]:
+            del self._percent_from_control[control_group]
+        return percent_from_controls
+
+    def add_point_stats(self, point_stats):
+        """
+        add per point results, e.g. the output of Significance.run, they show up in the columns next to mean and seq
+        and can be used as the plot_type of surface
+        :param point_stats: a dict of name: numpy array of the same shape as mean
+        :return: None
+        """
+        for name, values in point_stats.items():
+            if values.shape != self.mean.shape:
+                raise ValueError(f'{name} has shape {values.shape}, expected {self.mean.shape}')
+            self.point_stats[name] = values
+
+    def update_group(self, group_tag, group_mean, data_mask, touched):
+        """
+        update the cube after subjects were appended to one group (DataReaderCsv.append_subjects), only the parts
+        the new subjects can change are recomputed: the mean of the group, the ranks of the touched columns and the
+        percent_from_control of the group, every group only when it is a control group
+        all_data_tags[0] has to list the new group already when the group is new, the arrays are replaced, not
+        written in place, so the surfaces handed out before stay as they were
+        :param group_tag: the group name, a new group is added after the last group
+        :param group_mean: numpy array of shape (cell type, marker, ...), the mean of the group after the append
+        :param data_mask: the data_mask of the reader after the append
+        :param touched: bool array of the shape of data_mask, True where the new subjects have a value
+        :return: a list of (axis, surface name, plot type) of the surfaces that changed, see stale_surfaces
+        """
+        new_group = group_tag not in self.tag_index[0]
+        new_points = data_mask & ~self.valid[0]
+        stale = self.stale_surfaces(group_tag, touched, new_points)
+        if new_group:
+            self.mean = np.concatenate([self.mean, group_mean[None]])
+        else:
+            self.mean = self.mean.copy()
+            self.mean[self.tag_index[0][group_tag]] = group_mean
+        self.valid = np.broadcast_to(data_mask, self.mean.shape)
+        self.tag_index[0] = {tag: i for i, tag in enumerate(self.all_data_tags[0])}
+        group_index = self.tag_index[0][group_tag]
+        if new_group:
+            self.control_point = self.get_control_point(self.control_group)
+        #  ranks along the groups, only the columns with new values are sorted again, a new group changes them all
+        if 0 in self._seq and new_group:
+            del self._seq[0]
+        elif 0 in self._seq:
+            index = (slice(None),) + np.nonzero(touched)
+            self._seq[0] = self._seq[0].copy()
+            self._seq[0][index] = self.rank(0, index, 0)
+        #  ranks along the data tag axes, only the row of the group, every row when a point is new to the data
+        for axis in [axis for axis in self._seq if axis > 0]:
+            if new_points.any():
+                del self._seq[axis]
+                continue
+            row = self.rank(axis, (group_index,), axis - 1)
+            if new_group:
+                self._seq[axis] = np.concatenate([self._seq[axis], row[None]])
+            else:
+                self._seq[axis] = self._seq[axis].copy()
+                self._seq[axis][group_index] = row
+        for control_group in list(self._percent_from_control):
+            if control_group == group_tag:
+                #  the control slice changed, every group is compared against it again
+                del self._percent_from_control[control_group]
+                continue
+            control_mean = self.get_control_mean(control_group)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                row = (group_mean - control_mean) / control_mean
+            row[self.get_control_point(control_group)[group_index]] = 0
+            percent_from_control = self._percent_from_control[control_group]
+            if new_group:
+                self._percent_from_control[control_group] = np.concatenate([percent_from_control, row[None]])
+            else:
+                self._percent_from_control[control_group] = percent_from_control.copy()
+                self._percent_from_control[control_group][group_index] = row
+        #  the point stats were computed from the old subjects
+        self.point_stats = {}
+        return stale
+
+    def stale_surfaces(self, group_tag, touched, new_points):
+        """
+        the surfaces that change when subjects are appended to one group
+        :param group_tag: the group name, it may be new
+        :param touched: bool array of the shape of data_mask, True where the new subjects have a value
+        :param new_points: bool array of the shape of data_mask, True where a point is new to the data
+        :return: a list of (axis, surface name, plot type), for every axis, surface name and plot type (seq, mean,
+        percent_from_control) the new subjects change
+        """
+        new_group = group_tag not in self.tag_index[0]
+        #  an evicted control group can still have surfaces in the surface cache of DataAnalysis
+        control_groups = {self.control_group} | self.used_control_groups
+        valid = self.valid[0] | new_points
+        stale = [(0, group_tag, 'mean')]
+        stale += [(0, name, 'seq') for name in self.all_data_tags[0] if touched.any() or new_group]
+        #  a point new to the data is 0 instead of nan for the control group
+        stale += [(0, name, 'percent_from_control') for name in self.all_data_tags[0]
+                  if name == group_tag or group_tag in control_groups or new_points.any()]
+        for axis in range(1, self.mean.ndim):
+            other_axes = tuple(i for i in range(touched.ndim) if i != axis - 1)
+            #  a name is stale where the group has a new value, a rank where its line has one
+            touched_names = touched.any(axis=other_axes)
+            line_touched = touched.any(axis=axis - 1, keepdims=True) | new_points.any(axis=axis - 1, keepdims=True)
+            ranked_names = (line_touched & valid).any(axis=other_axes)
+            for i, name in enumerate(self.all_data_tags[axis]):
+                if new_group or touched_names[i]:
+                    stale.append((axis, name, 'mean'))
+                if new_group or ranked_names[i]:
+                    stale.append((axis, name, 'seq'))
+                if new_group or touched_names[i] or group_tag in control_groups:
+                    stale.append((axis, name, 'percent_from_control'))
+        return stale
+
+    def stale_columns(self, group_tag, touched, new_points):
+        """
+        the columns of all_columns that change when subjects are appended to one group, call before update_group
+        :param group_tag: the group name, it may be new
+        :param touched: bool array of the shape of data_mask, True where the new subjects have a value
+        :param new_points: bool array of the shape of data_mask, True where a point is new to the data
+        :return: a list of column tag lists (the data_tags of column), None when every column changed
+        """
+        if group_tag not in self.tag_index[0] or group_tag == self.control_group:
+            return None
+        columns = [['all'] + [self.all_data_tags[axis + 1][i] for axis, i in enumerate(point)]
+                   for point in zip(*np.nonzero(touched))]
+        for axis in range(1, self.mean.ndim):
+            #  a column along a data tag axis is one group and one line, a new point is new to every group
+            group_lines = [(group_tag, touched.any(axis=axis - 1))]
+            if new_points.any():
+                group_lines += [(name, new_points.any(axis=axis - 1)) for name in self.all_data_tags[0]
+                                if name != group_tag]
+            for name, lines in group_lines:
+                for line in zip(*np.nonzero(lines)):
+                    column = [self.all_data_tags[i + 1 if i < axis - 1 else i + 2][j] for i, j in enumerate(line)]
+                    column.insert(axis - 1, 'all')
+                    columns.append([name] + column)
+        return columns
+
+    def surface_axes(self, all_data_tag_index, fixed_tags=None):
+        """
+        :param all_data_tag_index: which axis is the focused variable
+        :param fixed_tags: a dict of axis: tag for the axes that are neither the focus nor the surface
+        :return: the two axes the surface is drawn over
+        """
+        fixed_tags = fixed_tags or {}
+        axes = [axis for axis in range(self.mean.ndim) if axis != all_data_tag_index and axis not in fixed_tags]
+        if len(axes) != 2:
+            raise ValueError(f'a surface needs exactly 2 free axes, got {axes}, fix the other axes with fixed_tags')
+        return axes
+
+    def surface(self, all_data_tag_index, surface_name, plot_type, control_group=None, fixed_tags=None):
+        """
+        one surface, the focused axis fixed to surface_name, only the values of plot_type along that axis are computed
+        :param all_data_tag_index: which axis is the focused variable
+        :param surface_name: what is the focused variable of the surface
+        :param plot_type: 'seq', 'mean', 'percent_from_control' or the name of a point stat, e.g. 'q_value'
+        :param control_group: the control group of percent_from_control, the cube control group by default
+        :param fixed_tags: a dict of axis: tag, needed when the cube has more than 3 axes, e.g. {3: 'Spleen'}
+        :return: 2d numpy array over the two free axes, nan where the point does not exist
+        """
+        self.surface_axes(all_data_tag_index, fixed_tags)
+        fixed_tags = dict(fixed_tags or {})
+        fixed_tags[all_data_tag_index] = surface_name
+        index = tuple(self.tag_index[axis][fixed_tags[axis]] if axis in fixed_tags else slice(None)
+                      for axis in range(self.mean.ndim))
+        if plot_type == 'seq':
+            values = self.seq(all_data_tag_index)
+        elif plot_type == 'mean':
+            values = self.mean
+        elif plot_type == 'percent_from_control':
+            values = self.get_percent_from_control(control_group or self.control_group)
+        elif plot_type in self.point_stats:
+            values = self.point_stats[plot_type]
+        else:
+            raise ValueError(f'unknown plot type {plot_type}')
+        surface = values[index]
+        valid = self.valid[index]
+        if not valid.all():
+            surface = np.where(valid, surface, np.nan)
+        return surface
+
+    def column(self, data_tags):
+        """
+        analysis of one column, same output as DataAnalysis.one_column_analysis
+        :param data_tags: a list of data tags, with the focused variable as 'all' e.g. ['all', 'BCell', 'pERK']
+        :return: a dict of analysis results e.g. {group1|BCell|pERK: {seq: 0, mean: 10.1, percent_from_control: 0}}
+        """
+        axis = [i for i, tag in enumerate(data_tags) if tag.lower() == 'all'][0]
+        index = []
+        for i, tag in enumerate(data_tags):
+            if i == axis:
+                index.append(slice(None))
+            elif tag in self.tag_index[i]:
+                index.append(self.tag_index[i][tag])
+            else:
+                return {}
+        index = tuple(index)
+        return self._column_dict(axis, data_tags, self.seq(axis)[index], self.mean[index],
+                                 self.percent_from_control[index], self.control_point[index],
+                                 {name: values[index] for name, values in self.point_stats.items()})
+
+    def all_columns(self):
+        """
+        every column of every axis pair, same content as DataAnalysis.all_columns after generate_all_columns
+        :return: a dict of column key: column analysis dict
+        """
+        result = {}
+        for combination in combinations(range(self.mean.ndim), self.mean.ndim - 1):
+            axis = [i for i in range(self.mean.ndim) if i not in combination][0]
+            seq = np.moveaxis(self.seq(axis), axis, -1)
+            mean = np.moveaxis(self.mean, axis, -1)
+            percent_from_control = np.moveaxis(self.percent_from_control, axis, -1)
+            column_control_point = np.moveaxis(self.control_point, axis, -1)
+            point_stats = {name: np.moveaxis(values, axis, -1) for name, values in self.point_stats.items()}
+            for index in np.ndindex(seq.shape[:-1]):
+                column_tag_list = [self.all_data_tags[i][index[n]] for n, i in enumerate(combination)]
+                column_tag_list.insert(axis, 'all')
+                result['|'.join(column_tag_list)] = self._column_dict(axis, column_tag_list, seq[index], mean[index],
+                                                                      percent_from_control[index],
+                                                                      column_control_point[index],
+                                                                      {name: values[index]
+                                                                       for name, values in point_stats.items()})
+        return result
+
+    def _column_dict(self, axis, column_tag_list, seq, mean, percent_from_control, control_point, point_stats):
+        """
+        build the sorted column dict from the 1d arrays along the focused axis
+        """
+        sorted_dict = {}
+        point_tag = list(column_tag_list)
+        for point in np.argsort(np.where(seq < 0, len(seq), seq))[:np.count_nonzero(seq >= 0)]:
+            point_tag[axis] = self.all_data_tags[axis][point]
+            point_dict = {'seq': int(seq[point]), 'mean': mean[point],
+                          'percent_from_control': 0 if control_point[point] else percent_from_control[point]}
+            for name, values in point_stats.items():
+                point_dict[name] = values[point]
+            sorted_dict['|'.join(point_tag)] = point_dict
+        return sorted_dict
@@ -0,0 +1,143 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: AnalysisProtocol.py
+@time: 10/18/26 11:20
+"""
+import json
+import math
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+from DataQuery import QueryResult
+
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), 'cytof_analysis.sock')
+FRAME = struct.Struct('!II')  # the byte length of the json header and of the array payload of a message
+BINARY_KINDS = 'biuf'  # numpy dtype kinds sent as raw bytes in binary mode
+
+
+def to_wire(obj, buffers=None):
+    """
+    turn a result into something json can dump
+    :param obj: nested dicts / lists / tuples of numpy arrays, numpy scalars, QueryResult, strings and numbers
+    :param buffers: a list, numeric arrays are appended to it and replaced by their position (binary mode), None to
+    put every array into the json as nested lists (json mode, nan is null)
+    :return: the json ready object, a non finite float that is not an array element is {'__float__': 'nan'}, ±inf
+    is always {'__float__': 'inf'} / {'__float__': '-inf'}, json has no such numbers
+    """
+    if isinstance(obj, np.ndarray):
+        if buffers is not None and obj.dtype.kind in BINARY_KINDS:
+            buffers.append(np.ascontiguousarray(obj))
+            return {'__array__': len(buffers) - 1}
+        return {'__ndarray__': array_to_wire(obj.tolist()), 'dtype': obj.dtype.str}
+    if isinstance(obj, QueryResult):
+        return {'__query_result__': to_wire([obj.data, obj.tag_labels, obj.group_labels, obj.subject_index], buffers)}
+    if isinstance(obj, dict):
+        return {str(key): to_wire(value, buffers) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [to_wire(item, buffers) for item in obj]
+    if isinstance(obj, np.generic):
+        obj = obj.item()
+    if isinstance(obj, float) and not math.isfinite(obj):
+        return {'__float__': repr(obj)}
+    return obj
+
+
+def array_to_wire(values):
+    """
+    :param values: the nested lists of ndarray.tolist()
+    :return: the same lists with nan as null and ±inf as {'__float__': 'inf'} / {'__float__': '-inf'}
+    """
+    if isinstance(values, list):
+        return [array_to_wire(value) for value in values]
+    if isinstance(values, float) and not math.isfinite(values):
+        return None if math.isnan(values) else {'__float__': repr(values)}
+    return values
+
+
+def from_wire(obj, buffers):
+    """
+    the inverse of to_wire
+    :param obj: the loaded json
+    :param buffers: the arrays of the payload
+    :return: the result with numpy arrays and QueryResult back in place
+    """
+    if isinstance(obj, dict):
+        if '__float__' in obj:
+            return float(obj['__float__'])
+        if '__array__' in obj:
+            return buffers[obj['__array__']]
+        if '__ndarray__' in obj:
+            dtype = np.dtype(obj['dtype'])
+            values = from_wire(obj['__ndarray__'], buffers)
+            #  null is nan again
+            return np.array(values, dtype=np.float64 if dtype.kind == 'f' else dtype).astype(dtype)
+        if '__query_result__' in obj:
+            return QueryResult(*from_wire(obj['__query_result__'], buffers))
+        return {key: from_wire(value, buffers) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [from_wire(item, buffers) for item in obj]
+    return obj
+
+
+def pack_message(header, buffers=()):
+    """
+    :param header: a json ready dict, the array buffers are described in header['arrays']
+    :param buffers: numpy arrays sent as raw bytes after the header
+    :return: bytes of one message
+    """
+    header = dict(header, arrays=[{'dtype': buffer.dtype.str, 'shape': list(buffer.shape)} for buffer in buffers])
+    header_bytes = json.dumps(header, allow_nan=False).encode()
+    payload = b''.join(buffer.tobytes() for buffer in buffers)
+    return FRAME.pack(len(header_bytes), len(payload)) + header_bytes + payload
+
+
+def unpack_message(header_bytes, payload):
+    """
+    :return: the header dict, the arrays of the payload
+    """
+    header = json.loads(header_bytes)
+    buffers = []
+    offset = 0
+    for array in header.pop('arrays'):
+        dtype = np.dtype(array['dtype'])
+        size = dtype.itemsize * math.prod(array['shape'])
+        buffers.append(np.frombuffer(payload, dtype=dtype, count=size // dtype.itemsize,
+                                     offset=offset).reshape(array['shape']))
+        offset += size
+    return header, buffers
+
+
+def read_exactly(sock, size):
+    """
+    :return: size bytes from a blocking socket
+    """
+    chunks = bytearray()
+    while len(chunks) < size:
+        chunk = sock.recv(min(size - len(chunks), 1 << 20))
+        if not chunk:
+            raise ConnectionError('the analysis server closed the connection')
+        chunks += chunk
+    return bytes(chunks)
+
+
+def read_message(sock):
+    """
+    read one message from a blocking socket
+    :return: the header dict, the arrays of the payload
+    """
+    header_size, payload_size = FRAME.unpack(read_exactly(sock, FRAME.size))
+    return unpack_message(read_exactly(sock, header_size), read_exactly(sock, payload_size))
+
+
+async def read_message_async(stream_reader):
+    """
+    read one message from an asyncio stream
+    :return: the header dict, the arrays of the payload
+    """
+    header_size, payload_size = FRAME.unpack(await stream_reader.readexactly(FRAME.size))
+    header_bytes = await stream_reader.readexactly(header_size)
+    return unpack_message(header_bytes, await stream_reader.readexactly(payload_size))
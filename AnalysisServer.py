@@ -0,0 +1,221 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: AnalysisServer.py
+@time: 10/18/26 11:20
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import stat
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from AnalysisProtocol import DEFAULT_SOCKET, pack_message, read_message_async, to_wire
+from DataAnalysis import DataAnalysis
+from DataReaderCsv import DataReaderCsv
+
+
+class AnalysisServer:
+    """
+    local query daemon, every dataset (csv files plus the DataAnalysis settings) is loaded once and kept in memory,
+    clients (AnalysisClient) ask for get_data, one_column_analysis and get_surface_data over a unix socket or a
+    localhost tcp port
+    the analysis runs in a thread pool, requests on the same dataset take turns (DataAnalysis is not thread safe),
+    requests on different datasets run at the same time, encoded responses are kept in a bounded lru cache
+    a dataset whose csv files changed on disk is loaded again on its next request
+    """
+    RESPONSE_CACHE_SIZE = 256  # the number of encoded responses kept
+    METHODS = ('get_data', 'one_column_analysis', 'get_surface_data')
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, host=None, port=None, max_workers=None):
+        """
+        :param socket_path: the unix socket to listen on, used when port is None
+        :param host: the host of the tcp server, 127.0.0.1 by default, only used with port
+        :param port: listen on a tcp port instead of the unix socket
+        :param max_workers: the number of analysis threads
+        """
+        self.socket_path = socket_path
+        self.host = host or '127.0.0.1'
+        self.port = port
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.datasets = {}  # dataset key: (DataAnalysis, signature of the csv files)
+        self.dataset_locks = {}  # dataset key: asyncio.Lock, one request at a time per dataset
+        self.response_cache = OrderedDict()  # (dataset key, method, arguments, binary): encoded response
+        self.socket_created = False  # True once this server listens on socket_path, only then run removes it
+
+    @staticmethod
+    def dataset_key(dataset):
+        """
+        :param dataset: a dict of DataAnalysis arguments: file_path, control_group, streaming, row_tag_num,
+        data_tag_names
+        :return: a hashable key of the dataset
+        """
+        file_path = dataset.get('file_path') or DataAnalysis.FILE_PATH
+        return (tuple(file_path) if isinstance(file_path, list) else file_path, dataset.get('control_group', 'Naïve'),
+                bool(dataset.get('streaming', False)), dataset.get('row_tag_num', DataReaderCsv.ROW_TAG_NUM),
+                tuple(dataset.get('data_tag_names') or ()))
+
+    @staticmethod
+    def files_signature(data_analysis):
+        """
+        :return: size and mtime of every csv of the dataset
+        """
+        return [(os.stat(file_path).st_size, os.stat(file_path).st_mtime_ns)
+                for file_path in data_analysis.data_reader.file_paths]
+
+    def load_dataset(self, key):
+        """
+        load a dataset, runs in the thread pool
+        :return: DataAnalysis
+        """
+        file_path, control_group, streaming, row_tag_num, data_tag_names = key
+        data_analysis = DataAnalysis(control_group, streaming, list(file_path) if isinstance(file_path, tuple)
+                                     else file_path, row_tag_num, list(data_tag_names) or None)
+        data_analysis.get_analysis_cube()
+        return data_analysis
+
+    def check_dataset(self, key):
+        """
+        load a dataset that is not resident yet or whose csv files changed, runs in the thread pool
+        :return: (DataAnalysis, signature of the csv files) of the new data, None if the resident data is current
+        """
+        if key in self.datasets:
+            data_analysis, signature = self.datasets[key]
+            try:
+                if self.files_signature(data_analysis) == signature:
+                    return None
+            except OSError:
+                pass
+        data_analysis = self.load_dataset(key)
+        return data_analysis, self.files_signature(data_analysis)
+
+    @staticmethod
+    def call(data_analysis, method, args, kwargs, binary):
+        """
+        run one analysis method and encode its result, runs in the thread pool
+        :return: the response message
+        """
+        if method == 'get_data':
+            result = data_analysis.data_reader.get_data(*args, **kwargs)
+        elif method == 'one_column_analysis':
+            result = data_analysis.one_column_analysis(*args, **kwargs)
+        else:
+            if kwargs.get('fixed_tags'):
+                #  json object keys are strings, the axes are ints
+                kwargs['fixed_tags'] = {int(axis): tag for axis, tag in kwargs['fixed_tags'].items()}
+            result = data_analysis.get_surface_data(*args, **kwargs)
+        buffers = [] if binary else None
+        return pack_message({'result': to_wire(result, buffers)}, buffers or ())
+
+    async def handle_request(self, request):
+        """
+        :param request: a dict with dataset (DataAnalysis arguments), method, args, kwargs and binary
+        :return: the response message
+        """
+        method = request.get('method')
+        if method not in self.METHODS:
+            raise ValueError(f'unknown method {method}, use one of {self.METHODS}')
+        key = self.dataset_key(request.get('dataset') or {})
+        args, kwargs = request.get('args', []), request.get('kwargs', {})
+        binary = bool(request.get('binary', True))
+        cache_key = (key, method, json.dumps([args, kwargs], sort_keys=True), binary)
+        loop = asyncio.get_running_loop()
+        async with self.dataset_locks.setdefault(key, asyncio.Lock()):
+            #  the files are checked with every request, a cached response is only used while they are the same
+            loaded = await loop.run_in_executor(self.executor, self.check_dataset, key)
+            if loaded is not None:
+                self.datasets[key] = loaded
+                for stale_key in [stale_key for stale_key in self.response_cache if stale_key[0] == key]:
+                    del self.response_cache[stale_key]
+            if cache_key in self.response_cache:
+                self.response_cache.move_to_end(cache_key)
+                return self.response_cache[cache_key]
+            response = await loop.run_in_executor(self.executor, self.call, self.datasets[key][0], method, args,
+                                                  kwargs, binary)
+        self.response_cache[cache_key] = response
+        if len(self.response_cache) > self.RESPONSE_CACHE_SIZE:
+            self.response_cache.popitem(last=False)
+        return response
+
+    async def handle_client(self, stream_reader, stream_writer):
+        """
+        answer the requests of one client until it disconnects
+        """
+        try:
+            while True:
+                try:
+                    request, _ = await read_message_async(stream_reader)
+                except asyncio.IncompleteReadError:
+                    break
+                try:
+                    response = await self.handle_request(request)
+                except Exception as error:  # the error is sent to the client, the server keeps running
+                    response = pack_message({'error': type(error).__name__, 'message': str(error)})
+                stream_writer.write(response)
+                await stream_writer.drain()
+        finally:
+            stream_writer.close()
+
+    def remove_stale_socket(self):
+        """
+        remove the socket left behind by a server that is not running any more
+        raises FileExistsError if socket_path is not a socket or another server still listens on it
+        :return: None
+        """
+        try:
+            mode = os.stat(self.socket_path).st_mode
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(mode):
+            raise FileExistsError(f'{self.socket_path} exists and is not a socket, choose another --socket')
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.socket_path)
+        except ConnectionRefusedError:
+            os.remove(self.socket_path)
+            return
+        finally:
+            probe.close()
+        raise FileExistsError(f'an analysis server is already listening on {self.socket_path}')
+
+    async def serve(self):
+        """
+        listen until cancelled
+        :return: None
+        """
+        if self.port is None:
+            self.remove_stale_socket()
+            server = await asyncio.start_unix_server(self.handle_client, path=self.socket_path)
+            self.socket_created = True
+        else:
+            server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        #  stop on kill as on ctrl-c, so run removes the socket
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        async with server:
+            await server.serve_forever()
+
+    def run(self):
+        try:
+            asyncio.run(self.serve())
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            pass
+        finally:
+            self.executor.shutdown()
+            if self.socket_created and os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='keep CyTOF datasets in memory and answer analysis queries')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help='the unix socket to listen on')
+    parser.add_argument('--port', type=int, default=None, help='listen on this localhost tcp port instead')
+    parser.add_argument('--workers', type=int, default=None, help='the number of analysis threads')
+    args = parser.parse_args()
+    try:
+        AnalysisServer(args.socket, port=args.port, max_workers=args.workers).run()
+    except FileExistsError as error:
+        parser.error(str(error))
@@ -0,0 +1,167 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: BatchRenderer.py
+@time: 10/18/26 10:58
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+
+matplotlib.use('Agg')  # headless, nothing is shown, every figure is written to a file
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from DataAnalysis import DataAnalysis, draw_composite_figure, draw_surface_figure, grant_surface_controls
+
+
+logger = logging.getLogger(__name__)
+DRAW_FUNCTIONS = {'surface': draw_surface_figure, 'composite': draw_composite_figure}
+
+
+def render_job(name, draw_function, draw_args, file_paths):
+    """
+    draw one figure and save it in every format, runs in a worker process
+    :param name: the figure name
+    :param draw_function: a key of DRAW_FUNCTIONS
+    :param draw_args: the arguments of the draw function
+    :param file_paths: the files to write
+    :return: name
+    """
+    fig = DRAW_FUNCTIONS[draw_function](**draw_args)
+    for file_path in file_paths:
+        fig.savefig(file_path, bbox_inches='tight')
+    plt.close(fig)
+    return name
+
+
+def hash_inputs(obj, digest):
+    """
+    feed everything a figure depends on into a hash
+    :param obj: nested lists / tuples / dicts of numpy arrays, strings and numbers
+    :param digest: a hashlib object
+    :return: None
+    """
+    if isinstance(obj, np.ndarray):
+        digest.update(f'{obj.dtype}{obj.shape}'.encode())
+        digest.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, dict):
+        for key in sorted(obj):
+            digest.update(repr(key).encode())
+            hash_inputs(obj[key], digest)
+    elif isinstance(obj, (list, tuple)):
+        digest.update(f'{type(obj).__name__}{len(obj)}'.encode())
+        for item in obj:
+            hash_inputs(item, digest)
+    else:
+        digest.update(repr(obj).encode())
+
+
+class BatchRenderer:
+    """
+    render the surface figures and the grant composite of a DataAnalysis to files without a display
+    the surfaces are computed in this process, only the drawing runs in a process pool
+    a figure whose inputs did not change since the last run (see MANIFEST_NAME in the output folder) is skipped
+    """
+    MANIFEST_NAME = 'render_manifest.json'
+    PLOT_TYPES = ('mean', 'seq', 'percent_from_control')
+    COLOR_MAPS = {'mean': 'gist_earth_r', 'seq': 'Blues_r', 'percent_from_control': 'RdYlGn'}
+
+    def __init__(self, data_analysis, output_dir, formats=('png',), max_workers=None, annotate=False, fixed_tags=None):
+        """
+        :param data_analysis: DataAnalysis to render
+        :param output_dir: the folder the figures are written to
+        :param formats: file formats, any of png, svg, pdf
+        :param max_workers: the number of drawing processes, the number of cpus by default
+        :param annotate: write the value of every point of the surface figures
+        :param fixed_tags: a dict of axis: tag for the axes beyond the surfaces when there are more than 2 data tag
+        levels, see DataAnalysis.get_surface_data
+        """
+        self.data_analysis = data_analysis
+        self.output_dir = output_dir
+        self.formats = formats
+        self.max_workers = max_workers
+        self.annotate = annotate
+        self.fixed_tags = fixed_tags or {}
+
+    def get_jobs(self, plot_types=PLOT_TYPES, composite=True):
+        """
+        :param plot_types: the plot types of plot_surface to render
+        :param composite: also render the grant composite, it is skipped (with a warning) when the data does not have
+        the grant groups
+        :return: a list of (figure name, draw function, draw arguments)
+        """
+        jobs = []
+        for plot_type in plot_types:
+            color_map = self.COLOR_MAPS[plot_type]
+            for index, axis_name in enumerate(self.data_analysis.all_data_tags_name):
+                if index in self.fixed_tags:
+                    continue
+                jobs.append((f'{plot_type}_{axis_name}'.replace(' ', '_'), 'surface',
+                             self.data_analysis.get_surface_figure_args(index, plot_type, color_map, self.annotate,
+                                                                        self.fixed_tags)))
+        if composite:
+            try:
+                surface_controls = grant_surface_controls(self.data_analysis.data_reader.group_list)
+            except ValueError as error:
+                logger.warning('skipping grant_composite: %s', error)
+                return jobs
+            composite_data, x, y = self.data_analysis.get_composite_surface(0, surface_controls, self.fixed_tags)
+            jobs.append(('grant_composite', 'composite', {'composite': composite_data, 'x': x, 'y': y}))
+        return jobs
+
+    def render(self, plot_types=PLOT_TYPES, composite=True):
+        """
+        write every figure whose inputs changed
+        :return: a list of the names of the figures that were drawn
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        manifest_path = os.path.join(self.output_dir, self.MANIFEST_NAME)
+        manifest = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as f:
+                manifest = json.load(f)
+        to_render = []
+        for name, draw_function, draw_args in self.get_jobs(plot_types, composite):
+            digest = hashlib.blake2b(digest_size=16)
+            hash_inputs([draw_function, draw_args], digest)
+            input_hash = digest.hexdigest()
+            file_paths = [os.path.join(self.output_dir, f'{name}.{file_format}') for file_format in self.formats]
+            if manifest.get(name) == input_hash and all(os.path.exists(file_path) for file_path in file_paths):
+                continue
+            to_render.append((name, draw_function, draw_args, file_paths, input_hash))
+        if not to_render:
+            return []
+        rendered = []
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(render_job, *job[:4]) for job in to_render]
+            for future, job in zip(futures, to_render):
+                rendered.append(future.result())
+                manifest[job[0]] = job[4]
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        return rendered
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='render every CyTOF surface figure to files')
+    parser.add_argument('--file', default=DataAnalysis.FILE_PATH, help='csv file or glob pattern')
+    parser.add_argument('--control', default='Naïve', help='the control group')
+    parser.add_argument('--out', default='figures', help='the output folder')
+    parser.add_argument('--formats', nargs='+', default=['png'], choices=['png', 'svg', 'pdf'])
+    parser.add_argument('--plot-types', nargs='+', default=list(BatchRenderer.PLOT_TYPES),
+                        choices=list(BatchRenderer.PLOT_TYPES))
+    parser.add_argument('--no-composite', action='store_true', help='do not render the grant composite')
+    parser.add_argument('--workers', type=int, default=None, help='the number of drawing processes')
+    parser.add_argument('--annotate', action='store_true', help='write the value of every point')
+    args = parser.parse_args()
+    batch_renderer = BatchRenderer(DataAnalysis(args.control, file_path=args.file), args.out, args.formats,
+                                   args.workers, args.annotate)
+    for figure_name in batch_renderer.render(args.plot_types, not args.no_composite):
+        print(f'rendered {figure_name}')
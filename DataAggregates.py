@@ -0,0 +1,120 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: DataAggregates.py
+@time: 10/18/26 10:54
+"""
+import numpy as np
+
+
+class DataAggregates:
+    """
+    running sums, counts and sums of squares per (group, data tag 1, data tag 2, ...), e.g. (group, cell type, marker)
+    used by the streaming mode of DataReaderCsv, memory only depends on the number of tags, not on the number of rows
+    """
+
+    def __init__(self, group_num, level_num=2):
+        """
+        :param group_num: the number of groups
+        :param level_num: the number of data tag levels, ROW_TAG_NUM of the reader
+        """
+        self.group_num = group_num
+        self.tag_nums = (0,) * level_num  # the number of tags seen so far on every level
+        self._sums = np.zeros((group_num,) + self.tag_nums)
+        self._counts = np.zeros((group_num,) + self.tag_nums, dtype=np.int64)
+        self._sum_squares = np.zeros((group_num,) + self.tag_nums)
+
+    def _used(self, array):
+        return array[(slice(None),) + tuple(slice(0, tag_num) for tag_num in self.tag_nums)]
+
+    @property
+    def sums(self):
+        return self._used(self._sums)
+
+    @property
+    def counts(self):
+        return self._used(self._counts)
+
+    @property
+    def sum_squares(self):
+        return self._used(self._sum_squares)
+
+    def resize(self, *tag_nums):
+        """
+        make room for new tags, the capacity grows geometrically so a stream of new tags is cheap
+        :param tag_nums: the number of tags seen so far on every level, e.g. cell type number, marker number
+        :return: None
+        """
+        capacity = self._sums.shape[1:]
+        if any(tag_num > size for tag_num, size in zip(tag_nums, capacity)):
+            new_capacity = tuple(max(tag_num, 2 * size) for tag_num, size in zip(tag_nums, capacity))
+            for name in ('_sums', '_counts', '_sum_squares'):
+                old = getattr(self, name)
+                new = np.zeros((self.group_num,) + new_capacity, dtype=old.dtype)
+                new[(slice(None),) + tuple(slice(0, size) for size in capacity)] = old
+                setattr(self, name, new)
+        self.tag_nums = tuple(max(old, new) for old, new in zip(self.tag_nums, tag_nums))
+
+    def add(self, group_index, tag_index, values):
+        """
+        add a chunk of rows of one group
+        :param group_index: index of the group
+        :param tag_index: a tuple of int arrays, the tag index of each row on every level
+        :param values: numpy array of shape (row, subject in the group), nan values are not counted
+        :return: None
+        """
+        np.add.at(self._sums[group_index], tag_index, np.nansum(values, axis=1))
+        np.add.at(self._counts[group_index], tag_index, np.count_nonzero(~np.isnan(values), axis=1))
+        np.add.at(self._sum_squares[group_index], tag_index, np.nansum(np.square(values), axis=1))
+
+    def add_group(self):
+        """
+        add an empty group after the last group
+        :return: None
+        """
+        for name in ('_sums', '_counts', '_sum_squares'):
+            old = getattr(self, name)
+            setattr(self, name, np.concatenate([old, np.zeros((1,) + old.shape[1:], dtype=old.dtype)]))
+        self.group_num += 1
+
+    def merge(self, other, group_map, *tag_maps):
+        """
+        add the aggregates of another file
+        :param other: DataAggregates of the other file
+        :param group_map: the index in this object of every group of other
+        :param tag_maps: for every level, the index in this object of every tag of other
+        :return: None
+        """
+        index = np.ix_(group_map, *tag_maps)
+        np.add.at(self._sums, index, other.sums)
+        np.add.at(self._counts, index, other.counts)
+        np.add.at(self._sum_squares, index, other.sum_squares)
+
+    def reorder(self, *tag_orders):
+        """
+        put the tag axes in a new order
+        :param tag_orders: for every level, the old index of every new position
+        :return: None
+        """
+        index = np.ix_(np.arange(self.group_num), *tag_orders)
+        for name in ('_sums', '_counts', '_sum_squares'):
+            setattr(self, name, getattr(self, name)[index])
+        self.tag_nums = tuple(len(tag_order) for tag_order in tag_orders)
+
+    def mean(self):
+        """
+        :return: numpy array of shape (group, data tag 1, data tag 2, ...), nan where nothing was counted
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.sums / self.counts
+
+    def variance(self, ddof=0):
+        """
+        :param ddof: delta degrees of freedom, 1 for the sample variance
+        :return: numpy array of shape (group, data tag 1, data tag 2, ...), nan where there are not enough values
+        """
+        counts = self.counts
+        with np.errstate(divide='ignore', invalid='ignore'):
+            variance = (self.sum_squares - self.sums ** 2 / counts) / (counts - ddof)
+        variance[counts - ddof <= 0] = np.nan
+        return np.maximum(variance, 0)
@@ -6,12 +6,26 @@
 @email: rxy216@case.edu
 @time: 5/22/23 20:56
 """
+import re
+from collections import OrderedDict
+
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib import colors
 import seaborn as sns
 
+from AggregationStats import get_statistic
+from AnalysisCube import AnalysisCube
+from DataQuery import TagFilter
 from DataReaderCsv import DataReaderCsv
+from Heatmap import heatmap
+from MarkerCorrelation import MarkerCorrelation
+from ResultStore import export_results
+from Significance import Significance
+from SubjectAnalysis import SubjectAnalysis
+
+#  color bars centered at 0
+CENTERED_PLOT_TYPES = ('percent_from_control', 'z_score', 'robust_z_score', 'correlation', 'correlation_difference')
 
 
 def closest_factors(n):
@@ -20,138 +34,466 @@ def closest_factors(n):
             return i, n // i
 
 
+def grant_surface_controls(group_list):
+    """
+    the (surface name, control group) pairs of the grant composite: every group that is not IL7 or a combination
+    against Naïve, then CLP + Heme against CLP (HemeV)
+    raises ValueError if the data does not have these groups
+    """
+    heme_groups = TagFilter(regex=re.escape("CLP + Heme")).filter(group_list)
+    missing = [name for name in ("Naïve", "CLP (HemeV)") if name not in group_list]
+    if not heme_groups:
+        missing.append("CLP + Heme")
+    if missing:
+        raise ValueError(f'the grant composite needs the groups {missing}, they are not in the data')
+    surface_controls = [(name, "Naïve") for name in TagFilter(exclude=("IL7", "+")).filter(group_list)]
+    surface_controls.append((heme_groups[0], "CLP (HemeV)"))
+    return surface_controls
+
+
+def draw_surface_figure(title, panels, plot_type, color_map, annotate=False, aspect=None):
+    """
+    draw one subplot grid of surfaces
+    :param title: the figure title
+    :param panels: a list of (panel title, surface data, x label, y label)
+    :param plot_type: 'seq' or 'mean' or 'percent_from_control', or a SubjectAnalysis plot type
+    :param color_map: the color map of every panel
+    :param annotate: write the value of every point
+    :param aspect: the aspect of the cells, 'auto' for long surfaces such as subject by marker
+    :return: the figure
+    """
+    #  get subplot row and col
+    subplot_row, subplot_col = closest_factors(len(panels))  # type: ignore
+    # Set up the plot
+    fig, axs = plt.subplots(nrows=subplot_row, ncols=subplot_col,
+                            figsize=(subplot_col * 8, subplot_row * 8),
+                            gridspec_kw={'hspace': 0.1, 'wspace': 0.15}, squeeze=False)
+    fig.suptitle(title, fontsize=32)
+    for ax, (panel_title, surface_data, x, y) in zip(axs.flat, panels):
+        # if plot_type == 'percent_from_control' or a z score, we need to put the center of the color bar at 0
+        heatmap(ax, surface_data, x, y, color_map, centered=plot_type in CENTERED_PLOT_TYPES, annotate=annotate,
+                fmt='{:.0f}' if plot_type == 'seq' else '{:.2f}', aspect=aspect)
+        ax.set_title(f'{panel_title},')
+    return fig
+
+
+def draw_composite_figure(composite, x, y, section_names=('Heme', 'Sepsis', 'Sepsis + Heme'), color_map='RdYlGn'):
+    """
+    draw the grant composite heatmap, one section of y columns per surface
+    :param composite: the output of DataAnalysis.get_composite_surface
+    :param x: the row labels
+    :param y: the column labels of one section
+    :param section_names: the name of each section, shown under the heatmap
+    :param color_map: the color map, centered at 0
+    :return: the figure
+    """
+    # set size
+    fig = plt.figure(figsize=(7, 7))
+    ax = fig.gca()
+    p = ax.imshow(composite, cmap=color_map, norm=colors.CenteredNorm())
+    fig.colorbar(p, ax=ax)
+    ax.set_xticks(np.arange(len(y) * len(section_names)), y * len(section_names), rotation=80)
+    ax.set_yticks(np.arange(len(x)), x)
+    # put x tick on top
+    ax.xaxis.tick_top()
+    for section_index, section_name in enumerate(section_names):
+        # plot a line to separate the groups
+        if section_index > 0:
+            ax.axvline(x=len(y) * section_index - 0.5, color='black')
+        # mark the groups on the bottom
+        ax.text(len(y) * (section_index + 0.5) - 0.5, len(x), section_name, ha='center', va='center', fontsize=12)
+    return fig
+
+
 class DataAnalysis:
     """
     do data analysis
     """
     FILE_PATH = 'MiceCYTOF.csv'
+    SURFACE_CACHE_SIZE = 128  # the number of surfaces kept by get_surface_data
 
-    def __init__(self, control_group='Naïve'):
+    def __init__(self, control_group='Naïve', streaming=False, file_path=None, row_tag_num=DataReaderCsv.ROW_TAG_NUM,
+                 data_tag_names=None, statistic='mean'):
+        """
+        :param control_group: the group percent_from_control is computed against
+        :param streaming: read the csv in chunks and only keep running aggregates, for files larger than memory
+        :param file_path: a csv, a list of csv files or a glob pattern, FILE_PATH by default
+        :param row_tag_num: the number of row tag columns of the csv, one data tag level per column
+        :param data_tag_names: the names of the data tag levels, ['Cell Type', 'Marker'] by default, e.g.
+        ['Tissue', 'Cell Type', 'Marker'], a level without a name is called 'Tag <axis>'
+        :param statistic: how the subjects of a group are aggregated, 'mean', 'median', 'trimmed_mean',
+        'arcsinh_mean' or another statistic of AggregationStats, the 'mean' of the results is this statistic, only
+        'mean' in streaming mode
+        """
+        get_statistic(statistic, streaming)
         self.grant_data = None
         self.CONTROL_GROUP = control_group
+        self.statistic = statistic
         self.all_columns = {}
-        self.data_reader = DataReaderCsv(self.FILE_PATH)
-        self.all_data_tags = [self.data_reader.group_list, self.data_reader.data_tag1_list,
-                              self.data_reader.data_tag2_list]
-        self.all_data_tags_name = ['group', 'Cell Type', 'Marker']
+        self.statistic_columns = {statistic: self.all_columns}  # statistic: all_columns of that statistic
+        self.analysis_cubes = {}  # statistic: AnalysisCube
+        self.subject_analysis = None
+        self.marker_correlation = None
+        self.surface_cache = OrderedDict()  # lru cache of get_surface_data
+        self.data_reader = DataReaderCsv(file_path or self.FILE_PATH, streaming=streaming, row_tag_num=row_tag_num)
+        self.data_reader.check_control_group(control_group)
+        self.all_data_tags = [self.data_reader.group_list] + self.data_reader.data_tag_lists
+        self.all_data_tags_name = ['group'] + list(data_tag_names or ['Cell Type', 'Marker'])[:row_tag_num]
+        self.all_data_tags_name += [f'Tag {axis}' for axis in range(len(self.all_data_tags_name), row_tag_num + 1)]
+
+    def get_analysis_cube(self, statistic=None):
+        """
+        get the array native analysis of the whole (group, cell type, marker, ...) cube, computed once per statistic
+        :param statistic: a statistic of AggregationStats, the current statistic by default
+        :return: AnalysisCube
+        """
+        statistic = statistic or self.statistic
+        if statistic not in self.analysis_cubes:
+            get_statistic(statistic, self.data_reader.streaming)
+            self.analysis_cubes[statistic] = AnalysisCube.from_reader(self.data_reader, self.all_data_tags,
+                                                                      self.CONTROL_GROUP, statistic)
+        return self.analysis_cubes[statistic]
 
-    def generate_all_columns(self):
+    def set_statistic(self, statistic):
         """
-        do 3d group analysis
+        switch the statistic of the analysis, the cube, the columns and the surfaces of every statistic are kept, so
+        switching back and forth does not compute anything again
+        :param statistic: a statistic of AggregationStats, only 'mean' in streaming mode
         :return: None
         """
-        combinations = [[0, 1], [0, 2], [1, 2]]
-        for combination in combinations:
-            for i in self.all_data_tags[combination[0]]:
-                for j in self.all_data_tags[combination[1]]:
-                    column_tag_list = ['all', 'all', 'all']
-                    column_tag_list[combination[0]] = i
-                    column_tag_list[combination[1]] = j
-                    self.all_columns['|'.join(column_tag_list)] = self.one_column_analysis(column_tag_list)
+        get_statistic(statistic, self.data_reader.streaming)
+        self.statistic = statistic
+        self.all_columns = self.statistic_columns.setdefault(statistic, {})
+
+    def get_subject_analysis(self):
+        """
+        get the per subject analysis against CONTROL_GROUP, computed once
+        :return: SubjectAnalysis
+        """
+        if self.subject_analysis is None:
+            self.subject_analysis = SubjectAnalysis(self.data_reader, self.CONTROL_GROUP)
+        return self.subject_analysis
+
+    def get_marker_correlation(self):
+        """
+        get the marker by marker correlation of every group and cell type, computed once per method
+        :return: MarkerCorrelation
+        """
+        if self.marker_correlation is None:
+            self.marker_correlation = MarkerCorrelation(self.data_reader, self.CONTROL_GROUP)
+        return self.marker_correlation
+
+    def get_significance(self, resample_num=Significance.RESAMPLE_NUM, seed=0, alpha=0.05, correction='bh',
+                         max_workers=None):
+        """
+        bootstrap confidence interval and permutation p value of percent_from_control against CONTROL_GROUP for every
+        point, the results are added to the analysis cube of the mean statistic as ci_low, ci_high, p_value and
+        q_value (the resamples are of the group means)
+        :param resample_num: the number of bootstrap resamples and of permutations
+        :param seed: the seed of the rng
+        :param alpha: 1 - the confidence level of the interval
+        :param correction: multiple testing correction, 'bh', 'bonferroni' or 'none'
+        :param max_workers: split the markers across this many processes, None to run in this process
+        :return: a dict of numpy arrays of shape (group, cell type, marker), see Significance.run
+        """
+        significance = Significance(self.data_reader, self.CONTROL_GROUP, resample_num, seed, alpha, correction,
+                                    max_workers).run()
+        self.get_analysis_cube('mean').add_point_stats(significance)
+        #  surfaces of an earlier run are stale
+        for key in [key for key in self.surface_cache if key[2] in significance]:
+            del self.surface_cache[key]
+        return significance
+
+    def generate_all_columns(self, significance=False):
+        """
+        do group analysis, every column of every axis pair
+        :param significance: also put ci_low, ci_high, p_value and q_value into every point, with the default
+        settings of get_significance if it was not called before, only with the mean statistic
+        :return: the AnalysisCube all_columns is built from
+        """
+        if significance and self.statistic != 'mean':
+            raise ValueError(f'significance is computed for the mean statistic, not for {self.statistic}')
+        analysis_cube = self.get_analysis_cube()
+        if significance and 'q_value' not in analysis_cube.point_stats:
+            self.get_significance()
+        self.all_columns.update(analysis_cube.all_columns())
+        return analysis_cube
+
+    def append_subjects(self, group_tag, values, subject_ids=None):
+        """
+        append new subjects to a group (or a new group) of the loaded data and update the analysis incrementally,
+        only the statistic of that group, the ranks of the touched columns and the affected percent_from_control are
+        recomputed, the columns of all_columns and the cached surfaces that changed are replaced
+        :param group_tag: the group name
+        :param values: numpy array of shape (cell type, marker, ..., new subject), see DataReaderCsv.append_subjects
+        :param subject_ids: the id of every new subject
+        :return: a list of (axis, surface name, plot type) of the surfaces that changed, to redraw only those
+        """
+        old_mask = self.data_reader.data_mask
+        touched = self.data_reader.append_subjects(group_tag, values, subject_ids)
+        self.all_data_tags[0] = self.data_reader.group_list
+        self.subject_analysis = None
+        self.marker_correlation = None
+        #  the subject and correlation surfaces, the point stats and the other statistics are computed again on demand
+        analysis_cube = self.analysis_cubes.get(self.statistic)
+        self.analysis_cubes = {} if analysis_cube is None else {self.statistic: analysis_cube}
+        self.statistic_columns = {self.statistic: self.all_columns}
+        for key in [key for key in self.surface_cache if key[0] in ('subject', 'correlation') or
+                    key[5] != self.statistic or key[2] not in ('seq', 'mean', 'percent_from_control')]:
+            del self.surface_cache[key]
+        if analysis_cube is None:
+            return [(axis, name, plot_type) for axis in range(len(self.all_data_tags))
+                    for name in self.all_data_tags[axis] for plot_type in ('seq', 'mean', 'percent_from_control')]
+        new_points = touched & ~old_mask
+        columns = analysis_cube.stale_columns(group_tag, touched, new_points) if self.all_columns else []
+        stale = analysis_cube.update_group(group_tag, self.data_reader.group_mean(group_tag, self.statistic),
+                                           self.data_reader.data_mask, touched)
+        stale_keys = set(stale)
+        for key in [key for key in self.surface_cache if key[:3] in stale_keys]:
+            del self.surface_cache[key]
+        if columns is None:
+            self.all_columns.clear()
+            self.generate_all_columns()
+        else:
+            for column in columns:
+                self.all_columns['|'.join(column)] = analysis_cube.column(column)
+        return stale
+
+    def append_csv(self, file_path):
+        """
+        append the subjects of another csv with the same data tags, e.g. the export of a new acquisition batch
+        :param file_path: the csv of the new subjects
+        :return: a list of (axis, surface name, plot type) of the surfaces that changed
+        """
+        stale = {}
+        for group_tag, values, subject_ids in self.data_reader.read_subjects(file_path):
+            stale.update(dict.fromkeys(self.append_subjects(group_tag, values, subject_ids)))
+        return list(stale)
 
-    def one_column_analysis(self, data_tags):
+    def export_results(self, output_dir, control_groups=None):
+        """
+        write mean, seq, percent_from_control (and the point stats of get_significance) of the current statistic with
+        the tag labels as .npy files and a manifest, open them again with ResultStore.ResultStore without the csv
+        :param output_dir: the folder of the files
+        :param control_groups: the control groups percent_from_control is exported against, CONTROL_GROUP by default
+        :return: the path of the manifest
+        """
+        return export_results(self.get_analysis_cube(), output_dir, control_groups or [self.CONTROL_GROUP],
+                              self.all_data_tags_name, self.statistic)
+
+    def one_column_analysis(self, data_tags, statistic=None):
         """
         do one column analysis
         :param data_tags: a list of data tags, with the focused variable as 'all' e.g. ['all', 'BCell', 'pERK']
+        :param statistic: a statistic of AggregationStats, the current statistic by default
         :return: a dict of analysis results e.g. {all|BCell|pERK: {group1: {seq: 0, mean: 10.1}, group2: {...}, ...}, ...}
         """
-        #  get data
-        data = self.data_reader.get_data(data_tags)
-        #  do sort
-        mean_dict = {}
-        for point in data:
-            mean_dict[point] = np.mean(data[point])
-        sorted_mean_dict = sorted(mean_dict.items(), key=lambda kv: (kv[1], kv[0]), reverse=True)
-        sorted_dict = {}
-        for i, point in enumerate(sorted_mean_dict):
-            percent_from_control = 0
-            if self.CONTROL_GROUP not in point[0]:
-                control_for_point = point[0].replace(point[0].split('|')[0], self.CONTROL_GROUP)
-                control_data = self.data_reader.get_data(control_for_point.split('|'))
-                percent_from_control = (np.mean(mean_dict[point[0]]) - np.mean(control_data[control_for_point])) / \
-                                       np.mean(control_data[control_for_point])
-            sorted_dict[point[0]] = {'seq': i, 'mean': point[1], 'percent_from_control': percent_from_control}
-        return sorted_dict
-
-    def get_surface_data(self, all_data_tag_index, surface_name, plot_type):
-        """
-        get surface data
-        :param plot_type: seq or mean
-        :param all_data_tag_index: 0, 1, 2, which axis is the focused variable
+        return self.get_analysis_cube(statistic).column(data_tags)
+
+    def get_surface_data(self, all_data_tag_index, surface_name, plot_type, control_group=None, fixed_tags=None,
+                         statistic=None):
+        """
+        get surface data, computed on demand from the analysis cube and kept in a bounded lru cache
+        :param plot_type: seq or mean or percent_from_control, or ci_low, ci_high, p_value, q_value after
+        get_significance
+        :param all_data_tag_index: 0, 1, 2, ..., which axis is the focused variable
         :param surface_name: what is the focused variable of the surface
-        :return: surfaced data, x label, y label
+        :param control_group: the control group of percent_from_control, CONTROL_GROUP by default
+        :param fixed_tags: a dict of axis: tag for the axes beyond the surface when there are more than 2 data tag
+        levels, e.g. {3: 'Spleen'}
+        :param statistic: a statistic of AggregationStats, the current statistic by default, the surfaces of every
+        statistic share the lru cache
+        :return: surfaced data (read only, nan where the point does not exist), x label, y label
         """
-        surface_data = []
-        xy_label = {}  # index is the axis index from all axis, value is the axis label
-        temp_xy_index = []
-        for index, axis in enumerate(self.all_data_tags):
-            if index != all_data_tag_index:
-                xy_label[index] = axis
-                temp_xy_index.append(index)
-        for i in xy_label[temp_xy_index[0]]:
-            row = []
-            for j in xy_label[temp_xy_index[1]]:
-                column_tag_list = ['all', 'all', 'all']
-                column_tag_list[temp_xy_index[0]] = i
-                column_tag_list[temp_xy_index[1]] = j
-                # print(column_tag_list)
-                point_tag = []
-                for t in column_tag_list:
-                    if t != 'all':
-                        point_tag.append(t)
-                    else:
-                        point_tag.append(surface_name)
-                # print(point_tag)
-                row.append(self.all_columns['|'.join(column_tag_list)]['|'.join(point_tag)][plot_type])
-            surface_data.append(row)
-        return np.array(surface_data), xy_label[temp_xy_index[1]], xy_label[temp_xy_index[0]]
+        control_group = control_group or self.CONTROL_GROUP
+        statistic = statistic or self.statistic
+        key = (all_data_tag_index, surface_name, plot_type, control_group, tuple(sorted((fixed_tags or {}).items())),
+               statistic)
+
+        def compute():
+            analysis_cube = self.get_analysis_cube(statistic)
+            surface_data = analysis_cube.surface(all_data_tag_index, surface_name, plot_type, control_group,
+                                                 fixed_tags)
+            xy_label = [self.all_data_tags[axis]
+                        for axis in analysis_cube.surface_axes(all_data_tag_index, fixed_tags)]
+            return surface_data, xy_label[1], xy_label[0]
+        return self._cached_surface(key, compute)
 
-    def plot_surface(self, plot_type, color_map='gist_earth_r'):
+    def get_subject_surface(self, cell_type, plot_type='z_score', fixed_tags=None):
         """
-        plot 2d surface
-        :param plot_type: 'seq' or 'mean'
-        :return: None
+        subject by marker surface of one cell type, kept in the same lru cache as get_surface_data
+        :param cell_type: the cell type
+        :param plot_type: 'value', 'z_score', 'robust_z_score' or 'outlier'
+        :param fixed_tags: a dict of axis: tag for the data tag levels after marker, see get_surface_data
+        :return: surfaced data (read only, rows are subjects), x label (markers), y label (subject ids)
+        """
+        key = ('subject', cell_type, plot_type, None, tuple(sorted((fixed_tags or {}).items())), None)
+
+        def compute():
+            surface_data = self.get_subject_analysis().surface(cell_type, plot_type, fixed_tags)
+            return surface_data, self.data_reader.data_tag2_list, self.data_reader.subject_list
+        return self._cached_surface(key, compute)
+
+    def get_correlation_surface(self, group_tag, cell_type, plot_type='correlation', method='pearson',
+                                fixed_tags=None):
+        """
+        marker by marker correlation matrix of one group and cell type, kept in the same lru cache as get_surface_data
+        :param group_tag: the group
+        :param cell_type: the cell type
+        :param plot_type: 'correlation' or 'correlation_difference' (against CONTROL_GROUP)
+        :param method: 'pearson' or 'spearman'
+        :param fixed_tags: a dict of axis: tag for the data tag levels after marker, see get_surface_data
+        :return: surfaced data (read only), x label (markers), y label (markers)
+        """
+        key = ('correlation', (group_tag, cell_type), plot_type, method, tuple(sorted((fixed_tags or {}).items())),
+               None)
+
+        def compute():
+            surface_data = self.get_marker_correlation().surface(group_tag, cell_type, plot_type, method, fixed_tags)
+            markers = self.data_reader.data_tag2_list
+            return surface_data, markers, markers
+        return self._cached_surface(key, compute)
+
+    def _cached_surface(self, key, compute):
+        """
+        the lru cache of every surface getter
+        :param key: the surface cache key, (axis or kind, name, plot type, control group or method, fixed tags,
+        statistic)
+        :param compute: called without arguments on a miss, returns (surface data, x label, y label)
+        :return: the cached (surface data, x label, y label), the surface data is read only
+        """
+        if key in self.surface_cache:
+            self.surface_cache.move_to_end(key)
+            return self.surface_cache[key]
+        surface_data, x, y = compute()
+        surface_data.flags.writeable = False
+        self.surface_cache[key] = surface_data, x, y
+        if len(self.surface_cache) > self.SURFACE_CACHE_SIZE:
+            self.surface_cache.popitem(last=False)
+        return self.surface_cache[key]
+
+    def get_multi_control_surfaces(self, all_data_tag_index, surface_controls, fixed_tags=None, statistic=None):
+        """
+        percent_from_control surfaces against several control groups from the same reader, the control means are
+        computed once per control group
+        :param all_data_tag_index: 0, 1, 2, ..., which axis is the focused variable
+        :param surface_controls: a list of (surface name, control group), e.g. [('CLP (HemeV)', 'Naïve'), ...]
+        :param fixed_tags: a dict of axis: tag for the axes beyond the surface, see get_surface_data
+        :param statistic: a statistic of AggregationStats, the current statistic by default
+        :return: stacked surfaces of shape (surface, y, x), x label, y label
+        """
+        analysis_cube = self.get_analysis_cube(statistic)
+        #  every control group in one broadcasted division, the surfaces below only slice the cached results
+        analysis_cube.get_percent_from_controls([control for _, control in surface_controls])
+        surfaces = np.stack([analysis_cube.surface(all_data_tag_index, surface_name, 'percent_from_control', control,
+                                                   fixed_tags)
+                             for surface_name, control in surface_controls])
+        xy_label = [self.all_data_tags[axis] for axis in analysis_cube.surface_axes(all_data_tag_index, fixed_tags)]
+        return surfaces, xy_label[1], xy_label[0]
+
+    def get_composite_surface(self, all_data_tag_index, surface_controls, fixed_tags=None, statistic=None):
         """
+        the grant composite heatmap, every surface is transposed and the surfaces are put side by side
+        :param all_data_tag_index: 0, 1, 2, ..., which axis is the focused variable
+        :param surface_controls: a list of (surface name, control group)
+        :param fixed_tags: a dict of axis: tag for the axes beyond the surface, see get_surface_data
+        :param statistic: a statistic of AggregationStats, the current statistic by default
+        :return: composite of shape (x, surface * y), x label, y label
+        """
+        surfaces, x, y = self.get_multi_control_surfaces(all_data_tag_index, surface_controls, fixed_tags, statistic)
+        return np.concatenate(np.transpose(surfaces, (0, 2, 1)), axis=1), x, y
+
+    def get_surface_figure_args(self, index, plot_type, color_map='gist_earth_r', annotate=False, fixed_tags=None,
+                                mask_alpha=None, statistic=None):
+        """
+        everything draw_surface_figure needs for one axis, plain arrays and lists so it can be sent to another process
+        :param index: 0, 1, 2, ..., which axis is the focused variable
+        :param plot_type: 'seq' or 'mean' or 'percent_from_control'
+        :param annotate: write the value of every point
+        :param fixed_tags: a dict of axis: tag for the axes beyond the surface, see get_surface_data
+        :param mask_alpha: only show the points with a q_value below this, see get_significance, only with the mean
+        statistic
+        :param statistic: a statistic of AggregationStats, the current statistic by default
+        :return: a dict of draw_surface_figure arguments
+        """
+        statistic = statistic or self.statistic
         if plot_type == 'seq':
             color_map = 'Blues_r'
-        for index, axis in enumerate(self.all_data_tags):
-            #  get subplot row and col
-            subplot_row, subplot_col = closest_factors(len(axis))  # type: ignore
-            # Set up the plot
-            fig, axs = plt.subplots(nrows=subplot_row, ncols=subplot_col,
-                                    figsize=(subplot_col * 8, subplot_row * 8),
-                                    gridspec_kw={'hspace': 0.1, 'wspace': 0.15})
-            fig.suptitle(f'CyTOF {self.all_data_tags_name[index]} {plot_type} surface', fontsize=32)
-            tick_no = 0
-            for i in range(0, subplot_row):
-                for j in range(0, subplot_col):
-                    surface_data, x, y = self.get_surface_data(index, axis[tick_no], plot_type)
-                    print(surface_data)
-                    # print(x)
-                    # print(y)
-                    if subplot_row == 1 or subplot_col == 1:
-                        p = 0
-                        # if plot_type == 'percent_from_control', we need to put the center of the color bar at 0
-                        if plot_type == 'percent_from_control':
-                            p = axs[tick_no].imshow(surface_data, cmap=color_map, norm=colors.CenteredNorm())
-                        else:
-                            p = axs[tick_no].imshow(surface_data, cmap=color_map)
-                        plt.colorbar(p, ax=axs[tick_no])
-                        axs[tick_no].set_xticks(np.arange(len(x)), x, rotation=60)
-                        axs[tick_no].set_yticks(np.arange(len(y)), y)
-                        axs[tick_no].set_title(f'{axis[tick_no]},')
-                    else:
-                        p = 0
-                        # if plot_type == 'percent_from_control', we need to put the center of the color bar at 0
-                        if plot_type == 'percent_from_control':
-                            p = axs[i, j].imshow(surface_data, cmap=color_map, norm=colors.CenteredNorm())
-                        else:
-                            p = axs[i, j].imshow(surface_data, cmap=color_map)
-                        plt.colorbar(p, ax=axs[i, j])
-                        axs[i, j].set_xticks(np.arange(len(x)), x, rotation=60)
-                        axs[i, j].set_yticks(np.arange(len(y)), y)
-                        axs[i, j].set_title(f'{axis[tick_no]},')
-                    tick_no += 1
+        if mask_alpha is not None and statistic != 'mean':
+            raise ValueError(f'significance is computed for the mean statistic, not for {statistic}')
+        if mask_alpha is not None and 'q_value' not in self.get_analysis_cube('mean').point_stats:
+            self.get_significance()
+        panels = []
+        for name in self.all_data_tags[index]:
+            surface_data, x, y = self.get_surface_data(index, name, plot_type, fixed_tags=fixed_tags,
+                                                       statistic=statistic)
+            if mask_alpha is not None:
+                q_value = self.get_surface_data(index, name, 'q_value', fixed_tags=fixed_tags, statistic='mean')[0]
+                surface_data = np.where(q_value < mask_alpha, surface_data, np.nan)
+            panels.append((name, surface_data, x, y))
+        title = f'CyTOF {self.all_data_tags_name[index]} {plot_type} surface'
+        if statistic != 'mean':
+            title += f' of the {statistic}'
+        if fixed_tags:
+            title += ' (' + ', '.join(fixed_tags[axis] for axis in sorted(fixed_tags)) + ')'
+        if mask_alpha is not None:
+            title += f', q < {mask_alpha}'
+        return {'title': title, 'panels': panels, 'plot_type': plot_type, 'color_map': color_map, 'annotate': annotate}
+
+    def plot_surface(self, plot_type, color_map='gist_earth_r', annotate=False, fixed_tags=None, mask_alpha=None,
+                     statistic=None):
+        """
+        plot 2d surface
+        :param plot_type: 'seq' or 'mean' or 'percent_from_control'
+        :param annotate: write the value of every point
+        :param fixed_tags: a dict of axis: tag, with more than 2 data tag levels every axis beyond the surface is fixed
+        to one tag, e.g. {3: 'Spleen'}
+        :param mask_alpha: only show the points with a q_value below this, e.g. 0.05, see get_significance
+        :param statistic: a statistic of AggregationStats, e.g. 'median', the current statistic by default
+        :return: None
+        """
+        fixed_tags = fixed_tags or {}
+        for index in range(len(self.all_data_tags)):
+            if index in fixed_tags:
+                continue
+            draw_surface_figure(**self.get_surface_figure_args(index, plot_type, color_map, annotate, fixed_tags,
+                                                               mask_alpha, statistic))
+            plt.show()
+
+    def plot_subject_surface(self, plot_type='z_score', color_map='RdYlGn', annotate=False, fixed_tags=None):
+        """
+        plot the subject by marker surface of every cell type
+        :param plot_type: 'value', 'z_score', 'robust_z_score' or 'outlier'
+        :param annotate: write the value of every point
+        :param fixed_tags: a dict of axis: tag for the data tag levels after marker, see get_surface_data
+        :return: None
+        """
+        panels = []
+        for cell_type in self.data_reader.data_tag1_list:
+            surface_data, x, y = self.get_subject_surface(cell_type, plot_type, fixed_tags)
+            panels.append((cell_type, surface_data, x, y))
+        draw_surface_figure(f'CyTOF subject {plot_type} surface', panels, plot_type, color_map, annotate, aspect='auto')
+        plt.show()
+
+    def plot_correlation_surface(self, plot_type='correlation', method='pearson', color_map='RdBu_r', annotate=False,
+                                 fixed_tags=None):
+        """
+        plot the marker by marker correlation of every cell type, one figure per group
+        :param plot_type: 'correlation' or 'correlation_difference', the control group is not drawn for the difference
+        :param method: 'pearson' or 'spearman'
+        :param annotate: write the value of every point
+        :param fixed_tags: a dict of axis: tag for the data tag levels after marker, see get_surface_data
+        :return: None
+        """
+        for group_tag in self.data_reader.group_list:
+            if plot_type == 'correlation_difference' and group_tag == self.CONTROL_GROUP:
+                continue
+            panels = []
+            for cell_type in self.data_reader.data_tag1_list:
+                surface_data, x, y = self.get_correlation_surface(group_tag, cell_type, plot_type, method, fixed_tags)
+                panels.append((cell_type, surface_data, x, y))
+            draw_surface_figure(f'CyTOF {group_tag} marker {method} {plot_type}', panels, plot_type, color_map,
+                                annotate)
             plt.show()
 
     def plot_for_grant(self, plot_type, color_map='gist_earth_r'):
@@ -166,10 +508,9 @@ class DataAnalysis:
             all_surface_data = []
             x = None
             y = None
-            for name in axis:
-                if "IL7" not in name and "+" not in name:
-                    surface_data, x, y = self.get_surface_data(index, name, plot_type)
-                    all_surface_data.append(np.transpose(surface_data))
+            for name in TagFilter(exclude=("IL7", "+")).filter(axis):
+                surface_data, x, y = self.get_surface_data(index, name, plot_type)
+                all_surface_data.append(np.transpose(surface_data))
 
             self.grant_data = all_surface_data
             return
@@ -260,37 +601,10 @@ class DataAnalysis:
 
 if __name__ == '__main__':
     data_analysis = DataAnalysis("Naïve")
-    data_analysis.generate_all_columns()
     # data_analysis.plot_surface('mean')
     # data_analysis.plot_surface('seq')
     # data_analysis.plot_surface('percent_from_control', color_map='RdYlGn')
-    data_analysis.plot_for_grant('percent_from_control', color_map='RdYlGn')
-    frist_two = data_analysis.grant_data
-    da2 = DataAnalysis("CLP (HemeV)")
-    da2.generate_all_columns()
-    da2.plot_for_grant2('percent_from_control', color_map='RdYlGn')
-    third = da2.grant_data
-    _, x, y = data_analysis.get_surface_data(0, "Naïve", "percent_from_control")
-    frist_two.append(third[0])
-    all_surface_data = frist_two
-    all_surface_data = np.concatenate(all_surface_data, axis=1)
-    print(all_surface_data)
-    # set size
-    plt.figure(figsize=(7, 7))
-    plt.imshow(all_surface_data, cmap="RdYlGn", norm=colors.CenteredNorm())
-    plt.colorbar()
-    plt.xticks(np.arange(len(y * 3)), y * 3, rotation=80)
-    plt.yticks(np.arange(len(x)), x)
-    # put x tick on top
-    ax = plt.gca()
-    ax.xaxis.tick_top()
-    # plot a line to separate the groups
-    plt.axvline(x=len(y) - 0.5, color='black')
-    plt.axvline(x=len(y) * 2 - 0.5, color='black')
-    # mark the groups on the bottom
-    plt.text(len(y) / 2 - 0.5, 19, 'Heme', ha='center', va='center', fontsize=12)
-    plt.text(len(y) * 1.5 - 0.5, 19, 'Sepsis', ha='center', va='center', fontsize=12)
-    plt.text(len(y) * 2.5 - 0.5, 19, 'Sepsis + Heme', ha='center', va='center', fontsize=12)
+    all_surface_data, x, y = data_analysis.get_composite_surface(
+        0, grant_surface_controls(data_analysis.data_reader.group_list))
+    draw_composite_figure(all_surface_data, x, y)
     plt.show()
-
-
@@ -0,0 +1,153 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: DataQuery.py
+@time: 10/18/26 11:02
+"""
+import re
+
+import numpy as np
+
+
+class TagFilter:
+    """
+    select the tags of one level by name, prefix or regex, minus the tags that contain an excluded substring
+    e.g. TagFilter(exclude=('IL7', '+')) is every tag without 'IL7' and '+'
+    """
+
+    def __init__(self, tags=None, prefix=None, regex=None, exclude=()):
+        """
+        :param tags: a list of tag names, None for every tag
+        :param prefix: a prefix or a tuple of prefixes the tag has to start with
+        :param regex: a pattern the tag has to contain (re.search)
+        :param exclude: substrings, a tag that contains one of them is left out
+        """
+        self.tags = None if tags is None else set(tags)
+        self.prefix = prefix
+        self.regex = None if regex is None else re.compile(regex)
+        self.exclude = (exclude,) if isinstance(exclude, str) else tuple(exclude)
+
+    def match(self, tag):
+        if self.tags is not None and tag not in self.tags:
+            return False
+        if self.prefix is not None and not tag.startswith(self.prefix):
+            return False
+        if self.regex is not None and not self.regex.search(tag):
+            return False
+        return not any(excluded in tag for excluded in self.exclude)
+
+    def filter(self, tag_list):
+        """
+        :param tag_list: a list of tags
+        :return: the matching tags, in the order of tag_list
+        """
+        return [tag for tag in tag_list if self.match(tag)]
+
+
+class QueryResult:
+    """
+    the selected data stacked in one array, one row per existing data tag combination (e.g. cell type and marker
+    pair), one column per subject of the selected groups
+    """
+
+    def __init__(self, data, tag_labels, group_labels, subject_index):
+        self.data = data  # numpy array of shape (data tag combination, subject)
+        self.tag_labels = tag_labels  # for every data tag level, the tag of every row
+        self.group_labels = group_labels  # group of every column
+        self.subject_index = subject_index  # index of every column on the subject axis of DataReaderCsv.data
+
+    @property
+    def cell_labels(self):
+        return self.tag_labels[0]
+
+    @property
+    def marker_labels(self):
+        return self.tag_labels[1]
+
+
+class DataQuery:
+    """
+    query layer of DataReaderCsv.get_data
+    every tag level has an inverted index (tag name: position), so a query only touches the tags it selects instead of
+    building a key for every group, cell type and marker
+    a query is one spec per level: 'all', a tag name, a list of tag names or a TagFilter
+    """
+
+    def __init__(self, data_reader):
+        self.data_reader = data_reader
+        self.tag_lists = [data_reader.group_list] + data_reader.data_tag_lists
+        self.tag_index = [data_reader.group_index] + data_reader.data_tag_indexes
+        self.group_columns = [np.arange(data_reader.group_slices[group_tag].start,
+                                        data_reader.group_slices[group_tag].stop)
+                              for group_tag in data_reader.group_list]
+
+    def resolve(self, level, spec):
+        """
+        :param level: 0 group, 1 cell type, 2 marker, 3... the extra data tag levels
+        :param spec: 'all', a tag name, a list of tag names or a TagFilter
+        :return: int array of the selected positions on that level
+        """
+        tag_index = self.tag_index[level]
+        if isinstance(spec, TagFilter):
+            if spec.tags is not None and spec.prefix is None and spec.regex is None:
+                #  only names, look them up instead of scanning the level
+                positions = sorted(tag_index[tag] for tag in spec.tags if tag in tag_index and spec.match(tag))
+            else:
+                positions = [i for i, tag in enumerate(self.tag_lists[level]) if spec.match(tag)]
+        elif isinstance(spec, str):
+            if spec.lower() == 'all':
+                return np.arange(len(self.tag_lists[level]))
+            positions = [tag_index[spec]] if spec in tag_index else []
+        else:
+            positions = [tag_index[tag] for tag in spec if tag in tag_index]
+        return np.array(positions, dtype=np.int64)
+
+    def match_tags(self, level, spec):
+        """
+        :return: the tag names selected by spec on one level
+        """
+        return [self.tag_lists[level][i] for i in self.resolve(level, spec)]
+
+    def select(self, data_tag_list):
+        """
+        :param data_tag_list: one spec per level, e.g. ['all', 'BCell', TagFilter(prefix='p')]
+        :return: group positions, a tuple of the positions on every data tag level of the existing combinations
+        """
+        if len(data_tag_list) != len(self.tag_lists):
+            raise ValueError(f'expected {len(self.tag_lists)} tags (group and data tags), got {len(data_tag_list)}')
+        groups, *tags = [self.resolve(level, spec) for level, spec in enumerate(data_tag_list)]
+        #  only the selected block of the mask is looked at, combinations come out in the order of the old loops
+        points = np.nonzero(self.data_reader.data_mask[np.ix_(*tags)])
+        return groups, tuple(level_tags[level_points] for level_tags, level_points in zip(tags, points))
+
+    def get_dict(self, data_tag_list):
+        """
+        :return: a dict of views into data, key: 'group|cell|marker', same as DataReaderCsv.get_data
+        """
+        groups, points = self.select(data_tag_list)
+        data = self.data_reader.data
+        group_list = self.tag_lists[0]
+        #  the key part and the index of every combination, built once for all groups
+        point_keys = ['|'.join(tags) for tags in zip(*[[tag_list[i] for i in level_points.tolist()]
+                                                       for tag_list, level_points in zip(self.tag_lists[1:], points)])]
+        point_index = list(zip(*[level_points.tolist() for level_points in points]))
+        data_to_return = {}
+        for group in groups:
+            group_slice = self.data_reader.group_slices[group_list[group]]
+            for point_key, index in zip(point_keys, point_index):
+                data_to_return[group_list[group] + '|' + point_key] = data[index + (group_slice,)]
+        return data_to_return
+
+    def get_array(self, data_tag_list):
+        """
+        :return: QueryResult with all selected values stacked in one array
+        """
+        groups, points = self.select(data_tag_list)
+        subject_index = np.concatenate([self.group_columns[group] for group in groups]) if len(groups) \
+            else np.zeros(0, dtype=np.int64)
+        group_labels = np.array(self.tag_lists[0])[np.repeat(groups, [len(self.group_columns[group])
+                                                                      for group in groups])]
+        data = self.data_reader.data[points][:, subject_index]
+        return QueryResult(data, [np.array(tag_list)[level_points]
+                                  for tag_list, level_points in zip(self.tag_lists[1:], points)],
+                           group_labels, subject_index)
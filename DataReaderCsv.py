@@ -7,93 +7,558 @@
 @time: 5/3/23 23:40
 """
 import csv
+import glob
+import hashlib
+import json
+import os
+import tempfile
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 
+from AggregationStats import get_statistic
+from DataAggregates import DataAggregates
+from DataQuery import DataQuery
+
 
 class DataReaderCsv:
     """
     read data from csv file for cytof data
-    todo: support more data tag layers, current only support 2 layers
+    every row starts with row_tag_num data tags (ROW_TAG_NUM by default: cell type, marker), more levels such as
+    tissue, stimulation or time point are extra tag columns
+    all values are kept in one dense float array shaped (data tag 1, ..., data tag n, subject column), a combination
+    of tags that does not exist in the csv is filled with nan and marked as False in data_mask
+    in streaming mode the csv is read in chunks of rows and only running aggregates per (group, data tags) are kept,
+    repeated rows of the same data tags are pooled, the raw data is not available
+    file_path can also be a list of files or a glob pattern, e.g. one export per acquisition batch, the files are
+    parsed in parallel and merged, subjects of the same group are put next to each other in file order
     """
     HEADER_ROW_NUM = 2  # the number of header rows
+    SUBJECT_TAG_ROW = 0  # the row number of subject id, first row is 0
     GROUP_TAG_ROW = 1  # the row number of group tag, first row is 0
-    ROW_TAG_NUM = 2  # the number of columns of row tags
+    ROW_TAG_NUM = 2  # the default number of columns of row tags
+    CACHE_VERSION = 3  # bump when the layout of the cache files changes
+    CACHE_SUFFIX = '.cache'  # cache files are <csv path>.cache.npy (data) and <csv path>.cache.json (metadata)
+    CHUNK_SIZE = 10000  # the number of rows parsed at once in streaming mode
 
-    def __init__(self, file_path):
-        self.file_path = file_path
+    def __init__(self, file_path, use_cache=True, streaming=False, chunk_size=CHUNK_SIZE, max_workers=None,
+                 row_tag_num=ROW_TAG_NUM):
+        if row_tag_num < 2:
+            raise ValueError(f'at least 2 row tag columns are needed, got {row_tag_num}')
+        self.row_tag_num = row_tag_num  # the number of columns of row tags, one data tag level per column
+        self.file_paths = self.resolve_file_paths(file_path)  # all csv files to read
+        self.file_path = self.file_paths[0] if len(self.file_paths) == 1 else file_path
+        self.max_workers = max_workers  # the number of processes used to parse several files
+        self.partial_rows = False  # True if some merged files miss a cell type and marker pair that others have
+        self.cached = False  # True if the binary cache next to the csv holds the current data
+        self._query = None  # DataQuery, indexed access to data
+        self.use_cache = use_cache  # read from / write to the binary cache next to the csv
+        self.streaming = streaming  # only keep running aggregates, for files larger than memory
+        self.chunk_size = chunk_size
+        self.aggregates = None  # DataAggregates, only in streaming mode
         self.group_tag_dict = {}  # group tag dictionary, key: value = group name: [start, end] index (absolute index)
-        self.data_tag_dict = {}  # data tag dictionary, {layer1-1: [layer2-1, layer2-2, ...], layer1-2: [...], ...}
-        self.all_data = {}  # all data
+        #  data tag dictionary, {layer1-1: ['layer2-1|layer3-1|...', 'layer2-2|layer3-2|...', ...], layer1-2: [...]}
+        self.data_tag_dict = {}
+        self.data = None  # all data, numpy array of shape (data tag 1, ..., data tag n, subject column)
+        self.data_mask = None  # bool array of shape (data tag 1, ..., data tag n), True if the tags exist in the csv
         self.group_list = []  # list of group tags
+        self.data_tag_lists = []  # list of the tags of every level
         self.data_tag1_list = []  # list of data tag 1, cells
         self.data_tag2_list = []  # list of data tag 2, markers
+        self.group_index = {}  # group name: index in group_list
+        self.data_tag_indexes = [{} for _ in range(row_tag_num)]  # for every level, tag name: index on its axis
+        self.data_tag1_index = self.data_tag_indexes[0]  # cell name: index on axis 0 of data
+        self.data_tag2_index = self.data_tag_indexes[1]  # marker name: index on axis 1 of data
+        self.group_slices = {}  # group name: slice of the subject axis of data
+        self.subject_list = []  # subject id of every column of the subject axis of data
+        self.subject_index = {}  # subject id: index on the subject axis of data
         self.read_data()
         self.generate_all_tag_list()
 
+    @property
+    def all_data(self):
+        """
+        dict like view of data, key: 'group|cell|marker' (one tag per level), value: 1d view into data
+        """
+        return AllDataView(self)
+
     def generate_all_tag_list(self):
         """
         get all tags in the data
         :return: a list of all tags in the data
         """
-        data_tag2_temp_dict = {}
-        for group_tag in self.group_tag_dict:
-            self.group_list.append(group_tag)
-        for data_tag in self.data_tag_dict:
-            self.data_tag1_list.append(data_tag)
-            for sub_tag in self.data_tag_dict[data_tag]:
-                data_tag2_temp_dict[sub_tag] = 1
-        self.data_tag2_list = list(data_tag2_temp_dict.keys())
+        self.group_list = list(self.group_tag_dict.keys())
+        self.group_index = {tag: i for i, tag in enumerate(self.group_list)}
+        self.group_slices = {tag: slice(start - self.row_tag_num, end - self.row_tag_num)
+                             for tag, (start, end) in self.group_tag_dict.items()}
+        self.subject_index = {subject: i for i, subject in enumerate(self.subject_list)}
+        self.data_tag1_index, self.data_tag2_index = self.data_tag_indexes[:2]
+        self.data_tag_lists = [list(data_tag_index.keys()) for data_tag_index in self.data_tag_indexes]
+        self.data_tag1_list, self.data_tag2_list = self.data_tag_lists[:2]
+
+    def index_data_tags(self):
+        """
+        give every tag its index, the first level keeps the order of data_tag_dict, the other levels the order they
+        first show up when walking data_tag_dict
+        :return: None
+        """
+        for data_tag, sub_tags in self.data_tag_dict.items():
+            self.data_tag_indexes[0].setdefault(data_tag, len(self.data_tag_indexes[0]))
+            for sub_tag in sub_tags:
+                for data_tag_index, tag in zip(self.data_tag_indexes[1:], sub_tag.split('|')):
+                    data_tag_index.setdefault(tag, len(data_tag_index))
 
     def read_data(self):
+        """
+        read the data from the binary cache if it is still valid, otherwise parse the csv and write the cache
+        :return: None
+        """
+        if len(self.file_paths) > 1:
+            self.read_files()
+            return
+        if self.streaming:
+            self.stream_csv()
+            return
+        if self.use_cache and self.load_cache():
+            self.cached = True
+            return
+        self.parse_csv()
+        if self.use_cache:
+            self.cached = self.save_cache()
+
+    def parse_csv(self):
         # read csv line by line
         with open(self.file_path, 'r') as f:
             reader = csv.reader(f)
-            # deal with header rows
-            for header_row in range(self.HEADER_ROW_NUM):
-                header = next(reader)[self.ROW_TAG_NUM:]
-                #  if need to do something with individual subject, do it here
-                #  get group tag
-                if header_row == self.GROUP_TAG_ROW:
-                    self.get_group_range(header)
-            #  iterate through each row
+            subject_num = self.read_header(reader)
+            #  iterate through each row, only keep the row tags and the raw values
+            data_tags = []
+            values = []
             for row in reader:
                 #  get data tag
-                data_tag = self.get_data_tag(row[:self.ROW_TAG_NUM])
-                for group_tag in self.group_tag_dict:
-                    #  store data in all_data as a numpy array
-                    self.all_data[group_tag + '|' + data_tag] = np.array(row[self.group_tag_dict[group_tag][0]:
-                                                                             self.group_tag_dict[group_tag][1]],
-                                                                         dtype=np.float64)
-            # print(len(list(self.all_data.items())))
+                data_tags.append(self.get_data_tag(row[:self.row_tag_num]).split('|'))
+                values.append(row[self.row_tag_num:self.row_tag_num + subject_num])
+        self.index_data_tags()
+        #  one int array per level, the index of every row on that axis
+        tag_index = tuple(np.array([data_tag_index[data_tag[level]] for data_tag in data_tags], dtype=np.int64)
+                          for level, data_tag_index in enumerate(self.data_tag_indexes))
+        values = np.array(values, dtype=np.float64).reshape(-1, subject_num)
+        #  scatter the rows into the dense array, a duplicated row overwrites the previous one
+        shape = tuple(len(data_tag_index) for data_tag_index in self.data_tag_indexes)
+        self.data = np.full(shape + (subject_num,), np.nan)
+        self.data_mask = np.zeros(shape, dtype=bool)
+        self.data[tag_index] = values
+        self.data_mask[tag_index] = True
+
+    def read_header(self, reader):
+        """
+        read the header rows, the subject ids and the group range of every group
+        :param reader: csv reader at the start of the file
+        :return: the number of subject columns
+        """
+        subject_num = 0
+        for header_row in range(self.HEADER_ROW_NUM):
+            header = next(reader)[self.row_tag_num:]
+            #  get group tag
+            if header_row == self.GROUP_TAG_ROW:
+                self.get_group_range(header)
+                subject_num = len(header)
+            elif header_row == self.SUBJECT_TAG_ROW:
+                self.subject_list = [subject.strip() for subject in header]
+        #  a file without subject ids gets the column number as id
+        self.subject_list = self.subject_list[:subject_num] + \
+            [str(i) for i in range(len(self.subject_list), subject_num)]
+        return subject_num
+
+    @staticmethod
+    def resolve_file_paths(file_path):
+        """
+        :param file_path: a csv path, a glob pattern or a list of csv paths
+        :return: a list of csv paths, a glob pattern is expanded in sorted order
+        """
+        if isinstance(file_path, (list, tuple)):
+            return list(file_path)
+        if glob.has_magic(file_path):
+            file_paths = sorted(glob.glob(file_path))
+            if not file_paths:
+                raise FileNotFoundError(f'no file matches {file_path}')
+            return file_paths
+        return [file_path]
+
+    def read_files(self):
+        """
+        parse every file in its own process and merge the results
+        the parsed arrays come back as .npy files (the binary cache or a temporary file) that are memory mapped here,
+        only the tag metadata is pickled
+        :return: None
+        """
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(read_file_worker, self.file_paths,
+                                        [self.use_cache] * len(self.file_paths),
+                                        [self.streaming] * len(self.file_paths),
+                                        [self.chunk_size] * len(self.file_paths),
+                                        [self.row_tag_num] * len(self.file_paths)))
+        #  merge the tags in file order
+        for result in results:
+            for data_tag, sub_tags in result['data_tag_dict'].items():
+                merged_sub_tags = self.data_tag_dict.setdefault(data_tag, [])
+                merged_sub_tags.extend(sub_tag for sub_tag in dict.fromkeys(sub_tags) if sub_tag not in merged_sub_tags)
+        self.index_data_tags()
+        group_columns = {}  # group name: [(file index, start, end), ...] relative to the subject axis of each file
+        for file_index, result in enumerate(results):
+            for group_tag, (start, end) in result['group_tag_dict'].items():
+                group_columns.setdefault(group_tag, []).append(
+                    (file_index, start - self.row_tag_num, end - self.row_tag_num))
+        #  subjects of one group are contiguous in the merged data
+        subject_num = 0
+        for group_tag, columns in group_columns.items():
+            group_size = sum(end - start for _, start, end in columns)
+            self.group_tag_dict[group_tag] = [subject_num + self.row_tag_num,
+                                              subject_num + group_size + self.row_tag_num]
+            subject_num += group_size
+            for file_index, start, end in columns:
+                self.subject_list.extend(results[file_index]['subject_list'][start:end])
+        shape = tuple(len(data_tag_index) for data_tag_index in self.data_tag_indexes)
+        self.data_mask = np.zeros(shape, dtype=bool)
+        tag_maps = []  # for every file, the merged index of its tags on every level
+        for result in results:
+            tag_maps.append([np.array([data_tag_index[tag] for tag in data_tag_list], dtype=np.int64)
+                             for data_tag_index, data_tag_list in zip(self.data_tag_indexes, result['data_tag_lists'])])
+            self.data_mask[np.ix_(*tag_maps[-1])] |= result['data_mask']
+        if self.streaming:
+            self.aggregates = DataAggregates(len(self.group_tag_dict), self.row_tag_num)
+            self.aggregates.resize(*shape)
+            group_index = {group_tag: i for i, group_tag in enumerate(self.group_tag_dict)}
+            for result, tag_map in zip(results, tag_maps):
+                self.aggregates.merge(result['aggregates'], [group_index[group_tag]
+                                                             for group_tag in result['group_tag_dict']], *tag_map)
+            return
+        self.data = np.full(shape + (subject_num,), np.nan)
+        file_data = [np.load(result['data_path'], mmap_mode='r') for result in results]
+        for group_tag, columns in group_columns.items():
+            target_start = self.group_tag_dict[group_tag][0] - self.row_tag_num
+            for file_index, start, end in columns:
+                self.data[np.ix_(*tag_maps[file_index], np.arange(target_start, target_start + end - start))] = \
+                    file_data[file_index][..., start:end]
+                target_start += end - start
+        for result, tag_map in zip(results, tag_maps):
+            file_mask = np.zeros(shape, dtype=bool)
+            file_mask[np.ix_(*tag_map)] = result['data_mask']
+            self.partial_rows |= bool((self.data_mask & ~file_mask).any())
+        del file_data
+        for result in results:
+            if result['temporary']:
+                os.remove(result['data_path'])
+
+    def stream_csv(self):
+        """
+        read the csv in chunks of rows and only keep running aggregates per (group, data tags)
+        :return: None
+        """
+        with open(self.file_path, 'r') as f:
+            reader = csv.reader(f)
+            subject_num = self.read_header(reader)
+            group_slices = [slice(start - self.row_tag_num, end - self.row_tag_num)
+                            for start, end in self.group_tag_dict.values()]
+            self.aggregates = DataAggregates(len(group_slices), self.row_tag_num)
+            #  tags of every level in the order they show up in the csv, reordered at the end
+            stream_indexes = [{} for _ in range(self.row_tag_num)]
+            seen_data_tags = set()
+            chunk_index = []
+            chunk_values = []
+            for row in reader:
+                data_tags = tuple(tag.replace(' ', '') for tag in row[:self.row_tag_num])
+                #  a repeated row is pooled into the same point, so it is only listed once in data_tag_dict
+                if data_tags not in seen_data_tags:
+                    seen_data_tags.add(data_tags)
+                    self.data_tag_dict.setdefault(data_tags[0], []).append('|'.join(data_tags[1:]))
+                chunk_index.append([stream_index.setdefault(tag, len(stream_index))
+                                    for stream_index, tag in zip(stream_indexes, data_tags)])
+                chunk_values.append(row[self.row_tag_num:self.row_tag_num + subject_num])
+                if len(chunk_values) == self.chunk_size:
+                    self.add_chunk(chunk_index, chunk_values, group_slices, stream_indexes)
+                    chunk_index = []
+                    chunk_values = []
+            self.add_chunk(chunk_index, chunk_values, group_slices, stream_indexes)
+        #  tags in the same order as parse_csv
+        self.index_data_tags()
+        self.aggregates.reorder(*[np.array([stream_index[tag] for tag in data_tag_index], dtype=np.int64)
+                                  for stream_index, data_tag_index in zip(stream_indexes, self.data_tag_indexes)])
+        self.data_mask = self.aggregates.counts.sum(axis=0) > 0
+
+    def add_chunk(self, chunk_index, chunk_values, group_slices, stream_indexes):
+        """
+        add one chunk of rows to the running aggregates
+        :param chunk_index: list of the tag index on every level of each row
+        :param chunk_values: list of the raw value strings of each row
+        :param group_slices: slice of each group on the subject columns
+        :param stream_indexes: the tags seen so far on every level
+        :return: None
+        """
+        if not chunk_values:
+            return
+        self.aggregates.resize(*[len(stream_index) for stream_index in stream_indexes])
+        tag_index = tuple(np.array(chunk_index, dtype=np.int64).T)
+        values = np.array(chunk_values, dtype=np.float64)
+        for group_index, group_slice in enumerate(group_slices):
+            self.aggregates.add(group_index, tag_index, values[:, group_slice])
+
+    def cache_paths(self):
+        """
+        :return: path of the cached data array, path of the cache metadata
+        """
+        return self.file_path + self.CACHE_SUFFIX + '.npy', self.file_path + self.CACHE_SUFFIX + '.json'
+
+    def file_signature(self):
+        """
+        :return: size and mtime of the csv, the cache is checked against them before the content hash
+        """
+        stat = os.stat(self.file_path)
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    def file_hash(self):
+        """
+        :return: content hash of the csv
+        """
+        file_hash = hashlib.blake2b(digest_size=16)
+        with open(self.file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                file_hash.update(chunk)
+        return file_hash.hexdigest()
+
+    def cache_layout(self):
+        """
+        :return: the reader settings the cache was written with, a cache written with other settings is not used
+        """
+        return {'version': self.CACHE_VERSION, 'header_row_num': self.HEADER_ROW_NUM,
+                'group_tag_row': self.GROUP_TAG_ROW, 'subject_tag_row': self.SUBJECT_TAG_ROW,
+                'row_tag_num': self.row_tag_num}
+
+    def load_cache(self):
+        """
+        memory map the cached data if the csv has not changed since the cache was written
+        the cache is valid if size and mtime match, or if the size matches and the content hash is the same
+        :return: True if the data was loaded from the cache
+        """
+        data_path, meta_path = self.cache_paths()
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            signature = self.file_signature()
+            if meta['layout'] != self.cache_layout() or meta['size'] != signature['size']:
+                return False
+            if meta['mtime_ns'] != signature['mtime_ns']:
+                if meta['hash'] != self.file_hash():
+                    return False
+                #  same content with a new mtime, e.g. touched or copied, remember the new mtime
+                meta['mtime_ns'] = signature['mtime_ns']
+                self.write_json(meta_path, meta)
+            data = np.load(data_path, mmap_mode='r')
+        except (OSError, ValueError, KeyError):
+            return False
+        self.group_tag_dict = meta['group_tag_dict']
+        self.subject_list = meta['subject_list']
+        self.data_tag_dict = meta['data_tag_dict']
+        self.data_tag_indexes = [{tag: i for i, tag in enumerate(data_tag_list)}
+                                 for data_tag_list in meta['data_tag_lists']]
+        self.data_mask = np.array(meta['data_mask'], dtype=bool).reshape(data.shape[:-1])
+        self.data = data
+        return True
+
+    def save_cache(self):
+        """
+        write the parsed data next to the csv, the metadata is written last so a half written cache is never used
+        :return: True if the cache was written
+        """
+        data_path, meta_path = self.cache_paths()
+        meta = dict(self.file_signature(), hash=self.file_hash(), layout=self.cache_layout(),
+                    group_tag_dict=self.group_tag_dict, subject_list=self.subject_list,
+                    data_tag_dict=self.data_tag_dict,
+                    data_tag_lists=[list(data_tag_index) for data_tag_index in self.data_tag_indexes],
+                    data_mask=self.data_mask.tolist())
+        try:
+            with open(data_path + '.tmp', 'wb') as f:
+                np.save(f, self.data)
+            os.replace(data_path + '.tmp', data_path)
+            self.write_json(meta_path, meta)
+        except OSError:
+            #  the cache is only an optimization, e.g. the csv folder may be read only
+            return False
+        return True
+
+    @staticmethod
+    def write_json(path, obj):
+        with open(path + '.tmp', 'w') as f:
+            json.dump(obj, f)
+        os.replace(path + '.tmp', path)
 
-    def get_data(self, data_tag_list):
+    def get_data(self, data_tag_list, as_array=False):
         """
         get data from all_data
-        :param data_tag_list: a list of all data tags, including group tag. e.g. ['group1', 'data1', 'data2']
+        :param data_tag_list: a list of all data tags, including group tag. e.g. ['group1', 'data1', 'data2'], one tag
+        per data tag level
         if you want all data in a group or a data_tag, use 'all' instead of the specific tag
-        :return: the numpy array of the selected data
-        """
-        list_of_data_to_get = []
-        list_of_individual_tag = []
-        for index, tag in enumerate(data_tag_list):
-            if tag.lower() == 'all':
-                list_of_individual_tag.append([])
-                if index == 0:
-                    list_of_individual_tag[index] = self.group_list
-                elif index == 1:
-                    list_of_individual_tag[index] = self.data_tag1_list
-                elif index == 2:
-                    list_of_individual_tag[index] = self.data_tag2_list
-            else:
-                list_of_individual_tag.append([tag])
-        data_to_return = {}
-        for group_tag_get in list_of_individual_tag[0]:
-            for data_tag_get in list_of_individual_tag[1]:
-                for sub_tag_get in list_of_individual_tag[2]:
-                    final_tag = group_tag_get + '|' + data_tag_get + '|' + sub_tag_get
-                    if final_tag in self.all_data:
-                        data_to_return[final_tag] = self.all_data[final_tag]
-        return data_to_return
+        a tag can also be a list of tags or a DataQuery.TagFilter, e.g. TagFilter(exclude=('IL7', '+'))
+        :param as_array: return one stacked DataQuery.QueryResult instead of a dict
+        :return: a dict of views into data, key: 'group|cell|marker', value: 1d numpy array of the selected data
+        """
+        self.check_raw_data()
+        if as_array:
+            return self.query.get_array(data_tag_list)
+        return self.query.get_dict(data_tag_list)
+
+    @property
+    def query(self):
+        """
+        the DataQuery of this reader, built on first use
+        """
+        if self._query is None:
+            self._query = DataQuery(self)
+        return self._query
+
+    def get_group_data(self, group_tag):
+        """
+        get all data of one group
+        :param group_tag: the group name
+        :return: a view into data of shape (data tag 1, ..., data tag n, subject in the group)
+        """
+        self.check_raw_data()
+        return self.data[..., self.group_slices[group_tag]]
+
+    def get_subject_data(self, subject):
+        """
+        get all data of one subject
+        :param subject: the subject id from the first header row
+        :return: a view into data of shape (data tag 1, ..., data tag n)
+        """
+        self.check_raw_data()
+        return self.data[..., self.subject_index[subject]]
+
+    def group_means(self, statistic='mean'):
+        """
+        mean (or another statistic) of every group and data tag combination in one pass of axis reductions
+        :param statistic: a statistic of AggregationStats, only the mean is available in streaming mode
+        :return: numpy array of shape (group, data tag 1, ..., data tag n), nan where the data tags are missing
+        """
+        if self.aggregates is not None and statistic == 'mean':
+            return self.aggregates.mean()
+        return np.stack([self.group_mean(group_tag, statistic) for group_tag in self.group_list])
+
+    def group_mean(self, group_tag, statistic='mean'):
+        """
+        mean (or another statistic) of one group, same as its slice of group_means
+        :param group_tag: the group name
+        :param statistic: a statistic of AggregationStats
+        :return: numpy array of shape (data tag 1, ..., data tag n)
+        """
+        aggregate = get_statistic(statistic, self.aggregates is not None)
+        if self.aggregates is not None:
+            group_index = self.group_index[group_tag]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return self.aggregates.sums[group_index] / self.aggregates.counts[group_index]
+        #  merged files that miss a row leave nan subjects, the statistic is over the subjects that have the row
+        return aggregate(self.get_group_data(group_tag), self.partial_rows)
+
+    def append_subjects(self, group_tag, values, subject_ids=None):
+        """
+        append subject columns to a group, e.g. newly acquired animals, a group that does not exist yet is added after
+        the last group, the subjects of a group stay next to each other on the subject axis
+        the binary cache is not touched, it still holds the csv
+        :param group_tag: the group name
+        :param values: numpy array of shape (data tag 1, ..., data tag n, new subject) in the tag order of this reader,
+        nan where a subject has no value
+        :param subject_ids: the id of every new subject, the column number by default
+        :return: bool array of the shape of data_mask, True where the new subjects have a value
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if values.ndim == self.data_mask.ndim:
+            values = values[..., None]
+        if values.shape[:-1] != self.data_mask.shape:
+            raise ValueError(f'values of shape {values.shape} do not match the data tags {self.data_mask.shape}')
+        subject_num = values.shape[-1]
+        if subject_ids is None:
+            subject_ids = [str(i) for i in range(len(self.subject_list), len(self.subject_list) + subject_num)]
+        if len(subject_ids) != subject_num:
+            raise ValueError(f'{len(subject_ids)} subject ids for {subject_num} subjects')
+        new_valid = ~np.isnan(values)
+        touched = new_valid.any(axis=-1)
+        #  new columns go at the end of the group, the groups after it move right
+        if group_tag not in self.group_tag_dict:
+            self.group_tag_dict[group_tag] = [len(self.subject_list) + self.row_tag_num] * 2
+            if self.aggregates is not None:
+                self.aggregates.add_group()
+        end = self.group_tag_dict[group_tag][1]
+        for tag, group_range in self.group_tag_dict.items():
+            if tag != group_tag and group_range[0] >= end:
+                group_range[0] += subject_num
+                group_range[1] += subject_num
+        self.group_tag_dict[group_tag][1] += subject_num
+        end -= self.row_tag_num
+        self.subject_list[end:end] = list(subject_ids)
+        if self.data is not None:
+            #  a subject without a value in a row the others have, or the other way round, leaves nan subjects
+            self.partial_rows |= bool((new_valid != (self.data_mask | touched)[..., None]).any() or
+                                      self.data.shape[-1] and (touched & ~self.data_mask).any())
+            self.data = np.concatenate([self.data[..., :end], values, self.data[..., end:]], axis=-1)
+            self.cached = False
+        else:
+            points = np.nonzero(touched)
+            self.aggregates.add(list(self.group_tag_dict).index(group_tag), points, values[points])
+        for point in zip(*np.nonzero(touched & ~self.data_mask)):
+            tags = [data_tag_list[i] for data_tag_list, i in zip(self.data_tag_lists, point)]
+            self.data_tag_dict.setdefault(tags[0], []).append('|'.join(tags[1:]))
+        self.data_mask = self.data_mask | touched
+        self.generate_all_tag_list()
+        self._query = None
+        return touched
+
+    def read_subjects(self, file_path):
+        """
+        read a csv of new subjects with the same layout and put its values in the tag order of this reader
+        :param file_path: the csv of the new subjects
+        :return: a list of (group name, values, subject ids), the arguments of append_subjects for every group
+        """
+        new_reader = DataReaderCsv(file_path, use_cache=False, row_tag_num=self.row_tag_num)
+        tag_maps = []
+        for data_tag_index, data_tag_list in zip(self.data_tag_indexes, new_reader.data_tag_lists):
+            unknown = [tag for tag in data_tag_list if tag not in data_tag_index]
+            if unknown:
+                raise ValueError(f'{file_path} has data tags that are not in the data: {unknown}')
+            tag_maps.append(np.array([data_tag_index[tag] for tag in data_tag_list], dtype=np.int64))
+        new_subjects = []
+        for group_tag in new_reader.group_list:
+            group_slice = new_reader.group_slices[group_tag]
+            values = np.full(self.data_mask.shape + (group_slice.stop - group_slice.start,), np.nan)
+            values[np.ix_(*tag_maps)] = new_reader.data[..., group_slice]
+            new_subjects.append((group_tag, values, new_reader.subject_list[group_slice]))
+        return new_subjects
+
+    def check_raw_data(self, control_group=None):
+        """
+        :param control_group: also check that this control group is in the data, the analyses of the raw data compare
+        against one
+        """
+        if self.data is None:
+            raise ValueError('raw data is not kept in streaming mode, only the running aggregates are available')
+        if control_group is not None:
+            self.check_control_group(control_group)
+
+    def check_control_group(self, control_group):
+        if control_group not in self.group_index:
+            raise ValueError(f'control group {control_group} is not in the data')
+
+    def fixed_tag_index(self, fixed_tags):
+        """
+        index of the data tag levels after marker, which a (cell type, marker) surface needs fixed
+        :param fixed_tags: a dict of axis: tag, the axes are numbered like DataAnalysis.all_data_tags (3 is the first
+        level after marker)
+        :return: a tuple of the tag index of every level after marker
+        """
+        fixed_tags = fixed_tags or {}
+        if sorted(fixed_tags) != list(range(3, len(self.data_tag_indexes) + 1)):
+            raise ValueError(f'fix every data tag level after marker, axes 3 to {len(self.data_tag_indexes)}')
+        return tuple(self.data_tag_indexes[axis - 1][fixed_tags[axis]] for axis in sorted(fixed_tags))
 
     def get_group_range(self, group_header):
         """
@@ -105,23 +570,81 @@ class DataReaderCsv:
         last_cut_index = 0
         for i in range(1, len(group_header)):
             if group_header[i] != group_header[i - 1]:
-                self.group_tag_dict[group_header[i - 1]] = [last_cut_index + self.ROW_TAG_NUM, i + self.ROW_TAG_NUM]
+                self.group_tag_dict[group_header[i - 1]] = [last_cut_index + self.row_tag_num, i + self.row_tag_num]
                 last_cut_index = i
-        self.group_tag_dict[group_header[last_cut_index]] = [last_cut_index + self.ROW_TAG_NUM,
-                                                             len(group_header) + self.ROW_TAG_NUM]
+        self.group_tag_dict[group_header[last_cut_index]] = [last_cut_index + self.row_tag_num,
+                                                             len(group_header) + self.row_tag_num]
 
     def get_data_tag(self, tags):
         data_tag_list = []
         for tag in tags:
             data_tag_list.append(tag.replace(' ', ''))  # remove space
         data_tag = '|'.join(data_tag_list)
+        sub_tag = '|'.join(data_tag_list[1:])
         if data_tag_list[0] not in self.data_tag_dict:
-            self.data_tag_dict[data_tag_list[0]] = [data_tag_list[1]]
+            self.data_tag_dict[data_tag_list[0]] = [sub_tag]
         else:
-            self.data_tag_dict[data_tag_list[0]].append(data_tag_list[1])
+            self.data_tag_dict[data_tag_list[0]].append(sub_tag)
         return data_tag
 
 
+def read_file_worker(file_path, use_cache, streaming, chunk_size, row_tag_num):
+    """
+    parse one csv in a worker process of DataReaderCsv.read_files
+    :return: a dict of the tag metadata, plus the path of the .npy file that holds the data, or the aggregates in
+    streaming mode
+    """
+    data_reader = DataReaderCsv(file_path, use_cache=use_cache, streaming=streaming, chunk_size=chunk_size,
+                                row_tag_num=row_tag_num)
+    result = {'group_tag_dict': data_reader.group_tag_dict, 'subject_list': data_reader.subject_list,
+              'data_tag_dict': data_reader.data_tag_dict, 'data_tag_lists': data_reader.data_tag_lists,
+              'data_mask': data_reader.data_mask, 'aggregates': data_reader.aggregates, 'data_path': None,
+              'temporary': False}
+    if streaming:
+        return result
+    data_path = data_reader.cache_paths()[0]
+    if not data_reader.cached:
+        #  no usable cache next to the csv, hand the data over in a temporary file
+        fd, data_path = tempfile.mkstemp(suffix='.npy')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, data_reader.data)
+        result['temporary'] = True
+    result['data_path'] = data_path
+    return result
+
+
+class AllDataView(Mapping):
+    """
+    read only dict view of DataReaderCsv.data, keeps the old all_data api ('group|cell|marker': 1d array) working
+    without storing one small array per key, with more data tag levels the key has one more tag per level
+    """
+
+    def __init__(self, data_reader):
+        self.data_reader = data_reader
+
+    def __getitem__(self, key):
+        data_tags = key.split('|')
+        if len(data_tags) != self.data_reader.row_tag_num + 1:
+            raise KeyError(key)
+        data = self.data_reader.get_data(data_tags)
+        if key not in data:
+            raise KeyError(key)
+        return data[key]
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except (KeyError, ValueError, AttributeError):
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(self.data_reader.get_data(['all'] * (self.data_reader.row_tag_num + 1)))
+
+    def __len__(self):
+        return len(self.data_reader.group_list) * int(self.data_reader.data_mask.sum())
+
+
 if __name__ == '__main__':
     drs = DataReaderCsv('MiceCYTOF.csv')
     print(drs.get_data(['CLP (IL7V)', 'BCell', 'pERK']))
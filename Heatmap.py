@@ -0,0 +1,168 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: Heatmap.py
+@time: 10/18/26 11:00
+"""
+import math
+
+import numpy as np
+from matplotlib import colors
+from matplotlib.collections import PathCollection
+from matplotlib.font_manager import FontProperties
+from matplotlib.path import Path
+from matplotlib.textpath import TextPath, text_to_path
+from matplotlib.transforms import IdentityTransform
+
+MIN_FONT_SIZE = 4  # annotations that would be smaller than this are not drawn
+MAX_FONT_SIZE = 10
+LABEL_SPACING = 1.3  # space taken by one tick label, in multiples of its font size
+
+
+class GlyphCache:
+    """
+    glyph outlines of single characters, the annotation of a cell is put together from them instead of laying out
+    a new text path for every cell
+    """
+
+    def __init__(self, font_properties=None):
+        self.font_properties = font_properties or FontProperties()
+        self.glyphs = {}  # character: (vertices at size 1, codes, advance at size 1)
+        self.paths = {}  # (text, size): centered path
+
+    def glyph(self, character):
+        if character not in self.glyphs:
+            path = TextPath((0, 0), character, size=1, prop=self.font_properties)
+            #  the advance of a character, measured on a run of it so the ink of the last one does not count
+            size = 100
+            font_properties = self.font_properties.copy()
+            font_properties.set_size(size)
+            width = text_to_path.get_text_width_height_descent(character * 11, font_properties, ismath=False)[0]
+            single = text_to_path.get_text_width_height_descent(character, font_properties, ismath=False)[0]
+            self.glyphs[character] = (path.vertices, path.codes, (width - single) / 10 / size)
+        return self.glyphs[character]
+
+    def path(self, text, size):
+        """
+        :param text: the annotation
+        :param size: the font size in points
+        :return: a path of the text in points, centered at 0, 0
+        """
+        key = (text, size)
+        if key not in self.paths:
+            vertices = []
+            codes = []
+            x = 0
+            for character in text:
+                glyph_vertices, glyph_codes, advance = self.glyph(character)
+                if len(glyph_vertices):
+                    vertices.append(glyph_vertices + [x, 0])
+                    codes.append(glyph_codes)
+                x += advance
+            if not vertices:
+                self.paths[key] = Path(np.zeros((1, 2)), [Path.MOVETO])
+                return self.paths[key]
+            #  center horizontally on the advance, vertically on the height of a digit
+            center = np.array([x / 2, self.glyph('0')[0][:, 1].max() / 2])
+            self.paths[key] = Path((np.concatenate(vertices) - center) * size, np.concatenate(codes))
+        return self.paths[key]
+
+
+GLYPH_CACHE = GlyphCache()
+
+
+def axes_size_points(ax):
+    """
+    :return: width, height of the axes in points
+    """
+    ax.apply_aspect()
+    bbox = ax.get_window_extent()
+    return bbox.width * 72 / ax.figure.dpi, bbox.height * 72 / ax.figure.dpi
+
+
+def set_thinned_ticks(ax, axis, labels, font_size, rotation=0):
+    """
+    set one tick per label, but only every n-th label if they would overlap
+    :param ax: the axes
+    :param axis: 'x' or 'y'
+    :param labels: the label of every row / column
+    :param font_size: the font size of the labels
+    :param rotation: the rotation of the labels
+    :return: None
+    """
+    width, height = axes_size_points(ax)
+    length = width if axis == 'x' else height
+    #  a label perpendicular to the axis takes one line, a parallel label takes its whole text length
+    if axis == 'x' and rotation < 45 or axis == 'y' and rotation >= 45:
+        label_length = max((len(str(label)) for label in labels), default=1) * font_size * 0.6
+    else:
+        label_length = font_size * LABEL_SPACING
+    step = max(1, math.ceil(len(labels) * label_length / max(length, 1)))
+    ticks = np.arange(0, len(labels), step)
+    if axis == 'x':
+        ax.set_xticks(ticks, [labels[i] for i in ticks], rotation=rotation, fontsize=font_size)
+    else:
+        ax.set_yticks(ticks, [labels[i] for i in ticks], rotation=rotation, fontsize=font_size)
+
+
+def annotate_cells(ax, data, image, fmt='{:.2f}', font_size=None):
+    """
+    write the value of every cell as one PathCollection, white on dark cells and black on light cells
+    :param ax: the axes
+    :param data: 2d numpy array, nan cells are not annotated
+    :param image: the AxesImage of the data, for the cell colors
+    :param fmt: format of the values
+    :param font_size: the font size, fitted to the cell size if None
+    :return: the PathCollection, None if the annotations would be too small to read
+    """
+    data = np.asarray(data, dtype=np.float64)
+    rows, cols = np.nonzero(~np.isnan(data))
+    if len(rows) == 0:
+        return None
+    texts = [fmt.format(value) for value in data[rows, cols]]
+    if font_size is None:
+        width, height = axes_size_points(ax)
+        cell_width = width / data.shape[1]
+        cell_height = height / data.shape[0]
+        font_size = min(MAX_FONT_SIZE, cell_height * 0.7, cell_width / (0.65 * max(len(text) for text in texts)))
+        if font_size < MIN_FONT_SIZE:
+            return None
+        font_size = round(font_size * 2) / 2  # few distinct sizes keep the glyph cache small
+    paths = [GLYPH_CACHE.path(text, font_size) for text in texts]
+    rgba = image.cmap(image.norm(data[rows, cols]))
+    luminance = rgba[:, :3] @ np.array([0.299, 0.587, 0.114])
+    text_colors = np.where(luminance[:, None] < 0.5, [[1, 1, 1, 1]], [[0, 0, 0, 1]])
+    #  sizes=1 scales the paths from points to pixels at draw time, so any dpi works
+    collection = PathCollection(paths, sizes=[1], offsets=np.column_stack([cols, rows]),
+                                offset_transform=ax.transData, transform=IdentityTransform(),
+                                facecolors=text_colors, edgecolors='none')
+    ax.add_collection(collection, autolim=False)
+    return collection
+
+
+def heatmap(ax, data, x_labels, y_labels, color_map='gist_earth_r', centered=False, annotate=False, fmt='{:.2f}',
+            colorbar=True, x_rotation=60, label_size=10, aspect=None):
+    """
+    draw a heatmap with optional value annotations, the number of artists does not grow with the number of cells
+    :param ax: the axes to draw in
+    :param data: 2d numpy array
+    :param x_labels: the label of every column
+    :param y_labels: the label of every row
+    :param color_map: the color map
+    :param centered: put the center of the color bar at 0
+    :param annotate: write the value of every cell
+    :param fmt: format of the annotations
+    :param colorbar: draw a color bar next to the heatmap
+    :param x_rotation: the rotation of the x labels
+    :param label_size: the font size of the tick labels
+    :param aspect: the aspect of the cells, 'auto' to fill the axes, square cells by default
+    :return: the AxesImage
+    """
+    image = ax.imshow(data, cmap=color_map, norm=colors.CenteredNorm() if centered else None, aspect=aspect)
+    if colorbar:
+        ax.figure.colorbar(image, ax=ax)
+    set_thinned_ticks(ax, 'x', list(x_labels), label_size, x_rotation)
+    set_thinned_ticks(ax, 'y', list(y_labels), label_size)
+    if annotate:
+        annotate_cells(ax, data, image, fmt)
+    return image
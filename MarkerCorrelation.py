@@ -0,0 +1,138 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: MarkerCorrelation.py
+@time: 10/18/26 11:26
+"""
+import numpy as np
+
+METHODS = ('pearson', 'spearman')
+
+
+def average_ranks(values):
+    """
+    rank along the last axis, tied values get the average of their ranks, nan stays nan and is not counted
+    one sort of every row, a run of tied values is found from its first and last position in the sorted row
+    :param values: numpy array of shape (..., subject)
+    :return: float array of the same shape, ranks start at 1
+    """
+    subject_num = values.shape[-1]
+    if subject_num == 0:
+        return np.array(values, dtype=np.float64)
+    order = np.argsort(values, axis=-1)  # nan is sorted to the end
+    sorted_values = np.take_along_axis(values, order, axis=-1)
+    position = np.broadcast_to(np.arange(1, subject_num + 1, dtype=np.float64), values.shape)
+    #  nan != nan, every nan is a run of its own and keeps its nan below
+    run_start = np.ones(values.shape, dtype=bool)
+    run_start[..., 1:] = sorted_values[..., 1:] != sorted_values[..., :-1]
+    run_end = np.ones(values.shape, dtype=bool)
+    run_end[..., :-1] = run_start[..., 1:]
+    first = np.maximum.accumulate(np.where(run_start, position, 0), axis=-1)
+    last = np.flip(np.minimum.accumulate(np.flip(np.where(run_end, position, subject_num + 1), axis=-1), axis=-1),
+                   axis=-1)
+    ranks = np.empty(values.shape)
+    np.put_along_axis(ranks, order, (first + last) / 2, axis=-1)
+    ranks[np.isnan(values)] = np.nan
+    return ranks
+
+
+def pearson_matrices(values, has_nan=False):
+    """
+    pearson correlation of every pair of rows of the last two axes, as one batched matrix product over the subject
+    axis
+    :param values: numpy array of shape (..., marker, subject)
+    :param has_nan: some values are nan, every pair is then computed over the subjects that have both values
+    :return: numpy array of shape (..., marker, marker), nan where a marker has no spread
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if not has_nan:
+            centered = values - values.mean(axis=-1, keepdims=True)
+            normalized = centered / np.sqrt(np.square(centered).sum(axis=-1, keepdims=True))
+            correlation = normalized @ np.swapaxes(normalized, -1, -2)
+        else:
+            #  sums over the subjects both markers have, each one a matrix product with the valid mask
+            valid = (~np.isnan(values)).astype(np.float64)
+            filled = np.where(np.isnan(values), 0, values)
+            valid_t, filled_t = np.swapaxes(valid, -1, -2), np.swapaxes(filled, -1, -2)
+            count = valid @ valid_t
+            sum_x, sum_y = filled @ valid_t, valid @ filled_t
+            sum_xx, sum_yy = np.square(filled) @ valid_t, valid @ np.square(filled_t)
+            covariance = filled @ filled_t - sum_x * sum_y / count
+            variance_x = sum_xx - np.square(sum_x) / count
+            variance_y = sum_yy - np.square(sum_y) / count
+            correlation = covariance / np.sqrt(variance_x * variance_y)
+    correlation[~np.isfinite(correlation)] = np.nan
+    return np.clip(correlation, -1, 1)
+
+
+class MarkerCorrelation:
+    """
+    which markers move together across the subjects of a group, a marker by marker correlation matrix for every
+    (group, cell type) pair, and how much it differs from the control group
+    all matrices of a group are one batched matrix product of the (cell type, ..., marker, subject) block with its
+    transpose, spearman is pearson of the average ranks of the subjects
+    when subjects miss values (merged or appended files, DataReaderCsv.partial_rows) every marker is ranked over the
+    subjects it has, not over the subjects a pair of markers shares, so spearman is then an approximation for the
+    pairs whose markers miss different subjects, pearson stays exact over the shared subjects
+    """
+    PLOT_TYPES = ('correlation', 'correlation_difference')
+
+    def __init__(self, data_reader, control_group):
+        """
+        :param data_reader: DataReaderCsv, the raw data is needed, so not in streaming mode
+        :param control_group: the name of the control group
+        """
+        data_reader.check_raw_data(control_group)
+        self.data_reader = data_reader
+        self.control_group = control_group
+        self._correlation = {}  # method: correlation matrices
+
+    def correlation(self, method='pearson'):
+        """
+        :param method: 'pearson' or 'spearman' (approximate with partial rows, see MarkerCorrelation)
+        :return: numpy array of shape (group, cell type, ..., marker, marker), the data tag levels after marker come
+        before the two marker axes, nan where a marker does not exist or has no spread
+        """
+        if method not in METHODS:
+            raise ValueError(f'unknown method {method}, use one of {METHODS}')
+        if method not in self._correlation:
+            #  markers next to the subject axis, the matrix product runs over the last two axes
+            data = np.moveaxis(self.data_reader.data, 1, -2)
+            correlation = []
+            for group_tag in self.data_reader.group_list:
+                values = data[..., self.data_reader.group_slices[group_tag]]
+                has_nan = self.data_reader.partial_rows
+                if method == 'spearman':
+                    values = average_ranks(values)
+                correlation.append(pearson_matrices(values, has_nan))
+            self._correlation[method] = np.stack(correlation)
+        return self._correlation[method]
+
+    def difference(self, method='pearson'):
+        """
+        :param method: 'pearson' or 'spearman'
+        :return: correlation - the correlation of the control group, same shape as correlation
+        """
+        correlation = self.correlation(method)
+        return correlation - correlation[self.data_reader.group_index[self.control_group]]
+
+    def surface(self, group_tag, cell_type, plot_type='correlation', method='pearson', fixed_tags=None):
+        """
+        marker by marker matrix of one group and cell type
+        :param group_tag: the group
+        :param cell_type: the cell type
+        :param plot_type: 'correlation' or 'correlation_difference' (against the control group)
+        :param method: 'pearson' or 'spearman'
+        :param fixed_tags: a dict of axis: tag for the data tag levels after marker, the axes are numbered like
+        DataAnalysis.all_data_tags (3 is the first level after marker)
+        :return: numpy array of shape (marker, marker)
+        """
+        if plot_type == 'correlation':
+            values = self.correlation(method)
+        elif plot_type == 'correlation_difference':
+            values = self.difference(method)
+        else:
+            raise ValueError(f'unknown plot type {plot_type}, use one of {self.PLOT_TYPES}')
+        fixed_tag_index = self.data_reader.fixed_tag_index(fixed_tags)
+        return values[(self.data_reader.group_index[group_tag], self.data_reader.data_tag_indexes[0][cell_type]) +
+                      fixed_tag_index]
@@ -0,0 +1,156 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: ResultStore.py
+@time: 10/18/26 11:18
+"""
+import json
+import os
+
+import numpy as np
+
+FORMAT_VERSION = 1
+MANIFEST_NAME = 'manifest.json'
+
+
+def save_array(path, array):
+    """
+    write one array as .npy, through a temporary file so a reader never sees a half written file
+    """
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, np.ascontiguousarray(array))
+    os.replace(path + '.tmp', path)
+
+
+def export_results(analysis_cube, output_dir, control_groups=None, axis_names=None, statistic='mean'):
+    """
+    write the analysis cube as one .npy file per array plus a small json manifest, see ResultStore
+    :param analysis_cube: AnalysisCube
+    :param output_dir: the folder of the files, created if needed, an earlier export in it is replaced
+    :param control_groups: the control groups percent_from_control is exported against, the cube control group by
+    default
+    :param axis_names: the name of every axis, e.g. DataAnalysis.all_data_tags_name
+    :param statistic: the statistic the mean of the cube is, see AggregationStats
+    :return: the path of the manifest
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    control_groups = list(dict.fromkeys(control_groups or [analysis_cube.control_group]))
+    ndim = analysis_cube.mean.ndim
+    manifest = {'version': FORMAT_VERSION, 'shape': list(analysis_cube.mean.shape),
+                'axis_names': list(axis_names or [f'Tag {axis}' for axis in range(ndim)]),
+                'control_group': analysis_cube.control_group, 'statistic': statistic,
+                'tags': [f'tags_{axis}.npy' for axis in range(ndim)],
+                'data_mask': 'data_mask.npy', 'mean': 'mean.npy',
+                'seq': [f'seq_{axis}.npy' for axis in range(ndim)],
+                'percent_from_control': {control_group: f'percent_from_control_{i}.npy'
+                                         for i, control_group in enumerate(control_groups)},
+                'point_stats': {name: f'point_stats_{name}.npy' for name in analysis_cube.point_stats}}
+    for axis in range(ndim):
+        save_array(os.path.join(output_dir, manifest['tags'][axis]), np.array(analysis_cube.all_data_tags[axis]))
+        #  a rank is smaller than the number of tags of its axis
+        save_array(os.path.join(output_dir, manifest['seq'][axis]), analysis_cube.seq(axis).astype(np.int32))
+    save_array(os.path.join(output_dir, manifest['data_mask']), analysis_cube.valid[0])
+    save_array(os.path.join(output_dir, manifest['mean']), analysis_cube.mean)
+    percent_from_controls = analysis_cube.get_percent_from_controls(control_groups)
+    for control_group, percent_from_control in zip(control_groups, percent_from_controls):
+        save_array(os.path.join(output_dir, manifest['percent_from_control'][control_group]), percent_from_control)
+    for name, values in analysis_cube.point_stats.items():
+        save_array(os.path.join(output_dir, manifest['point_stats'][name]), values)
+    #  the manifest is written last, a folder with a manifest always has every file it lists
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    return manifest_path
+
+
+class ResultStore:
+    """
+    read only view of an exported analysis (export_results, DataAnalysis.export_results) without the csv
+    the arrays are memory mapped when they are first used, a surface only reads the pages of its slice, so opening
+    the results is instant and the full cube is never loaded
+    """
+
+    def __init__(self, output_dir):
+        """
+        :param output_dir: the folder export_results wrote to
+        """
+        self.output_dir = output_dir
+        with open(os.path.join(output_dir, MANIFEST_NAME), 'r') as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('version') != FORMAT_VERSION:
+            raise ValueError(f'{output_dir} has format version {self.manifest.get("version")}, '
+                             f'expected {FORMAT_VERSION}')
+        self.all_data_tags = [np.load(os.path.join(output_dir, file_name)).tolist()
+                              for file_name in self.manifest['tags']]
+        self.all_data_tags_name = self.manifest['axis_names']
+        self.control_group = self.manifest['control_group']
+        self.statistic = self.manifest['statistic']  # what the exported mean is, e.g. 'median'
+        self.control_groups = list(self.manifest['percent_from_control'])
+        self.tag_index = [{tag: i for i, tag in enumerate(axis)} for axis in self.all_data_tags]
+        self._arrays = {}  # file name: memory mapped array
+
+    def load(self, file_name):
+        """
+        :param file_name: a file of the manifest
+        :return: the memory mapped array
+        """
+        if file_name not in self._arrays:
+            self._arrays[file_name] = np.load(os.path.join(self.output_dir, file_name), mmap_mode='r')
+        return self._arrays[file_name]
+
+    def get_array(self, plot_type, all_data_tag_index=0, control_group=None):
+        """
+        :param plot_type: 'seq', 'mean', 'percent_from_control' or the name of an exported point stat
+        :param all_data_tag_index: the focused axis of seq
+        :param control_group: the control group of percent_from_control, the exported control group by default
+        :return: the memory mapped array of shape (group, cell type, marker, ...)
+        """
+        if plot_type == 'seq':
+            return self.load(self.manifest['seq'][all_data_tag_index])
+        if plot_type == 'mean':
+            return self.load(self.manifest['mean'])
+        if plot_type == 'percent_from_control':
+            control_group = control_group or self.control_group
+            if control_group not in self.manifest['percent_from_control']:
+                raise ValueError(f'percent_from_control against {control_group} was not exported, '
+                                 f'use one of {self.control_groups}')
+            return self.load(self.manifest['percent_from_control'][control_group])
+        if plot_type in self.manifest['point_stats']:
+            return self.load(self.manifest['point_stats'][plot_type])
+        raise ValueError(f'unknown plot type {plot_type}')
+
+    def surface_axes(self, all_data_tag_index, fixed_tags=None):
+        """
+        :return: the two axes the surface is drawn over, see AnalysisCube.surface_axes
+        """
+        fixed_tags = fixed_tags or {}
+        axes = [axis for axis in range(len(self.all_data_tags))
+                if axis != all_data_tag_index and axis not in fixed_tags]
+        if len(axes) != 2:
+            raise ValueError(f'a surface needs exactly 2 free axes, got {axes}, fix the other axes with fixed_tags')
+        return axes
+
+    def get_surface_data(self, all_data_tag_index, surface_name, plot_type, control_group=None, fixed_tags=None):
+        """
+        same surface as DataAnalysis.get_surface_data, only its slice is read from the files
+        :param all_data_tag_index: 0, 1, 2, ..., which axis is the focused variable
+        :param surface_name: what is the focused variable of the surface
+        :param plot_type: 'seq', 'mean', 'percent_from_control' or an exported point stat, e.g. 'q_value'
+        :param control_group: the control group of percent_from_control, the exported control group by default
+        :param fixed_tags: a dict of axis: tag for the axes beyond the surface, e.g. {3: 'Spleen'}
+        :return: surfaced data (nan where the point does not exist), x label, y label
+        """
+        axes = self.surface_axes(all_data_tag_index, fixed_tags)
+        fixed_tags = dict(fixed_tags or {})
+        fixed_tags[all_data_tag_index] = surface_name
+        index = tuple(self.tag_index[axis][fixed_tags[axis]] if axis in fixed_tags else slice(None)
+                      for axis in range(len(self.all_data_tags)))
+        surface = np.array(self.get_array(plot_type, all_data_tag_index, control_group)[index])
+        if plot_type == 'seq':
+            surface = surface.astype(np.int64)
+        #  the group axis is the first axis, the mask has every other axis
+        valid = np.broadcast_to(self.load(self.manifest['data_mask'])[index[1:]], surface.shape)
+        if not valid.all():
+            surface = np.where(valid, surface, np.nan)
+        return surface, self.all_data_tags[axes[1]], self.all_data_tags[axes[0]]
@@ -0,0 +1,196 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: Significance.py
+@time: 10/18/26 11:09
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from AggregationStats import nan_quantiles
+
+CORRECTIONS = ('bh', 'bonferroni', 'none')
+
+
+def adjust_p_values(p_values, correction='bh'):
+    """
+    multiple testing correction over every non nan p value of the array
+    :param p_values: numpy array of p values, nan where there is no test
+    :param correction: 'bh' (Benjamini-Hochberg false discovery rate), 'bonferroni' or 'none'
+    :return: numpy array of the same shape, the adjusted p values
+    """
+    if correction not in CORRECTIONS:
+        raise ValueError(f'unknown correction {correction}, use one of {CORRECTIONS}')
+    p_values = np.asarray(p_values, dtype=np.float64)
+    q_values = np.full(p_values.shape, np.nan)
+    tested = ~np.isnan(p_values)
+    p = p_values[tested]
+    if correction == 'bonferroni':
+        q = p * len(p)
+    elif correction == 'bh':
+        order = np.argsort(p)
+        #  p * n / rank, made monotone from the largest p value down
+        q = np.empty(len(p))
+        q[order] = np.minimum.accumulate((p[order] * len(p) / np.arange(1, len(p) + 1))[::-1])[::-1]
+    else:
+        q = p
+    q_values[tested] = np.minimum(q, 1)
+    return q_values
+
+
+def weighted_means(values, valid, weights):
+    """
+    the mean of every point under every resample as two matrix products
+    :param values: numpy array of shape (point, subject), nan replaced by 0
+    :param valid: float array of shape (point, subject), 1 where the subject has a value
+    :param weights: numpy array of shape (subject, resample), how often each subject is drawn in each resample
+    :return: numpy array of shape (point, resample)
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (values @ weights) / (valid @ weights)
+
+
+def percent_change(mean, control_mean):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (mean - control_mean) / control_mean
+
+
+def resample_points(data, group_slices, control_index, bootstrap_weights, permutation_masks, alpha):
+    """
+    bootstrap confidence interval and permutation p value of percent_from_control for a block of points
+    runs in a worker process when Significance has max_workers
+    :param data: numpy array of shape (..., subject), the raw data of the block
+    :param group_slices: slice of every group on the subject axis
+    :param control_index: the index of the control group
+    :param bootstrap_weights: for every group, numpy array of shape (subject in the group, resample)
+    :param permutation_masks: for every group, numpy array of shape (subject in the group and in the control group,
+    resample), 1 where the subject is labeled as the group
+    :param alpha: 1 - the confidence level of the interval
+    :return: ci_low, ci_high, p_value, each of shape (group, ...)
+    """
+    shape = data.shape[:-1]
+    data = data.reshape(-1, data.shape[-1])
+    valid = (~np.isnan(data)).astype(np.float64)
+    values = np.where(np.isnan(data), 0, data)
+    control_slice = group_slices[control_index]
+    control_bootstrap = weighted_means(values[:, control_slice], valid[:, control_slice],
+                                       bootstrap_weights[control_index])
+    ci_low = np.full((len(group_slices), len(data)), np.nan)
+    ci_high = np.full((len(group_slices), len(data)), np.nan)
+    p_value = np.full((len(group_slices), len(data)), np.nan)
+    for group_index, group_slice in enumerate(group_slices):
+        if group_index == control_index:
+            continue
+        bootstrap = percent_change(weighted_means(values[:, group_slice], valid[:, group_slice],
+                                                  bootstrap_weights[group_index]), control_bootstrap)
+        ci_low[group_index], ci_high[group_index] = nan_quantiles(bootstrap, [alpha / 2, 1 - alpha / 2])
+        #  pool the group and the control, every resample relabels the pooled subjects
+        pooled_values = np.concatenate([values[:, group_slice], values[:, control_slice]], axis=1)
+        pooled_valid = np.concatenate([valid[:, group_slice], valid[:, control_slice]], axis=1)
+        mask = permutation_masks[group_index]
+        group_sums = pooled_values @ mask
+        group_counts = pooled_valid @ mask
+        control_sums = pooled_values.sum(axis=1, keepdims=True) - group_sums
+        control_counts = pooled_valid.sum(axis=1, keepdims=True) - group_counts
+        with np.errstate(divide='ignore', invalid='ignore'):
+            permuted = np.abs(percent_change(group_sums / group_counts, control_sums / control_counts))
+            group_mean = values[:, group_slice].sum(axis=1) / valid[:, group_slice].sum(axis=1)
+            control_mean = values[:, control_slice].sum(axis=1) / valid[:, control_slice].sum(axis=1)
+            observed = np.abs(percent_change(group_mean, control_mean))
+        #  the observed labeling counts as one of the permutations, so p is never 0
+        extreme = np.count_nonzero(permuted >= observed[:, None] * (1 - 1e-12), axis=1)
+        p_value[group_index] = np.where(np.isnan(observed), np.nan, (extreme + 1) / (mask.shape[1] + 1))
+    return (ci_low.reshape((-1,) + shape), ci_high.reshape((-1,) + shape), p_value.reshape((-1,) + shape))
+
+
+class Significance:
+    """
+    uncertainty of percent_from_control for every (group, cell type, marker) point against the control group
+    bootstrap: the subjects of every group are resampled with replacement, the confidence interval is the percentile
+    interval of the resampled percent_from_control
+    permutation: the group and control labels of the pooled subjects are shuffled, the p value is the share of
+    shuffles with an |percent_from_control| at least as large as the observed one
+    all resamples of all points are done as matrix products of the data with resample weight matrices, the weights
+    are drawn once from the seeded rng, so the result does not depend on how the points are split across processes
+    (up to floating point rounding of the matrix products)
+    """
+    RESAMPLE_NUM = 1000
+    BATCH_SIZE = 2 ** 22  # the number of (point, resample) values computed at once
+
+    def __init__(self, data_reader, control_group, resample_num=RESAMPLE_NUM, seed=0, alpha=0.05, correction='bh',
+                 max_workers=None):
+        """
+        :param data_reader: DataReaderCsv, the raw data is needed, so not in streaming mode
+        :param control_group: the name of the control group
+        :param resample_num: the number of bootstrap resamples and of permutations
+        :param seed: the seed of the rng
+        :param alpha: 1 - the confidence level of the interval
+        :param correction: multiple testing correction of the p values, 'bh', 'bonferroni' or 'none'
+        :param max_workers: split the markers across this many processes, None to run in this process
+        """
+        data_reader.check_raw_data(control_group)
+        if correction not in CORRECTIONS:
+            raise ValueError(f'unknown correction {correction}, use one of {CORRECTIONS}')
+        self.data_reader = data_reader
+        self.control_group = control_group
+        self.resample_num = resample_num
+        self.seed = seed
+        self.alpha = alpha
+        self.correction = correction
+        self.max_workers = max_workers
+        self._result = None
+
+    def resample_weights(self):
+        """
+        :return: the bootstrap weights and the permutation masks of every group
+        """
+        rng = np.random.default_rng(self.seed)
+        group_sizes = [group_slice.stop - group_slice.start for group_slice in
+                       (self.data_reader.group_slices[group_tag] for group_tag in self.data_reader.group_list)]
+        control_size = group_sizes[self.data_reader.group_index[self.control_group]]
+        bootstrap_weights = [rng.multinomial(size, np.full(size, 1 / size), size=self.resample_num).T.astype(np.float64)
+                             for size in group_sizes]
+        permutation_masks = [rng.permuted(np.tile(np.arange(size + control_size) < size, (self.resample_num, 1)),
+                                          axis=1).T.astype(np.float64)
+                             for size in group_sizes]
+        return bootstrap_weights, permutation_masks
+
+    def run(self):
+        """
+        :return: a dict of numpy arrays of shape (group, cell type, marker, ...): ci_low, ci_high, p_value and q_value
+        (p_value after the multiple testing correction), nan where the point does not exist, control points get a
+        0 interval and a p value of 1
+        """
+        if self._result is not None:
+            return self._result
+        data = self.data_reader.data
+        group_slices = [self.data_reader.group_slices[group_tag] for group_tag in self.data_reader.group_list]
+        control_index = self.data_reader.group_index[self.control_group]
+        bootstrap_weights, permutation_masks = self.resample_weights()
+        #  blocks of markers (the last data tag axis) small enough to keep the resampled means in memory
+        marker_num = data.shape[-2]
+        points_per_marker = int(np.prod(data.shape[:-2])) * len(group_slices)
+        block_size = max(1, self.BATCH_SIZE // max(1, points_per_marker * self.resample_num))
+        if self.max_workers:
+            block_size = min(block_size, -(-marker_num // self.max_workers))
+        blocks = [slice(start, min(start + block_size, marker_num)) for start in range(0, marker_num, block_size)]
+        block_args = [(np.ascontiguousarray(data[..., block, :]), group_slices, control_index, bootstrap_weights,
+                       permutation_masks, self.alpha) for block in blocks]
+        if self.max_workers and len(blocks) > 1:
+            with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+                block_results = list(executor.map(resample_points, *zip(*block_args)))
+        else:
+            block_results = [resample_points(*args) for args in block_args]
+        ci_low, ci_high, p_value = [np.concatenate(arrays, axis=-1) for arrays in zip(*block_results)]
+        valid = np.broadcast_to(self.data_reader.data_mask, p_value.shape)
+        for array in (ci_low, ci_high, p_value):
+            array[~valid] = np.nan
+        #  the control group is not tested
+        ci_low[control_index] = np.where(valid[control_index], 0, np.nan)
+        ci_high[control_index] = np.where(valid[control_index], 0, np.nan)
+        q_value = adjust_p_values(p_value, self.correction)
+        p_value[control_index] = np.where(valid[control_index], 1, np.nan)
+        q_value[control_index] = p_value[control_index]
+        self._result = {'ci_low': ci_low, 'ci_high': ci_high, 'p_value': p_value, 'q_value': q_value}
+        return self._result
@@ -0,0 +1,123 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: SubjectAnalysis.py
+@time: 10/18/26 11:11
+"""
+import warnings
+
+import numpy as np
+
+MAD_SCALE = 0.6745  # the MAD of a normal distribution in standard deviations
+MEAN_AD_SCALE = 0.7979  # the mean absolute deviation of a normal distribution in standard deviations
+
+
+class SubjectAnalysis:
+    """
+    per subject results, every subject of every group at once with reductions along the subject axis of
+    DataReaderCsv.data, the subjects are named by the ids of the first header row (DataReaderCsv.subject_list)
+    z_score: how many control standard deviations a subject is away from the control mean
+    robust_z_score: modified z score inside the own group, (value - group median) / MAD, a subject with an absolute
+    robust z score above OUTLIER_THRESHOLD is flagged as an outlier
+    """
+    OUTLIER_THRESHOLD = 3.5
+    PLOT_TYPES = ('value', 'z_score', 'robust_z_score', 'outlier')
+
+    def __init__(self, data_reader, control_group):
+        """
+        :param data_reader: DataReaderCsv, the raw data is needed, so not in streaming mode
+        :param control_group: the name of the control group
+        """
+        data_reader.check_raw_data(control_group)
+        self.data_reader = data_reader
+        self.control_group = control_group
+        self.subject_groups = np.empty(len(data_reader.subject_list), dtype=object)  # group of every subject
+        for group_tag, group_slice in data_reader.group_slices.items():
+            self.subject_groups[group_slice] = group_tag
+        self._z_score = None
+        self._robust_z_score = None
+
+    def z_score(self):
+        """
+        :return: numpy array of the same shape as data, nan where the point does not exist or the control group has no
+        spread
+        """
+        if self._z_score is None:
+            data = self.data_reader.data
+            control = data[..., self.data_reader.group_slices[self.control_group]]
+            with warnings.catch_warnings(), np.errstate(divide='ignore', invalid='ignore'):
+                warnings.simplefilter('ignore', category=RuntimeWarning)
+                control_mean = np.nanmean(control, axis=-1, keepdims=True)
+                control_std = np.nanstd(control, axis=-1, ddof=1, keepdims=True)
+                z_score = (data - control_mean) / control_std
+            z_score[~np.isfinite(z_score)] = np.nan
+            self._z_score = z_score
+        return self._z_score
+
+    def robust_z_score(self):
+        """
+        modified z score of every subject inside its own group, the mean absolute deviation is used where more than
+        half of the group has the same value (MAD is 0)
+        :return: numpy array of the same shape as data
+        """
+        if self._robust_z_score is None:
+            data = self.data_reader.data
+            #  np.median is vectorized, np.nanmedian is only needed when merged files left nan subjects
+            median_function = np.nanmedian if self.data_reader.partial_rows else np.median
+            robust_z_score = np.full(data.shape, np.nan)
+            with warnings.catch_warnings(), np.errstate(divide='ignore', invalid='ignore'):
+                warnings.simplefilter('ignore', category=RuntimeWarning)
+                for group_slice in self.data_reader.group_slices.values():
+                    group_data = data[..., group_slice]
+                    deviation = group_data - median_function(group_data, axis=-1, keepdims=True)
+                    mad = median_function(np.abs(deviation), axis=-1, keepdims=True) / MAD_SCALE
+                    mean_ad = np.nanmean(np.abs(deviation), axis=-1, keepdims=True) / MEAN_AD_SCALE
+                    robust_z_score[..., group_slice] = deviation / np.where(mad > 0, mad, mean_ad)
+            #  a group where every subject has the same value (0 / 0) has no outliers
+            robust_z_score[np.isnan(robust_z_score) & ~np.isnan(data)] = 0
+            self._robust_z_score = robust_z_score
+        return self._robust_z_score
+
+    def outliers(self, threshold=OUTLIER_THRESHOLD):
+        """
+        :param threshold: the absolute robust z score above which a subject is an outlier
+        :return: bool array of the same shape as data
+        """
+        return np.abs(np.nan_to_num(self.robust_z_score())) > threshold
+
+    def outlier_subjects(self, threshold=OUTLIER_THRESHOLD):
+        """
+        :param threshold: the absolute robust z score above which a subject is an outlier
+        :return: a dict of subject id: the number of points where the subject is an outlier, only subjects with one
+        or more outlier points
+        """
+        counts = self.outliers(threshold).reshape(-1, len(self.data_reader.subject_list)).sum(axis=0)
+        return {self.data_reader.subject_list[i]: int(counts[i]) for i in np.nonzero(counts)[0]}
+
+    def surface(self, cell_type, plot_type='z_score', fixed_tags=None):
+        """
+        subject by marker surface of one cell type
+        :param cell_type: the cell type
+        :param plot_type: 'value', 'z_score', 'robust_z_score' or 'outlier'
+        :param fixed_tags: a dict of axis: tag for the data tag levels after marker, the axes are numbered like
+        DataAnalysis.all_data_tags (3 is the first level after marker)
+        :return: numpy array of shape (subject, marker)
+        """
+        if plot_type == 'value':
+            values = self.data_reader.data
+        elif plot_type == 'z_score':
+            values = self.z_score()
+        elif plot_type == 'robust_z_score':
+            values = self.robust_z_score()
+        elif plot_type == 'outlier':
+            values = self.outliers().astype(np.float64)
+        else:
+            raise ValueError(f'unknown plot type {plot_type}, use one of {self.PLOT_TYPES}')
+        index = (self.data_reader.data_tag_indexes[0][cell_type], slice(None)) + \
+            self.data_reader.fixed_tag_index(fixed_tags)
+        surface = values[index].T
+        #  markers the cell type does not have are left out of the analysis
+        valid = self.data_reader.data_mask[index][None, :]
+        if not valid.all():
+            surface = np.where(valid, surface, np.nan)
+        return surface
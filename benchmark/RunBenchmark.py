@@ -0,0 +1,150 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: RunBenchmark.py
+@time: 10/18/26 11:01
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from DataAnalysis import DataAnalysis
+from DataReaderCsv import DataReaderCsv
+from benchmark.SyntheticCsv import write_synthetic_csv
+
+
+def measure(function, repeat):
+    """
+    :param function: the function to measure, called without arguments
+    :param repeat: the number of runs
+    :return: the best time in seconds, the peak traced memory in bytes of the first run
+    """
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times), peak
+
+
+def get_benchmarks(file_path):
+    """
+    :param file_path: the synthetic csv
+    :return: a dict of benchmark name: function
+    """
+    data_reader = DataReaderCsv(file_path, use_cache=False)
+    cell = data_reader.data_tag1_list[0]
+    marker = data_reader.data_tag2_list[0]
+    #  the analysis is built once, the reader is timed by the read_data benchmarks only
+    data_analysis = DataAnalysis(file_path=file_path)
+
+    def cold():
+        """
+        drop the analysis results, so every run computes them again from the loaded data
+        """
+        data_analysis.analysis_cubes.clear()
+        data_analysis.surface_cache.clear()
+        data_analysis.all_columns.clear()
+        return data_analysis
+
+    def generate_all_columns():
+        cold().generate_all_columns()
+
+    def one_column_analysis():
+        cold().one_column_analysis(['all', cell, marker])
+
+    def get_surface_data():
+        cold().get_surface_data(0, 'Naïve', 'percent_from_control')
+
+    return {
+        'read_data': lambda: DataReaderCsv(file_path, use_cache=False),
+        'read_data_cached': lambda: DataReaderCsv(file_path),
+        'read_data_streaming': lambda: DataReaderCsv(file_path, streaming=True),
+        'get_data_point': lambda: data_reader.get_data(['Naïve', cell, marker]),
+        'get_data_all': lambda: data_reader.get_data(['all', 'all', 'all']),
+        'generate_all_columns': generate_all_columns,
+        'one_column_analysis': one_column_analysis,
+        'get_surface_data': get_surface_data,
+    }
+
+
+def run(sizes, repeat, selected=None):
+    """
+    :param sizes: a list of dicts with group_num, subjects_per_group, cell_num, marker_num
+    :param repeat: the number of timed runs of every benchmark
+    :param selected: the names of the benchmarks to run, all by default
+    :return: a list of result dicts
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for size in sizes:
+            file_path = os.path.join(temp_dir, 'synthetic_{group_num}_{subjects_per_group}_{cell_num}_{marker_num}.csv'
+                                     .format(**size))
+            write_synthetic_csv(file_path, **size)
+            DataReaderCsv(file_path)  # write the binary cache for read_data_cached
+            for name, function in get_benchmarks(file_path).items():
+                if selected and name not in selected:
+                    continue
+                seconds, peak_bytes = measure(function, repeat)
+                results.append(dict(size, benchmark=name, seconds=seconds, peak_bytes=peak_bytes))
+                print(f'{name:24s} {size} {seconds * 1000:10.2f} ms {peak_bytes / 2 ** 20:9.2f} MiB', flush=True)
+    return results
+
+
+def compare(results, baseline_path, threshold):
+    """
+    print the time ratio of every result against a previous run
+    :param results: the current results
+    :param baseline_path: a json file written by an earlier run
+    :param threshold: a ratio above this counts as a regression
+    :return: the number of regressions
+    """
+    with open(baseline_path, 'r') as f:
+        baseline = json.load(f)['results']
+    key_names = ('benchmark', 'group_num', 'subjects_per_group', 'cell_num', 'marker_num')
+    baseline = {tuple(result[key] for key in key_names): result for result in baseline}
+    regressions = 0
+    for result in results:
+        old = baseline.get(tuple(result[key] for key in key_names))
+        if old is None:
+            continue
+        ratio = result['seconds'] / old['seconds']
+        if ratio > threshold:
+            regressions += 1
+        print(f"{result['benchmark']:24s} x{ratio:6.2f} {'REGRESSION' if ratio > threshold else ''}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='time and peak memory of the reader and the analysis')
+    parser.add_argument('--groups', type=int, nargs='+', default=[4, 8])
+    parser.add_argument('--subjects', type=int, nargs='+', default=[5, 20], help='subjects per group')
+    parser.add_argument('--cells', type=int, nargs='+', default=[10, 30])
+    parser.add_argument('--markers', type=int, nargs='+', default=[20, 40])
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs of every benchmark, the best is kept')
+    parser.add_argument('--benchmarks', nargs='+', default=None, help='only run these benchmarks')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', default=None, help='a results json of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=1.2, help='slowdown ratio reported as a regression')
+    args = parser.parse_args()
+    sweep = [{'group_num': group_num, 'subjects_per_group': subjects, 'cell_num': cell_num, 'marker_num': marker_num}
+             for group_num, subjects, cell_num, marker_num in
+             itertools.product(args.groups, args.subjects, args.cells, args.markers)]
+    benchmark_results = run(sweep, args.repeat, args.benchmarks)
+    with open(args.output, 'w') as f:
+        json.dump({'python': sys.version, 'numpy': np.__version__, 'platform': platform.platform(),
+                   'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'results': benchmark_results}, f, indent=2)
+    if args.compare and compare(benchmark_results, args.compare, args.threshold):
+        sys.exit(1)
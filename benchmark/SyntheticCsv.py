@@ -0,0 +1,63 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: SyntheticCsv.py
+@time: 10/18/26 11:01
+"""
+import argparse
+import csv
+
+import numpy as np
+
+from DataReaderCsv import DataReaderCsv
+
+
+def write_synthetic_csv(file_path, group_num, subjects_per_group, cell_num, marker_num, seed=0,
+                        missing_fraction=0.0):
+    """
+    write a random cytof csv in the layout DataReaderCsv reads: HEADER_ROW_NUM header rows with the subject ids in
+    the first one and the group names in GROUP_TAG_ROW, then one row per cell type and marker that starts with
+    ROW_TAG_NUM tag columns
+    :param file_path: the csv to write
+    :param group_num: the number of groups, the first one is 'Naïve', the default control group
+    :param subjects_per_group: the number of subject columns of every group
+    :param cell_num: the number of cell types
+    :param marker_num: the number of markers
+    :param seed: seed of the random values
+    :param missing_fraction: the fraction of cell type and marker rows that are left out
+    :return: None
+    """
+    rng = np.random.default_rng(seed)
+    group_list = ['Naïve'] + [f'Group {i}' for i in range(1, group_num)]
+    subject_num = group_num * subjects_per_group
+    #  every group shifts every point a little, so the ranks and percent_from_control are not trivial
+    group_effect = rng.normal(0, 0.2, (group_num, cell_num, marker_num))
+    base = rng.normal(2, 1, (cell_num, marker_num))
+    keep = rng.random((cell_num, marker_num)) >= missing_fraction
+    with open(file_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        for header_row in range(DataReaderCsv.HEADER_ROW_NUM):
+            row_tags = [''] * DataReaderCsv.ROW_TAG_NUM
+            if header_row == DataReaderCsv.GROUP_TAG_ROW:
+                writer.writerow(row_tags + [group for group in group_list for _ in range(subjects_per_group)])
+            else:
+                writer.writerow(row_tags + [f'Subject {i}' for i in range(subject_num)])
+        for cell in range(cell_num):
+            log_mean = (base[cell] + group_effect[:, cell]).repeat(subjects_per_group, axis=0)
+            values = np.exp(rng.normal(log_mean, 0.3))
+            for marker in range(marker_num):
+                if keep[cell, marker]:
+                    writer.writerow([f'Cell {cell}', f'Marker {marker}'] + [f'{value:.4f}' for value in values[:, marker]])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='write a synthetic cytof csv')
+    parser.add_argument('file_path')
+    parser.add_argument('--groups', type=int, default=4)
+    parser.add_argument('--subjects', type=int, default=5, help='subjects per group')
+    parser.add_argument('--cells', type=int, default=20)
+    parser.add_argument('--markers', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--missing', type=float, default=0.0, help='fraction of missing cell type and marker rows')
+    args = parser.parse_args()
+    write_synthetic_csv(args.file_path, args.groups, args.subjects, args.cells, args.markers, args.seed, args.missing)
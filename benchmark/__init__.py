@@ -0,0 +1,7 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: __init__.py
+@time: 10/18/26 11:01
+benchmarks of the csv reader and the analysis, run from the repository root: python -m benchmark.RunBenchmark
+"""
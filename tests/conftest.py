@@ -0,0 +1,101 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: conftest.py
+@time: 10/18/26 11:35
+small csv fixtures built from benchmark.SyntheticCsv, run from the repository root: python -m pytest tests
+"""
+import csv
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DataReaderCsv import DataReaderCsv  # noqa: E402
+from benchmark.SyntheticCsv import write_synthetic_csv  # noqa: E402
+
+
+def read_rows(file_path):
+    with open(file_path, 'r', newline='') as f:
+        return list(csv.reader(f))
+
+
+def write_rows(file_path, rows):
+    with open(file_path, 'w', newline='') as f:
+        csv.writer(f).writerows(rows)
+
+
+def group_columns(rows, group_tag):
+    """
+    :return: the csv column indexes of the subjects of a group
+    """
+    return [i for i, tag in enumerate(rows[DataReaderCsv.GROUP_TAG_ROW]) if tag == group_tag]
+
+
+@pytest.fixture
+def tie_csv(tmp_path):
+    """
+    a synthetic csv with ties along every axis and a control group name that is part of another group name
+    groups: Naïve, CLP (the control group), CLP (HemeV), Copy (same values as Naïve)
+    """
+    file_path = str(tmp_path / 'ties.csv')
+    write_synthetic_csv(file_path, group_num=4, subjects_per_group=3, cell_num=5, marker_num=6, seed=1,
+                        missing_fraction=0.1)
+    rows = read_rows(file_path)
+    group_row = rows[DataReaderCsv.GROUP_TAG_ROW]
+    renamed = {'Group 1': 'CLP', 'Group 2': 'CLP (HemeV)', 'Group 3': 'Copy'}
+    rows[DataReaderCsv.GROUP_TAG_ROW] = [renamed.get(tag, tag) for tag in group_row]
+    data_rows = rows[DataReaderCsv.HEADER_ROW_NUM:]
+    #  a tie between groups, between the markers of a cell type and between the cell types of a marker
+    for row in data_rows:
+        for source, target in zip(group_columns(rows, 'Naïve'), group_columns(rows, 'Copy')):
+            row[target] = row[source]
+    rows_by_tags = {tuple(row[:DataReaderCsv.ROW_TAG_NUM]): row for row in data_rows}
+    for (cell, marker), row in rows_by_tags.items():
+        if marker == 'Marker 1' and (cell, 'Marker 0') in rows_by_tags:
+            row[DataReaderCsv.ROW_TAG_NUM:] = rows_by_tags[(cell, 'Marker 0')][DataReaderCsv.ROW_TAG_NUM:]
+        if cell == 'Cell 1' and ('Cell 0', marker) in rows_by_tags:
+            row[DataReaderCsv.ROW_TAG_NUM:] = rows_by_tags[('Cell 0', marker)][DataReaderCsv.ROW_TAG_NUM:]
+    write_rows(file_path, rows)
+    return file_path
+
+
+@pytest.fixture
+def append_csvs(tmp_path):
+    """
+    a synthetic csv split by subject columns: the base csv, the csv of the appended subjects (more subjects of the
+    control group and of another group, and a new group) and the csv of all of them in the order of a full rebuild
+    :return: base csv, appended csv, full csv
+    """
+    source = str(tmp_path / 'source.csv')
+    write_synthetic_csv(source, group_num=4, subjects_per_group=4, cell_num=4, marker_num=5, seed=2)
+    rows = read_rows(source)
+    tag_columns = list(range(DataReaderCsv.ROW_TAG_NUM))
+    naive, group_1, group_2, group_3 = (group_columns(rows, group_tag)
+                                        for group_tag in ('Naïve', 'Group 1', 'Group 2', 'Group 3'))
+    base_columns = naive[:3] + group_1[:2] + group_2
+    appended_columns = naive[3:] + group_1[2:] + group_3
+    full_columns = naive + group_1 + group_2 + group_3
+    paths = []
+    for name, columns in (('base', base_columns), ('appended', appended_columns), ('full', full_columns)):
+        file_path = str(tmp_path / f'{name}.csv')
+        write_rows(file_path, [[row[i] for i in tag_columns + columns] for row in rows])
+        paths.append(file_path)
+    return tuple(paths)
+
+
+def assert_columns_equal(columns, expected):
+    """
+    same column keys, same point order, same seq, means and percent_from_control equal up to float rounding
+    """
+    assert list(columns) == list(expected)
+    for column_key, column in columns.items():
+        assert list(column) == list(expected[column_key]), column_key
+        for point_key, point in column.items():
+            expected_point = expected[column_key][point_key]
+            assert point['seq'] == expected_point['seq'], point_key
+            for name in ('mean', 'percent_from_control'):
+                np.testing.assert_allclose(point[name], expected_point[name], rtol=1e-12, err_msg=point_key)
@@ -0,0 +1,90 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: test_aggregation_stats.py
+@time: 10/18/26 12:25
+"""
+import warnings
+
+import numpy as np
+import pytest
+
+from AggregationStats import get_statistic, median, nan_quantiles, quantile, trimmed_mean
+
+QUANTILES = [0, 0.1, 0.25, 0.5, 0.9, 1]
+
+
+def random_values(subject_num, nan_fraction=0.0, seed=0):
+    """
+    :return: values of shape (cell type, marker, subject) with ties, nan_fraction of them nan, the first point all nan
+    """
+    rng = np.random.default_rng(seed)
+    values = rng.integers(0, 20, (3, 4, subject_num)).astype(np.float64) + rng.uniform(0, 1, (3, 4, 1))
+    if nan_fraction:
+        values[rng.uniform(0, 1, values.shape) < nan_fraction] = np.nan
+        values[0, 0] = np.nan
+    return values
+
+
+def reference_trimmed_mean(values, proportion):
+    """
+    trimmed mean of every point written out: sort the valid values, cut int(proportion * n) from each end, mean
+    """
+    result = np.full(values.shape[:-1], np.nan)
+    for index in np.ndindex(values.shape[:-1]):
+        point = np.sort(values[index][~np.isnan(values[index])])
+        cut = int(proportion * len(point))
+        if len(point):
+            result[index] = point[cut:len(point) - cut].mean()
+    return result
+
+
+@pytest.mark.parametrize('subject_num', [1, 2, 7, 10])
+def test_quantile_matches_numpy(subject_num):
+    values = random_values(subject_num)
+    np.testing.assert_allclose(median(values), np.median(values, axis=-1), rtol=1e-12)
+    for q in QUANTILES:
+        np.testing.assert_allclose(quantile(values, q), np.quantile(values, q, axis=-1), rtol=1e-12)
+
+
+@pytest.mark.parametrize('subject_num', [1, 2, 7, 10])
+def test_nan_quantile_matches_numpy(subject_num):
+    values = random_values(subject_num, nan_fraction=0.3, seed=subject_num)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        np.testing.assert_allclose(median(values, has_nan=True), np.nanmedian(values, axis=-1), rtol=1e-12)
+        for q in QUANTILES:
+            np.testing.assert_allclose(quantile(values, q, has_nan=True), np.nanquantile(values, q, axis=-1),
+                                       rtol=1e-12)
+    np.testing.assert_allclose(nan_quantiles(values.reshape(-1, subject_num), QUANTILES),
+                               np.stack([quantile(values, q, has_nan=True).ravel() for q in QUANTILES]), rtol=1e-12)
+    assert np.isnan(median(values, has_nan=True)[0, 0])
+
+
+def test_quantile_without_nan_matches_the_nan_path():
+    values = random_values(9)
+    for q in QUANTILES:
+        np.testing.assert_allclose(quantile(values, q, has_nan=True), quantile(values, q), rtol=1e-12)
+
+
+@pytest.mark.parametrize('subject_num', [1, 2, 7, 10, 21])
+@pytest.mark.parametrize('proportion', [0.0, 0.1, 0.25, 0.4])
+def test_trimmed_mean_matches_reference(subject_num, proportion):
+    values = random_values(subject_num)
+    np.testing.assert_allclose(trimmed_mean(values, proportion=proportion),
+                               reference_trimmed_mean(values, proportion), rtol=1e-12)
+    with_nan = random_values(subject_num, nan_fraction=0.3, seed=subject_num)
+    np.testing.assert_allclose(trimmed_mean(with_nan, has_nan=True, proportion=proportion),
+                               reference_trimmed_mean(with_nan, proportion), rtol=1e-12)
+    np.testing.assert_allclose(trimmed_mean(values, has_nan=True, proportion=proportion),
+                               trimmed_mean(values, proportion=proportion), rtol=1e-12)
+
+
+def test_invalid_arguments_raise():
+    with pytest.raises(ValueError, match='proportion'):
+        trimmed_mean(random_values(4), proportion=0.5)
+    with pytest.raises(ValueError, match='streaming'):
+        get_statistic('median', streaming=True)
+    with pytest.raises(ValueError, match='unknown statistic'):
+        get_statistic('mode')
+    assert get_statistic('mean', streaming=True) is get_statistic('mean')
@@ -0,0 +1,93 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: test_all_columns.py
+@time: 10/18/26 11:35
+"""
+import csv
+
+import numpy as np
+
+from DataAnalysis import DataAnalysis
+from DataReaderCsv import DataReaderCsv
+from conftest import assert_columns_equal
+
+
+def legacy_all_columns(file_path, control_group):
+    """
+    the per point loop of the first DataAnalysis.generate_all_columns over the dict of DataReaderCsv.all_data, kept
+    as the reference of the vectorized analysis
+    :return: all_columns
+    """
+    all_data = {}
+    group_ranges = {}
+    data_tags = [{}, {}]
+    with open(file_path, 'r') as f:
+        reader = csv.reader(f)
+        for header_row in range(DataReaderCsv.HEADER_ROW_NUM):
+            header = next(reader)[DataReaderCsv.ROW_TAG_NUM:]
+            if header_row == DataReaderCsv.GROUP_TAG_ROW:
+                for i, group_tag in enumerate(header):
+                    group_ranges.setdefault(group_tag, [i + DataReaderCsv.ROW_TAG_NUM, None])[1] = \
+                        i + DataReaderCsv.ROW_TAG_NUM + 1
+        for row in reader:
+            tags = [tag.replace(' ', '') for tag in row[:DataReaderCsv.ROW_TAG_NUM]]
+            for level, tag in zip(data_tags, tags):
+                level[tag] = 1
+            for group_tag, (start, end) in group_ranges.items():
+                all_data['|'.join([group_tag] + tags)] = np.array(row[start:end], dtype=np.float64)
+    all_data_tags = [list(group_ranges), list(data_tags[0]), list(data_tags[1])]
+
+    def get_data(data_tag_list):
+        tag_lists = [all_data_tags[i] if tag.lower() == 'all' else [tag] for i, tag in enumerate(data_tag_list)]
+        return {'|'.join(tags): all_data['|'.join(tags)] for tags in
+                ((group_tag, cell, marker) for group_tag in tag_lists[0] for cell in tag_lists[1]
+                 for marker in tag_lists[2]) if '|'.join(tags) in all_data}
+
+    def one_column_analysis(column_tag_list):
+        data = get_data(column_tag_list)
+        mean_dict = {point: np.mean(values) for point, values in data.items()}
+        sorted_mean_dict = sorted(mean_dict.items(), key=lambda kv: (kv[1], kv[0]), reverse=True)
+        sorted_dict = {}
+        for i, point in enumerate(sorted_mean_dict):
+            percent_from_control = 0
+            if control_group not in point[0]:
+                control_for_point = point[0].replace(point[0].split('|')[0], control_group)
+                control_data = get_data(control_for_point.split('|'))
+                percent_from_control = (np.mean(mean_dict[point[0]]) - np.mean(control_data[control_for_point])) / \
+                    np.mean(control_data[control_for_point])
+            sorted_dict[point[0]] = {'seq': i, 'mean': point[1], 'percent_from_control': percent_from_control}
+        return sorted_dict
+
+    all_columns = {}
+    for combination in [[0, 1], [0, 2], [1, 2]]:
+        for i in all_data_tags[combination[0]]:
+            for j in all_data_tags[combination[1]]:
+                column_tag_list = ['all', 'all', 'all']
+                column_tag_list[combination[0]] = i
+                column_tag_list[combination[1]] = j
+                all_columns['|'.join(column_tag_list)] = one_column_analysis(column_tag_list)
+    return all_columns
+
+
+def test_all_columns_match_the_loop(tie_csv):
+    data_analysis = DataAnalysis('CLP', file_path=tie_csv)
+    data_analysis.generate_all_columns()
+    assert_columns_equal(data_analysis.all_columns, legacy_all_columns(tie_csv, 'CLP'))
+
+
+def test_substring_control_group_gets_zero(tie_csv):
+    data_analysis = DataAnalysis('CLP', file_path=tie_csv)
+    column = data_analysis.one_column_analysis(['all', 'Cell2', 'Marker3'])
+    #  'CLP' is part of 'CLP (HemeV)', the old loop gave every point of that group 0
+    assert column['CLP (HemeV)|Cell2|Marker3']['percent_from_control'] == 0
+    assert column['CLP|Cell2|Marker3']['percent_from_control'] == 0
+    assert column['Naïve|Cell2|Marker3']['percent_from_control'] != 0
+
+
+def test_ties_keep_the_key_order(tie_csv):
+    data_analysis = DataAnalysis('CLP', file_path=tie_csv)
+    column = data_analysis.one_column_analysis(['all', 'Cell2', 'Marker3'])
+    #  Copy has the values of Naïve, the larger key comes first like the reverse sorted keys of the loop
+    assert column['Copy|Cell2|Marker3']['mean'] == column['Naïve|Cell2|Marker3']['mean']
+    assert column['Copy|Cell2|Marker3']['seq'] == column['Naïve|Cell2|Marker3']['seq'] + 1
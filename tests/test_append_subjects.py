@@ -0,0 +1,49 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: test_append_subjects.py
+@time: 10/18/26 11:46
+"""
+import numpy as np
+
+from DataAnalysis import DataAnalysis
+from conftest import assert_columns_equal
+
+PLOT_TYPES = ('seq', 'mean', 'percent_from_control')
+
+
+def all_surfaces(data_analysis):
+    """
+    :return: a dict of (axis, surface name, plot type): surfaced data, for every surface of the data
+    """
+    return {(axis, name, plot_type): np.array(data_analysis.get_surface_data(axis, name, plot_type)[0])
+            for axis in range(len(data_analysis.all_data_tags)) for name in data_analysis.all_data_tags[axis]
+            for plot_type in PLOT_TYPES}
+
+
+def test_append_csv_matches_a_full_rebuild(append_csvs):
+    base_csv, appended_csv, full_csv = append_csvs
+    data_analysis = DataAnalysis(file_path=base_csv)
+    data_analysis.generate_all_columns()
+    data_analysis.append_csv(appended_csv)
+    full_analysis = DataAnalysis(file_path=full_csv)
+    full_analysis.generate_all_columns()
+    assert data_analysis.all_data_tags == full_analysis.all_data_tags
+    assert_columns_equal(data_analysis.all_columns, full_analysis.all_columns)
+    surfaces, full_surfaces = all_surfaces(data_analysis), all_surfaces(full_analysis)
+    for key, surface in surfaces.items():
+        np.testing.assert_allclose(surface, full_surfaces[key], rtol=1e-12, equal_nan=True, err_msg=str(key))
+
+
+def test_append_csv_reports_every_changed_surface(append_csvs):
+    base_csv, appended_csv, _ = append_csvs
+    data_analysis = DataAnalysis(file_path=base_csv)
+    data_analysis.generate_all_columns()
+    before = all_surfaces(data_analysis)
+    stale = set(data_analysis.append_csv(appended_csv))
+    after = all_surfaces(data_analysis)
+    changed = {key for key, surface in after.items()
+               if key not in before or before[key].shape != surface.shape or
+               not np.array_equal(before[key], surface, equal_nan=True)}
+    assert changed
+    assert changed <= stale
@@ -0,0 +1,83 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: test_control_groups.py
+@time: 10/18/26 12:10
+"""
+import numpy as np
+import pytest
+
+from AnalysisCube import AnalysisCube
+from DataAnalysis import DataAnalysis
+from DataReaderCsv import DataReaderCsv
+from MarkerCorrelation import MarkerCorrelation
+from Significance import Significance
+from SubjectAnalysis import SubjectAnalysis
+from benchmark.SyntheticCsv import write_synthetic_csv
+
+GROUP_NUM = AnalysisCube.CONTROL_CACHE_SIZE + 4
+
+
+@pytest.fixture
+def many_groups_csv(tmp_path):
+    file_path = str(tmp_path / 'groups.csv')
+    write_synthetic_csv(file_path, group_num=GROUP_NUM, subjects_per_group=2, cell_num=3, marker_num=4, seed=7)
+    return file_path
+
+
+def test_unknown_control_group_raises(many_groups_csv):
+    with pytest.raises(ValueError, match='Naive'):
+        DataAnalysis('Naive', file_path=many_groups_csv)
+    data_analysis = DataAnalysis(file_path=many_groups_csv)
+    with pytest.raises(ValueError, match='Naive'):
+        data_analysis.get_surface_data(0, 'Group 1', 'percent_from_control', control_group='Naive')
+    assert 'Naive' not in data_analysis.get_analysis_cube()._percent_from_control
+
+
+def test_control_group_sweep_is_bounded(many_groups_csv):
+    data_analysis = DataAnalysis(file_path=many_groups_csv)
+    group_list = data_analysis.data_reader.group_list
+    surfaces = {control_group: np.array(data_analysis.get_surface_data(0, 'Naïve', 'percent_from_control',
+                                                                       control_group=control_group)[0])
+                for control_group in group_list}
+    analysis_cube = data_analysis.get_analysis_cube()
+    assert len(analysis_cube._percent_from_control) == AnalysisCube.CONTROL_CACHE_SIZE + 1
+    assert 'Naïve' in analysis_cube._percent_from_control
+    #  an evicted control group gives the same surface when it is computed again
+    data_analysis.surface_cache.clear()
+    for control_group in group_list:
+        np.testing.assert_array_equal(data_analysis.get_surface_data(0, 'Naïve', 'percent_from_control',
+                                                                     control_group=control_group)[0],
+                                      surfaces[control_group])
+
+
+def test_append_to_an_evicted_control_group(many_groups_csv):
+    data_analysis = DataAnalysis(file_path=many_groups_csv)
+    group_list = list(data_analysis.data_reader.group_list)
+    for control_group in group_list:
+        data_analysis.get_surface_data(0, 'Naïve', 'percent_from_control', control_group=control_group)
+    assert 'Group 1' not in data_analysis.get_analysis_cube()._percent_from_control
+    values = np.random.default_rng(7).uniform(1, 10, data_analysis.data_reader.data_mask.shape + (2,))
+    stale = data_analysis.append_subjects('Group 1', values)
+    assert (0, 'Naïve', 'percent_from_control') in stale
+    fresh = AnalysisCube.from_reader(data_analysis.data_reader, data_analysis.all_data_tags, 'Naïve')
+    np.testing.assert_allclose(data_analysis.get_surface_data(0, 'Naïve', 'percent_from_control',
+                                                              control_group='Group 1')[0],
+                               fresh.surface(0, 'Naïve', 'percent_from_control', 'Group 1'), rtol=1e-12)
+
+
+@pytest.mark.parametrize('analysis_class', [MarkerCorrelation, Significance, SubjectAnalysis])
+def test_raw_data_analyses_share_the_guards(many_groups_csv, analysis_class):
+    with pytest.raises(ValueError, match='Naive'):
+        analysis_class(DataReaderCsv(many_groups_csv), 'Naive')
+    with pytest.raises(ValueError, match='streaming'):
+        analysis_class(DataReaderCsv(many_groups_csv, streaming=True), 'Naïve')
+
+
+def test_surfaces_reject_fixed_tags_without_a_level(many_groups_csv):
+    data_reader = DataReaderCsv(many_groups_csv)
+    assert data_reader.fixed_tag_index(None) == ()
+    with pytest.raises(ValueError, match='axes 3 to 2'):
+        SubjectAnalysis(data_reader, 'Naïve').surface('Cell0', fixed_tags={3: 'Spleen'})
+    with pytest.raises(ValueError, match='axes 3 to 2'):
+        MarkerCorrelation(data_reader, 'Naïve').surface('Naïve', 'Cell0', fixed_tags={3: 'Spleen'})
@@ -0,0 +1,74 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: test_csv_cache.py
+@time: 10/18/26 11:50
+"""
+import json
+import os
+
+import numpy as np
+import pytest
+
+from DataReaderCsv import DataReaderCsv
+from benchmark.SyntheticCsv import write_synthetic_csv
+from conftest import read_rows, write_rows
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    file_path = str(tmp_path / 'cached.csv')
+    write_synthetic_csv(file_path, group_num=3, subjects_per_group=3, cell_num=3, marker_num=4, seed=4)
+    return file_path
+
+
+def move_mtime(file_path, seconds=10):
+    """
+    move the mtime of the file forward, a coarse filesystem clock could otherwise keep the old one
+    """
+    stat = os.stat(file_path)
+    os.utime(file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + seconds * 10 ** 9))
+
+
+def test_second_load_memory_maps_the_cache(csv_path):
+    parsed = DataReaderCsv(csv_path)
+    assert parsed.cached and not isinstance(parsed.data, np.memmap)
+    loaded = DataReaderCsv(csv_path)
+    assert loaded.cached and isinstance(loaded.data, np.memmap)
+    np.testing.assert_array_equal(loaded.data, parsed.data)
+    assert loaded.group_list == parsed.group_list and loaded.subject_list == parsed.subject_list
+    assert loaded.data_tag_lists == parsed.data_tag_lists
+
+
+def test_same_size_edit_is_parsed_again(csv_path):
+    DataReaderCsv(csv_path)
+    rows = read_rows(csv_path)
+    first_value = rows[DataReaderCsv.HEADER_ROW_NUM][DataReaderCsv.ROW_TAG_NUM]
+    #  one digit changes, the size of the file stays the same
+    rows[DataReaderCsv.HEADER_ROW_NUM][DataReaderCsv.ROW_TAG_NUM] = \
+        ('1' if first_value[0] != '1' else '2') + first_value[1:]
+    size = os.path.getsize(csv_path)
+    write_rows(csv_path, rows)
+    move_mtime(csv_path)
+    assert os.path.getsize(csv_path) == size
+    data_reader = DataReaderCsv(csv_path)
+    assert not isinstance(data_reader.data, np.memmap)
+    assert data_reader.data[(0,) * DataReaderCsv.ROW_TAG_NUM + (0,)] == \
+        float(rows[DataReaderCsv.HEADER_ROW_NUM][DataReaderCsv.ROW_TAG_NUM])
+
+
+def test_touch_reuses_the_cache(csv_path):
+    DataReaderCsv(csv_path)
+    move_mtime(csv_path)
+    data_reader = DataReaderCsv(csv_path)
+    assert data_reader.cached and isinstance(data_reader.data, np.memmap)
+    with open(data_reader.cache_paths()[1], 'r') as f:
+        assert json.load(f)['mtime_ns'] == os.stat(csv_path).st_mtime_ns
+
+
+def test_cache_of_another_row_tag_num_is_ignored(csv_path):
+    DataReaderCsv(csv_path, row_tag_num=3)
+    data_reader = DataReaderCsv(csv_path)
+    assert not isinstance(data_reader.data, np.memmap)
+    assert data_reader.data.ndim == DataReaderCsv.ROW_TAG_NUM + 1
+    assert len(data_reader.subject_list) == 9
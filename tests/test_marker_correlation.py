@@ -0,0 +1,54 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: test_marker_correlation.py
+@time: 10/18/26 12:30
+"""
+import numpy as np
+import pytest
+
+from DataReaderCsv import DataReaderCsv
+from MarkerCorrelation import MarkerCorrelation, average_ranks
+from benchmark.SyntheticCsv import write_synthetic_csv
+
+
+def reference_ranks(row):
+    """
+    average ranks of one row written out: values below + (tied values + 1) / 2, over the valid values only
+    """
+    ranks = np.full(len(row), np.nan)
+    valid = row[~np.isnan(row)]
+    for i, value in enumerate(row):
+        if not np.isnan(value):
+            ranks[i] = np.count_nonzero(valid < value) + (np.count_nonzero(valid == value) + 1) / 2
+    return ranks
+
+
+@pytest.mark.parametrize('subject_num', [1, 2, 9, 50])
+@pytest.mark.parametrize('nan_fraction', [0.0, 0.3])
+def test_average_ranks_match_reference(subject_num, nan_fraction):
+    rng = np.random.default_rng(subject_num)
+    #  few distinct values, so most rows have ties
+    values = rng.integers(0, 5, (3, 4, subject_num)).astype(np.float64)
+    values[rng.uniform(0, 1, values.shape) < nan_fraction] = np.nan
+    ranks = average_ranks(values)
+    for index in np.ndindex(values.shape[:-1]):
+        np.testing.assert_array_equal(ranks[index], reference_ranks(values[index]))
+
+
+def test_average_ranks_of_empty_rows():
+    assert average_ranks(np.empty((2, 0))).shape == (2, 0)
+    assert np.isnan(average_ranks(np.full((1, 3), np.nan))).all()
+
+
+def test_spearman_is_pearson_of_ranks(tmp_path):
+    file_path = str(tmp_path / 'correlation.csv')
+    write_synthetic_csv(file_path, group_num=2, subjects_per_group=12, cell_num=2, marker_num=5, seed=11)
+    data_reader = DataReaderCsv(file_path, use_cache=False)
+    marker_correlation = MarkerCorrelation(data_reader, 'Naïve')
+    spearman = marker_correlation.correlation('spearman')
+    for group_index, group_tag in enumerate(data_reader.group_list):
+        for cell_index in range(len(data_reader.data_tag_lists[0])):
+            values = data_reader.data[cell_index][:, data_reader.group_slices[group_tag]]
+            ranks = np.stack([reference_ranks(row) for row in values])
+            np.testing.assert_allclose(spearman[group_index, cell_index], np.corrcoef(ranks), rtol=1e-10)
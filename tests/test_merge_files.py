@@ -0,0 +1,71 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: test_merge_files.py
+@time: 10/18/26 12:00
+"""
+import numpy as np
+import pytest
+
+from DataReaderCsv import DataReaderCsv
+from benchmark.SyntheticCsv import write_synthetic_csv
+from conftest import group_columns, read_rows, write_rows
+
+
+@pytest.fixture
+def batch_csvs(tmp_path):
+    """
+    one synthetic csv split into two batch files by subject columns, Group 1 has subjects in both, the second file
+    misses the Cell 0 Marker 0 row
+    :return: the source csv, the two batch files
+    """
+    source = str(tmp_path / 'source.csv')
+    write_synthetic_csv(source, group_num=3, subjects_per_group=4, cell_num=3, marker_num=4, seed=6)
+    rows = read_rows(source)
+    tag_columns = list(range(DataReaderCsv.ROW_TAG_NUM))
+    naive, group_1, group_2 = (group_columns(rows, group_tag) for group_tag in ('Naïve', 'Group 1', 'Group 2'))
+    first = [[row[i] for i in tag_columns + naive + group_1[:2]] for row in rows]
+    second = [[row[i] for i in tag_columns + group_1[2:] + group_2] for row in rows]
+    del second[DataReaderCsv.HEADER_ROW_NUM]
+    paths = [str(tmp_path / 'batch_1.csv'), str(tmp_path / 'batch_2.csv')]
+    write_rows(paths[0], first)
+    write_rows(paths[1], second)
+    return source, paths
+
+
+def test_groups_are_contiguous_in_file_order(batch_csvs):
+    source, paths = batch_csvs
+    merged = DataReaderCsv(paths, max_workers=2)
+    single = DataReaderCsv(source, use_cache=False)
+    assert merged.group_list == ['Naïve', 'Group 1', 'Group 2']
+    assert merged.group_slices == single.group_slices
+    #  the Group 1 subjects of the first file come before those of the second file
+    assert merged.subject_list == single.subject_list
+
+
+def test_missing_row_is_nan(batch_csvs):
+    source, paths = batch_csvs
+    merged = DataReaderCsv(paths, max_workers=2)
+    single = DataReaderCsv(source, use_cache=False)
+    assert merged.partial_rows and not single.partial_rows
+    assert merged.data_mask.all()
+    missing = np.isnan(merged.data)
+    #  only the subjects of the second file miss the first row
+    second_subjects = np.zeros(len(merged.subject_list), dtype=bool)
+    second_subjects[6:] = True
+    expected = np.zeros(merged.data.shape, dtype=bool)
+    expected[0, 0] = second_subjects
+    np.testing.assert_array_equal(missing, expected)
+    np.testing.assert_array_equal(merged.data[~missing], single.data[~missing])
+    #  the means of the missing row are over the subjects of the first file
+    np.testing.assert_allclose(merged.group_means()[1, 0, 0], single.data[0, 0, 4:6].mean(), rtol=1e-12)
+
+
+def test_streaming_merge_matches_dense_merge(batch_csvs):
+    _, paths = batch_csvs
+    dense = DataReaderCsv(paths, max_workers=2)
+    streamed = DataReaderCsv(paths, streaming=True, chunk_size=2, max_workers=2)
+    assert streamed.group_list == dense.group_list
+    assert streamed.data_tag_lists == dense.data_tag_lists
+    np.testing.assert_array_equal(streamed.data_mask, dense.data_mask)
+    np.testing.assert_allclose(streamed.group_means(), dense.group_means(), rtol=1e-12)
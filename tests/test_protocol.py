@@ -0,0 +1,65 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: test_protocol.py
+@time: 10/18/26 11:36
+"""
+import numpy as np
+import pytest
+
+from AnalysisProtocol import FRAME, from_wire, pack_message, to_wire, unpack_message
+from AnalysisServer import AnalysisServer
+from DataAnalysis import DataAnalysis
+from DataReaderCsv import DataReaderCsv
+from benchmark.SyntheticCsv import write_synthetic_csv
+from conftest import group_columns, read_rows, write_rows
+
+
+def decode(message):
+    """
+    :return: the result of a response message, like AnalysisClient.request
+    """
+    header_size, _ = FRAME.unpack(message[:FRAME.size])
+    header, buffers = unpack_message(message[FRAME.size:FRAME.size + header_size],
+                                     message[FRAME.size + header_size:])
+    return from_wire(header['result'], buffers)
+
+
+def round_trip(result, binary):
+    """
+    :return: the result after to_wire, one message and from_wire, like a response of AnalysisServer
+    """
+    buffers = [] if binary else None
+    return decode(pack_message({'result': to_wire(result, buffers)}, buffers or ()))
+
+
+@pytest.mark.parametrize('binary', [True, False])
+def test_non_finite_floats_round_trip(binary):
+    values = np.array([[1.5, np.inf], [-np.inf, np.nan]])
+    result = round_trip({'array': values, 'scalars': [np.float64(np.inf), -np.inf, np.nan, 2.0],
+                         'point': {'mean': np.float64(np.nan), 'percent_from_control': np.float64(-np.inf)}}, binary)
+    np.testing.assert_array_equal(result['array'], values)
+    assert result['array'].dtype == values.dtype
+    assert result['scalars'][:2] == [np.inf, -np.inf]
+    assert np.isnan(result['scalars'][2]) and result['scalars'][3] == 2.0
+    assert np.isnan(result['point']['mean'])
+    assert result['point']['percent_from_control'] == -np.inf
+
+
+@pytest.mark.parametrize('binary', [True, False])
+def test_zero_control_mean_is_answered(tmp_path, binary):
+    file_path = str(tmp_path / 'zero.csv')
+    write_synthetic_csv(file_path, group_num=3, subjects_per_group=3, cell_num=3, marker_num=4, seed=3)
+    rows = read_rows(file_path)
+    #  the control group mean of Cell 0 Marker 0 is 0, percent_from_control is ±inf there
+    for i in group_columns(rows, 'Naïve'):
+        rows[DataReaderCsv.HEADER_ROW_NUM][i] = '0'
+    write_rows(file_path, rows)
+    data_analysis = DataAnalysis(file_path=file_path)
+    for method, args, kwargs in (('one_column_analysis', [['all', 'Cell0', 'Marker0']], {}),
+                                 ('get_surface_data', [1, 'Cell0', 'percent_from_control'], {})):
+        result = decode(AnalysisServer.call(data_analysis, method, args, kwargs, binary))
+        if method == 'one_column_analysis':
+            assert result['Group 1|Cell0|Marker0']['percent_from_control'] == np.inf
+        else:
+            np.testing.assert_array_equal(result[0], data_analysis.get_surface_data(*args)[0])
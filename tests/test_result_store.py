@@ -0,0 +1,67 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: test_result_store.py
+@time: 10/18/26 12:20
+"""
+import numpy as np
+import pytest
+
+from DataAnalysis import DataAnalysis
+from ResultStore import ResultStore
+from benchmark.SyntheticCsv import write_synthetic_csv
+
+CONTROL_GROUPS = ['Naïve', 'Group 2', 'Group 1']
+
+
+@pytest.fixture
+def exported(tmp_path):
+    """
+    :return: the analysis and a result store of its export with several control groups and the point stats
+    """
+    file_path = str(tmp_path / 'store.csv')
+    write_synthetic_csv(file_path, group_num=4, subjects_per_group=3, cell_num=4, marker_num=5, seed=10,
+                        missing_fraction=0.2)
+    data_analysis = DataAnalysis(file_path=file_path)
+    data_analysis.get_significance(resample_num=30, seed=1)
+    data_analysis.export_results(str(tmp_path / 'results'), CONTROL_GROUPS)
+    return data_analysis, ResultStore(str(tmp_path / 'results'))
+
+
+def assert_surfaces_equal(result_store, data_analysis, all_data_tag_index, surface_name, plot_type,
+                          control_group=None):
+    stored = result_store.get_surface_data(all_data_tag_index, surface_name, plot_type, control_group)
+    expected = data_analysis.get_surface_data(all_data_tag_index, surface_name, plot_type, control_group)
+    np.testing.assert_array_equal(stored[0], expected[0])
+    assert list(stored[1]) == list(expected[1]) and list(stored[2]) == list(expected[2])
+
+
+def test_manifest(exported):
+    data_analysis, result_store = exported
+    assert result_store.control_groups == CONTROL_GROUPS
+    assert result_store.control_group == data_analysis.CONTROL_GROUP
+    assert result_store.all_data_tags == data_analysis.all_data_tags
+    assert result_store.statistic == data_analysis.statistic
+
+
+@pytest.mark.parametrize('plot_type', ['seq', 'mean', 'q_value', 'p_value', 'ci_low', 'ci_high'])
+def test_surfaces_match_the_analysis(exported, plot_type):
+    data_analysis, result_store = exported
+    for all_data_tag_index, all_data_tag in enumerate(data_analysis.all_data_tags):
+        for surface_name in all_data_tag:
+            assert_surfaces_equal(result_store, data_analysis, all_data_tag_index, surface_name, plot_type)
+
+
+@pytest.mark.parametrize('control_group', CONTROL_GROUPS + [None])
+def test_percent_from_control_matches_the_analysis(exported, control_group):
+    data_analysis, result_store = exported
+    for all_data_tag_index, all_data_tag in enumerate(data_analysis.all_data_tags):
+        for surface_name in all_data_tag:
+            assert_surfaces_equal(result_store, data_analysis, all_data_tag_index, surface_name,
+                                  'percent_from_control', control_group)
+
+
+def test_control_group_not_exported_raises(exported):
+    _, result_store = exported
+    with pytest.raises(ValueError, match='Group 3'):
+        result_store.get_surface_data(0, 'Naïve', 'percent_from_control', 'Group 3')
@@ -0,0 +1,92 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: test_significance.py
+@time: 10/18/26 12:15
+"""
+import numpy as np
+import pytest
+
+from DataReaderCsv import DataReaderCsv
+from Significance import Significance, adjust_p_values
+from benchmark.SyntheticCsv import write_synthetic_csv
+
+RESAMPLE_NUM = 50
+
+
+@pytest.fixture
+def data_reader(tmp_path):
+    file_path = str(tmp_path / 'significance.csv')
+    write_synthetic_csv(file_path, group_num=3, subjects_per_group=4, cell_num=3, marker_num=6, seed=8,
+                        missing_fraction=0.1)
+    return DataReaderCsv(file_path, use_cache=False)
+
+
+def assert_results_equal(result, expected, rtol=0.0):
+    assert result.keys() == expected.keys()
+    for name in expected:
+        np.testing.assert_allclose(result[name], expected[name], rtol=rtol, atol=1e-12 if rtol else 0)
+
+
+def reference_bh(p_values):
+    """
+    benjamini-hochberg written out: p * n / rank, then the running minimum from the largest p value down
+    """
+    p_values = np.asarray(p_values, dtype=np.float64)
+    order = np.argsort(p_values)
+    n = len(p_values)
+    q_values = np.empty(n)
+    running = 1.0
+    for rank in range(n, 0, -1):
+        index = order[rank - 1]
+        running = min(running, p_values[index] * n / rank)
+        q_values[index] = running
+    return q_values
+
+
+def test_same_seed_gives_same_result(data_reader):
+    first = Significance(data_reader, 'Naïve', resample_num=RESAMPLE_NUM, seed=3).run()
+    second = Significance(data_reader, 'Naïve', resample_num=RESAMPLE_NUM, seed=3).run()
+    assert_results_equal(second, first)
+    other = Significance(data_reader, 'Naïve', resample_num=RESAMPLE_NUM, seed=4).run()
+    tested = ~np.isnan(first['p_value'])
+    tested[data_reader.group_index['Naïve']] = False
+    assert not np.array_equal(other['ci_low'][tested], first['ci_low'][tested])
+
+
+@pytest.mark.parametrize('max_workers', [None, 2])
+def test_blocks_match_a_single_block(data_reader, monkeypatch, max_workers):
+    single = Significance(data_reader, 'Naïve', resample_num=RESAMPLE_NUM, seed=3).run()
+    #  one marker per block
+    monkeypatch.setattr(Significance, 'BATCH_SIZE', 1)
+    blocked = Significance(data_reader, 'Naïve', resample_num=RESAMPLE_NUM, seed=3, max_workers=max_workers).run()
+    assert_results_equal(blocked, single, rtol=1e-12)
+
+
+def test_control_group_is_not_tested(data_reader):
+    result = Significance(data_reader, 'Naïve', resample_num=RESAMPLE_NUM, seed=3).run()
+    control = data_reader.group_index['Naïve']
+    valid = data_reader.data_mask
+    np.testing.assert_array_equal(result['p_value'][control][valid], 1)
+    np.testing.assert_array_equal(result['ci_low'][control][valid], 0)
+    assert np.isnan(result['p_value'][control][~valid]).all()
+
+
+def test_bh_matches_reference():
+    p_values = np.random.default_rng(9).uniform(0, 0.2, 40)
+    p_values[[3, 7]] = p_values[5]  # ties
+    np.testing.assert_allclose(adjust_p_values(p_values, 'bh'), reference_bh(p_values), rtol=1e-12)
+    #  nan is not tested and does not count in n
+    with_nan = np.concatenate([p_values, [np.nan, np.nan]]).reshape(6, 7)
+    q_values = adjust_p_values(with_nan, 'bh')
+    assert np.isnan(q_values.ravel()[-2:]).all()
+    np.testing.assert_allclose(q_values.ravel()[:-2], reference_bh(p_values), rtol=1e-12)
+    np.testing.assert_allclose(adjust_p_values(p_values, 'bonferroni'), np.minimum(p_values * 40, 1), rtol=1e-12)
+    assert adjust_p_values([0.9, 0.95], 'bh').max() <= 1
+
+
+def test_unknown_correction_raises(data_reader):
+    with pytest.raises(ValueError, match='holm'):
+        adjust_p_values([0.1], 'holm')
+    with pytest.raises(ValueError, match='holm'):
+        Significance(data_reader, 'Naïve', correction='holm')
@@ -0,0 +1,65 @@
+# Copyright (c) 2023.
+# -*-coding:utf-8 -*-
+"""
+@file: test_streaming.py
+@time: 10/18/26 11:55
+"""
+import numpy as np
+import pytest
+
+from AnalysisCube import AnalysisCube
+from DataAnalysis import DataAnalysis
+from DataReaderCsv import DataReaderCsv
+from benchmark.SyntheticCsv import write_synthetic_csv
+from conftest import assert_columns_equal, read_rows, write_rows
+
+
+@pytest.fixture
+def shuffled_csv(tmp_path):
+    """
+    a synthetic csv with missing rows in shuffled order, so the tags show up in another order than parse_csv
+    indexes them and new tags keep showing up in later chunks
+    """
+    file_path = str(tmp_path / 'shuffled.csv')
+    write_synthetic_csv(file_path, group_num=3, subjects_per_group=4, cell_num=6, marker_num=7, seed=5,
+                        missing_fraction=0.2)
+    rows = read_rows(file_path)
+    data_rows = rows[DataReaderCsv.HEADER_ROW_NUM:]
+    np.random.default_rng(5).shuffle(data_rows)
+    write_rows(file_path, rows[:DataReaderCsv.HEADER_ROW_NUM] + data_rows)
+    return file_path
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 10000])
+def test_streaming_matches_dense(shuffled_csv, chunk_size):
+    dense = DataReaderCsv(shuffled_csv, use_cache=False)
+    streamed = DataReaderCsv(shuffled_csv, streaming=True, chunk_size=chunk_size)
+    assert streamed.data is None
+    assert streamed.data_tag_lists == dense.data_tag_lists
+    np.testing.assert_array_equal(streamed.data_mask, dense.data_mask)
+    np.testing.assert_allclose(streamed.group_means(), dense.group_means(), rtol=1e-12)
+    data_analysis = DataAnalysis(file_path=shuffled_csv)
+    data_analysis.generate_all_columns()
+    streamed_cube = AnalysisCube.from_reader(streamed, [streamed.group_list] + streamed.data_tag_lists,
+                                             data_analysis.CONTROL_GROUP)
+    assert_columns_equal(streamed_cube.all_columns(), data_analysis.all_columns)
+
+
+def test_streaming_pools_repeated_rows(shuffled_csv):
+    rows = read_rows(shuffled_csv)
+    repeated = list(rows[DataReaderCsv.HEADER_ROW_NUM])
+    repeated[DataReaderCsv.ROW_TAG_NUM:] = [str(float(value) + 1) for value in repeated[DataReaderCsv.ROW_TAG_NUM:]]
+    write_rows(shuffled_csv, rows + [repeated])
+    streamed = DataReaderCsv(shuffled_csv, streaming=True, chunk_size=2)
+    dense = DataReaderCsv(shuffled_csv, use_cache=False)
+    point = tuple(data_tag_index[tag.replace(' ', '')] for data_tag_index, tag in
+                  zip(streamed.data_tag_indexes, repeated[:DataReaderCsv.ROW_TAG_NUM]))
+    first_values = np.array(rows[DataReaderCsv.HEADER_ROW_NUM][DataReaderCsv.ROW_TAG_NUM:], dtype=np.float64)
+    repeated_values = np.array(repeated[DataReaderCsv.ROW_TAG_NUM:], dtype=np.float64)
+    for group_index, group_tag in enumerate(streamed.group_list):
+        group_slice = streamed.group_slices[group_tag]
+        #  streaming pools both rows into the point, the dense array keeps the last row
+        pooled = np.concatenate([first_values[group_slice], repeated_values[group_slice]]).mean()
+        np.testing.assert_allclose(streamed.group_means()[(group_index,) + point], pooled, rtol=1e-12)
+        np.testing.assert_allclose(dense.group_means()[(group_index,) + point], repeated_values[group_slice].mean(),
+                                   rtol=1e-12)